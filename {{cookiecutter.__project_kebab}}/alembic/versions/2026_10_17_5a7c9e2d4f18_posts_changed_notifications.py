@@ -0,0 +1,45 @@
+"""posts changed notifications
+
+Revision ID: 5a7c9e2d4f18
+Revises: 8d21b6f4c0e3
+Create Date: 2026-10-17 14:05:52.880413
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5a7c9e2d4f18"
+down_revision: Union[str, None] = "8d21b6f4c0e3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Notifies listeners (see storage.post_cache) about the id of every updated
+    # or deleted post. Notifications are sent on commit, duplicates within
+    # one transaction are collapsed by postgres.
+    op.execute(
+        """
+        CREATE FUNCTION notify_posts_changed() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('posts_changed', OLD.id::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER posts_changed
+        AFTER UPDATE OR DELETE ON posts
+        FOR EACH ROW EXECUTE FUNCTION notify_posts_changed()
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER posts_changed ON posts")
+    op.execute("DROP FUNCTION notify_posts_changed()")
@@ -0,0 +1,42 @@
+"""posts client key
+
+Revision ID: 8d21b6f4c0e3
+Revises: 3c5e1f0a9b27
+Create Date: 2026-10-17 11:40:03.218774
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "8d21b6f4c0e3"
+down_revision: Union[str, None] = "3c5e1f0a9b27"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("posts", sa.Column("client_key", sa.String(), nullable=True))
+    # CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_posts_client_key"),
+            "posts",
+            ["client_key"],
+            unique=True,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            op.f("ix_posts_client_key"),
+            table_name="posts",
+            postgresql_concurrently=True,
+        )
+    op.drop_column("posts", "client_key")
@@ -0,0 +1,53 @@
+"""comments post_id id index
+
+Revision ID: a8e2c4f60d19
+Revises: f3a9b1c7d245
+Create Date: 2026-10-17 23:12:05.604219
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "a8e2c4f60d19"
+down_revision: Union[str, None] = "f3a9b1c7d245"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The first comments of a post are read in id order from the index,
+    # see PostRepo.view_posts_with_comments. It still serves the foreign
+    # key checks of deleted posts, so it replaces ix_comments_post_id.
+    # CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_comments_post_id_id",
+            "comments",
+            ["post_id", "id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_comments_post_id",
+            table_name="comments",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_comments_post_id",
+            "comments",
+            ["post_id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_comments_post_id_id",
+            table_name="comments",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,49 @@
+"""posts keyset index include updated_at
+
+Revision ID: b4f0d2a7c913
+Revises: 5a7c9e2d4f18
+Create Date: 2026-10-17 16:21:08.447215
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "b4f0d2a7c913"
+down_revision: Union[str, None] = "5a7c9e2d4f18"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _replace_keyset_index(include: list[str]) -> None:
+    # The new index is built next to the old one, so that pagination
+    # never runs without an index
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_posts_created_at_id_new",
+            "posts",
+            ["created_at", "id"],
+            unique=False,
+            postgresql_include=include,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_posts_created_at_id",
+            table_name="posts",
+            postgresql_concurrently=True,
+        )
+        op.execute(
+            "ALTER INDEX ix_posts_created_at_id_new RENAME TO ix_posts_created_at_id"
+        )
+
+
+def upgrade() -> None:
+    # ETags of pages of posts (see PostRepo.view_posts_versions)
+    # are looked up with an index-only scan
+    _replace_keyset_index(["updated_at"])
+
+
+def downgrade() -> None:
+    _replace_keyset_index([])
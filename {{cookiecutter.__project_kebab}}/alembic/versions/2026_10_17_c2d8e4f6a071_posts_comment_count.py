@@ -0,0 +1,108 @@
+"""posts comment count
+
+Revision ID: c2d8e4f6a071
+Revises: e7a3c1d95b60
+Create Date: 2026-10-17 19:02:44.160387
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c2d8e4f6a071"
+down_revision: Union[str, None] = "e7a3c1d95b60"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Counts of the existing posts start at 0 and are filled in by
+    # the reconcile-comment-counts command, in batches of posts,
+    # instead of a single UPDATE locking every post
+    op.add_column(
+        "posts",
+        sa.Column("comment_count", sa.Integer(), server_default="0", nullable=False),
+    )
+    # Leaves room for HOT updates of the counts, in the pages written from now
+    op.execute("ALTER TABLE posts SET (fillfactor = 90)")
+    # Statement-level triggers update every post once per statement,
+    # e.g. once for all the comments of PostRepo.create_comments_bulk
+    op.execute(
+        """
+        CREATE FUNCTION count_inserted_comments() RETURNS trigger AS $$
+        BEGIN
+            UPDATE posts SET comment_count = posts.comment_count + inserted.count
+            FROM (
+                SELECT post_id, count(*) AS count FROM new_comments GROUP BY post_id
+            ) AS inserted
+            WHERE posts.id = inserted.post_id;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER comments_inserted
+        AFTER INSERT ON comments
+        REFERENCING NEW TABLE AS new_comments
+        FOR EACH STATEMENT EXECUTE FUNCTION count_inserted_comments()
+        """
+    )
+    op.execute(
+        """
+        CREATE FUNCTION count_deleted_comments() RETURNS trigger AS $$
+        BEGIN
+            UPDATE posts SET comment_count = posts.comment_count - deleted.count
+            FROM (
+                SELECT post_id, count(*) AS count FROM old_comments GROUP BY post_id
+            ) AS deleted
+            WHERE posts.id = deleted.post_id;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER comments_deleted
+        AFTER DELETE ON comments
+        REFERENCING OLD TABLE AS old_comments
+        FOR EACH STATEMENT EXECUTE FUNCTION count_deleted_comments()
+        """
+    )
+    # Comments moved to another post, rare enough for a row-level trigger
+    op.execute(
+        """
+        CREATE FUNCTION count_moved_comment() RETURNS trigger AS $$
+        BEGIN
+            UPDATE posts SET comment_count = comment_count - 1 WHERE id = OLD.post_id;
+            UPDATE posts SET comment_count = comment_count + 1 WHERE id = NEW.post_id;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER comments_moved
+        AFTER UPDATE OF post_id ON comments
+        FOR EACH ROW WHEN (OLD.post_id IS DISTINCT FROM NEW.post_id)
+        EXECUTE FUNCTION count_moved_comment()
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER comments_moved ON comments")
+    op.execute("DROP FUNCTION count_moved_comment()")
+    op.execute("DROP TRIGGER comments_deleted ON comments")
+    op.execute("DROP FUNCTION count_deleted_comments()")
+    op.execute("DROP TRIGGER comments_inserted ON comments")
+    op.execute("DROP FUNCTION count_inserted_comments()")
+    op.drop_column("posts", "comment_count")
+    op.execute("ALTER TABLE posts RESET (fillfactor)")
@@ -0,0 +1,39 @@
+"""comments post_id index
+
+Revision ID: e7a3c1d95b60
+Revises: b4f0d2a7c913
+Create Date: 2026-10-17 17:48:30.915502
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e7a3c1d95b60"
+down_revision: Union[str, None] = "b4f0d2a7c913"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Postgres does not index the referencing side of a foreign key.
+    # CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_comments_post_id"),
+            "comments",
+            ["post_id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            op.f("ix_comments_post_id"),
+            table_name="comments",
+            postgresql_concurrently=True,
+        )
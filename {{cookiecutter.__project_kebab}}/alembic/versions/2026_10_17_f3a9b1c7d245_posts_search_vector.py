@@ -0,0 +1,58 @@
+"""posts search vector
+
+Revision ID: f3a9b1c7d245
+Revises: c2d8e4f6a071
+Create Date: 2026-10-17 21:46:12.538104
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "f3a9b1c7d245"
+down_revision: Union[str, None] = "c2d8e4f6a071"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Adding a stored generated column rewrites the table under an
+    # ACCESS EXCLUSIVE lock, on a large table run it in a quiet period
+    op.add_column(
+        "posts",
+        sa.Column(
+            "search_vector",
+            postgresql.TSVECTOR(),
+            sa.Computed(
+                "setweight(to_tsvector('english', title), 'A') || "
+                "setweight(to_tsvector('english', main_content), 'B')",
+                persisted=True,
+            ),
+            nullable=False,
+        ),
+    )
+    # CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_posts_search_vector"),
+            "posts",
+            ["search_vector"],
+            unique=False,
+            postgresql_using="gin",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            op.f("ix_posts_search_vector"),
+            table_name="posts",
+            postgresql_concurrently=True,
+        )
+    op.drop_column("posts", "search_vector")
@@ -0,0 +1,206 @@
+"""
+Admission control
+
+Limits the number of requests in flight, so that under a traffic spike
+excess requests are rejected right away with 503 and Retry-After
+instead of all requests queueing for database connections until they time out.
+
+Requests of API sections with a lower Priority (see api.spec.make_router)
+may use only a share of the limit, so they are rejected first.
+"""
+
+import time
+from typing import Callable, Iterable
+
+from fastapi.routing import APIRoute
+from prometheus_client import Counter, Gauge
+from starlette.routing import BaseRoute, Match
+from starlette.types import Message, Receive, Scope, Send, ASGIApp
+
+from {{cookiecutter.__project_slug}}.api.spec import (
+    PRIORITY_EXTENSION,
+    OverloadedError,
+    Priority,
+    UserError,
+)
+
+# Share of the limit that requests of each priority may occupy
+PRIORITY_SHARES = {
+    Priority.LOW: 0.5,
+    Priority.NORMAL: 0.9,
+    Priority.HIGH: 1.0,
+}
+
+ADMISSION_LIMIT = Gauge(
+    "admission_limit",
+    "Max number of requests in flight",
+    multiprocess_mode="livesum",
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight",
+    "Admitted requests in flight",
+    multiprocess_mode="livesum",
+)
+ADMISSION_REJECTED = Counter(
+    "admission_rejected",
+    "Requests rejected because too many requests were in flight",
+    ["priority"],
+)
+
+
+class ConcurrencyLimit:
+    """
+    Limit of requests in flight, fixed at `max_in_flight` or adaptive.
+
+    The adaptive limit follows AIMD (additive increase, multiplicative decrease)
+    on the latency until the response starts: it shrinks by `backoff` when
+    a response takes longer than `target_latency` seconds, at most once per
+    `target_latency`, and grows by one per `limit` fast responses while
+    the limit is in use. It stays between `min_in_flight` and `max_in_flight`.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        adaptive: bool = False,
+        min_in_flight: int = 1,
+        target_latency: float = 0.5,
+        backoff: float = 0.9,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        assert 0 < min_in_flight <= max_in_flight
+        self.max_in_flight = max_in_flight
+        self.adaptive = adaptive
+        self.min_in_flight = min_in_flight
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self._clock = clock
+        self.limit = float(max_in_flight)
+        self.in_flight = 0
+        self._decreased_at = float("-inf")
+        self._update_gauges()
+
+    def try_acquire(self, priority: Priority) -> bool:
+        if self.in_flight >= self.limit * PRIORITY_SHARES[priority]:
+            return False
+        self.in_flight += 1
+        self._update_gauges()
+        return True
+
+    def release(self, latency: float) -> None:
+        if self.adaptive:
+            self._adapt(latency)
+        self.in_flight -= 1
+        self._update_gauges()
+
+    def _adapt(self, latency: float) -> None:
+        if latency > self.target_latency:
+            now = self._clock()
+            # Requests that were slow because of the same overload
+            # decrease the limit only once
+            if now - self._decreased_at >= self.target_latency:
+                self._decreased_at = now
+                self.limit = max(self.limit * self.backoff, self.min_in_flight)
+        elif self.in_flight >= self.limit / 2:
+            # Do not grow a limit that is not used, it would not have been tested
+            self.limit = min(self.limit + 1 / self.limit, self.max_in_flight)
+
+    def _update_gauges(self) -> None:
+        ADMISSION_LIMIT.set(self.limit)
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+
+
+def route_priorities(
+    routes: Iterable[BaseRoute],
+) -> Callable[[Scope], Priority | None]:
+    """
+    Priority of the API route (see api.spec.make_router) that matches
+    the request, None for other routes, e.g. /health or /metrics,
+    which are never rejected.
+
+    `routes` are read on the first call
+    """
+    prioritized: list[tuple[BaseRoute, Priority]] | None = None
+
+    def priority_of(scope: Scope) -> Priority | None:
+        nonlocal prioritized
+        if prioritized is None:
+            prioritized = [
+                (route, Priority[route.openapi_extra[PRIORITY_EXTENSION].upper()])
+                for route in routes
+                if isinstance(route, APIRoute)
+                and route.openapi_extra
+                and PRIORITY_EXTENSION in route.openapi_extra
+            ]
+        for route, priority in prioritized:
+            match, _ = route.matches(scope)
+            if match != Match.NONE:
+                return priority
+        return None
+
+    return priority_of
+
+
+class AdmissionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        limit: ConcurrencyLimit,
+        priority_of: Callable[[Scope], Priority | None],
+        retry_after_seconds: int = 1,
+    ):
+        self.app = app
+        self.limit = limit
+        self.priority_of = priority_of
+        self.retry_after_seconds = retry_after_seconds
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        priority = self.priority_of(scope)
+        if priority is None:
+            await self.app(scope, receive, send)
+            return
+        if not self.limit.try_acquire(priority):
+            ADMISSION_REJECTED.labels(priority.name.lower()).inc()
+            await self._reject(send)
+            return
+
+        start = time.perf_counter()
+        latency: float | None = None
+
+        async def send_timed(message: Message) -> None:
+            nonlocal latency
+            if message["type"] == "http.response.start":
+                latency = time.perf_counter() - start
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            # Failed without a response, e.g. timed out waiting for the pool
+            if latency is None:
+                latency = time.perf_counter() - start
+            self.limit.release(latency)
+
+    async def _reject(self, send: Send) -> None:
+        # The error shape of all the other errors, see spec.expect_exceptions
+        error = OverloadedError()
+        body = (
+            UserError(error=error.__class__.__name__, detail=str(error))
+            .model_dump_json()
+            .encode()
+        )
+        await send(
+            {
+                "type": "http.response.start",
+                "status": error.status_code,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(self.retry_after_seconds).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,169 @@
+"""
+Tests of admission control (admission.py)
+"""
+
+import asyncio
+
+import httpx
+import pytest
+from prometheus_client import REGISTRY
+from starlette.types import Receive, Scope, Send
+
+from .admission import AdmissionMiddleware, ConcurrencyLimit, route_priorities
+from .api.spec import Priority
+from .application_context import ApplicationContext, AppSettings
+from .api import api_router
+from .storage.connection_pool import ConnectionPool
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _acquire_all(limit: ConcurrencyLimit, priority: Priority) -> int:
+    acquired = 0
+    while limit.try_acquire(priority):
+        acquired += 1
+    return acquired
+
+
+@pytest.mark.parametrize(
+    "priority, admitted",
+    [(Priority.LOW, 5), (Priority.NORMAL, 9), (Priority.HIGH, 10)],
+)
+def test_priority_shares(priority: Priority, admitted: int):
+    limit = ConcurrencyLimit(10)
+    assert _acquire_all(limit, priority) == admitted
+
+    limit.release(0.1)
+    assert limit.try_acquire(priority)
+
+
+def test_lower_priority_rejected_first():
+    limit = ConcurrencyLimit(10)
+    assert _acquire_all(limit, Priority.LOW) == 5
+    # Higher priorities still get the rest
+    assert _acquire_all(limit, Priority.HIGH) == 5
+    assert not limit.try_acquire(Priority.LOW)
+
+
+def test_fixed_limit_does_not_adapt():
+    limit = ConcurrencyLimit(10)
+    limit.try_acquire(Priority.HIGH)
+    limit.release(60.0)
+    assert limit.limit == 10
+
+
+def test_adaptive_limit_decrease():
+    clock = _Clock()
+    limit = ConcurrencyLimit(
+        10, adaptive=True, min_in_flight=8, target_latency=0.5, clock=clock
+    )
+    _acquire_all(limit, Priority.HIGH)
+
+    # Slow responses of the same moment decrease the limit once
+    limit.release(1.0)
+    limit.release(1.0)
+    assert limit.limit == 9.0
+
+    clock.now = 0.5
+    limit.release(1.0)
+    assert limit.limit == pytest.approx(8.1)
+
+    # Never below min_in_flight
+    clock.now = 1.0
+    limit.release(1.0)
+    assert limit.limit == 8.0
+
+
+def test_adaptive_limit_increase():
+    limit = ConcurrencyLimit(10, adaptive=True, target_latency=0.5)
+    limit.limit = 4.0
+    for _ in range(4):
+        assert limit.try_acquire(Priority.HIGH)
+
+    # +1 per `limit` fast responses while the limit is in use
+    limit.release(0.1)
+    limit.release(0.1)
+    assert limit.limit == pytest.approx(4.5, abs=0.02)
+    # Less than half of the limit in flight, not tested so no increase
+    increased = limit.limit
+    limit.release(0.1)
+    limit.release(0.1)
+    assert limit.limit == increased
+
+    # Never above max_in_flight
+    limit.limit = 9.99
+    _acquire_all(limit, Priority.HIGH)
+    limit.release(0.1)
+    assert limit.limit == 10.0
+
+
+@pytest.mark.asyncio
+async def test_route_priorities(db_connection_pool: ConnectionPool):
+    settings = AppSettings(db_url="", host="127.0.0.1", port=8000, root_path="")
+    router = api_router(
+        ApplicationContext.create_with_settings(db_connection_pool, settings)
+    )
+    priority_of = route_priorities(router.routes)
+
+    def scope(method: str, path: str) -> Scope:
+        return {"type": "http", "method": method, "path": path, "root_path": ""}
+
+    assert priority_of(scope("GET", "/echo")) == Priority.LOW
+    assert priority_of(scope("GET", "/posts/1")) == Priority.NORMAL
+    assert priority_of(scope("DELETE", "/posts/1")) == Priority.NORMAL
+    assert priority_of(scope("GET", "/health")) is None
+
+
+@pytest.mark.asyncio
+async def test_admission_middleware():
+    release = asyncio.Event()
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["path"] == "/slow":
+            await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    def priority_of(scope: Scope) -> Priority | None:
+        return None if scope["path"] == "/health" else Priority.HIGH
+
+    limit = ConcurrencyLimit(1)
+    middleware = AdmissionMiddleware(app, limit, priority_of, retry_after_seconds=3)
+    rejected = REGISTRY.get_sample_value(
+        "admission_rejected_total", {"priority": "high"}
+    )
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=middleware), base_url="http://test"
+    ) as client:
+        slow = asyncio.create_task(client.get("/slow"))
+        while not limit.in_flight:
+            await asyncio.sleep(0.001)
+        assert REGISTRY.get_sample_value("admission_in_flight") == 1
+
+        response = await client.get("/fast")
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "3"
+        assert response.json() == {
+            "error": "OverloadedError",
+            "detail": "Server is overloaded, retry later",
+        }
+        assert (
+            REGISTRY.get_sample_value("admission_rejected_total", {"priority": "high"})
+            == (rejected or 0) + 1
+        )
+
+        # Requests without priority are never rejected
+        response = await client.get("/health")
+        assert response.status_code == 200
+
+        release.set()
+        assert (await slow).status_code == 200
+        assert limit.in_flight == 0
+        response = await client.get("/fast")
+        assert response.status_code == 200
@@ -3,15 +3,60 @@ API implementation
 """
 
 import logging
+from typing import AsyncIterator
 
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
 
 from {{cookiecutter.__project_slug}}.application_context import ApplicationContext
+from {{cookiecutter.__project_slug}}.storage.models import Comment, Post, PostRow
+from {{cookiecutter.__project_slug}}.storage.post_repo import NewPost
 
 from . import spec
+from .cursor import (
+    decode_post_cursor,
+    decode_search_cursor,
+    encode_post_cursor,
+    encode_search_cursor,
+)
 
 logger = logging.getLogger(__name__)
 
+# Number of posts serialized into a single chunk of the export stream
+EXPORT_CHUNK_SIZE = 100
+
+
+def _post_response(post: Post | PostRow) -> spec.PostResponse:
+    return spec.PostResponse(
+        id=post.id,
+        title=post.title,
+        main_content=post.main_content,
+        created_at=post.created_at,
+        updated_at=post.updated_at,
+        comment_count=post.comment_count,
+    )
+
+
+def _comment_response(comment: Comment) -> spec.CommentResponse:
+    return spec.CommentResponse(
+        id=comment.id,
+        content=comment.content,
+        created_at=comment.created_at,
+        updated_at=comment.updated_at,
+    )
+
+
+def _post_with_comments_response(post: Post) -> spec.PostWithCommentsResponse:
+    return spec.PostWithCommentsResponse(
+        id=post.id,
+        title=post.title,
+        main_content=post.main_content,
+        created_at=post.created_at,
+        updated_at=post.updated_at,
+        comment_count=post.comment_count,
+        comments=[_comment_response(comment) for comment in post.comments],
+    )
+
 
 class DefaultApi(spec.Api):
     """
@@ -28,40 +73,97 @@ class DefaultApi(spec.Api):
 
     async def new_post(self, post: spec.PostPayload) -> spec.PostResponse:
         new_post = await self.post_repo.create_post(post.title, post.main_content)
-        return spec.PostResponse(
-            id=new_post.id,
-            title=new_post.title,
-            main_content=new_post.main_content,
-            created_at=new_post.created_at,
-            updated_at=new_post.updated_at,
-        )
-
-    async def view_posts(self) -> spec.PostsListResponse:
-        posts = await self.post_repo.view_posts()
-        return spec.PostsListResponse(
-            data=[
-                spec.PostResponse(
-                    id=post.id,
-                    title=post.title,
-                    main_content=post.main_content,
-                    created_at=post.created_at,
-                    updated_at=post.updated_at,
+        return _post_response(new_post)
+
+    async def new_posts_batch(
+        self, batch: spec.PostsBatchPayload
+    ) -> spec.PostsBatchResponse:
+        posts = await self.post_repo.create_posts_bulk(
+            [
+                NewPost(
+                    title=item.title,
+                    main_content=item.main_content,
+                    client_key=item.client_key,
                 )
-                for post in posts
+                for item in batch.data
             ]
         )
+        return spec.PostsBatchResponse(data=[_post_response(post) for post in posts])
+
+    async def view_posts(
+        self,
+        limit: spec.PageLimit = spec.DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+    ) -> spec.PostsListResponse:
+        after = decode_post_cursor(cursor) if cursor is not None else None
+        page = await self.post_repo.view_posts(limit, after)
+        return spec.PostsListResponse(
+            data=[_post_response(post) for post in page.posts],
+            next_cursor=(
+                encode_post_cursor(page.next_key) if page.next_key is not None else None
+            ),
+        )
+
+    async def search_posts(
+        self,
+        query: spec.SearchQuery,
+        limit: spec.PageLimit = spec.DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+    ) -> spec.PostsSearchResponse:
+        after = decode_search_cursor(cursor) if cursor is not None else None
+        page = await self.post_repo.search_posts(query, limit, after)
+        return spec.PostsSearchResponse(
+            data=[_post_response(post) for post in page.posts],
+            next_cursor=(
+                encode_search_cursor(page.next_key)
+                if page.next_key is not None
+                else None
+            ),
+            truncated=page.truncated,
+        )
+
+    async def view_posts_with_comments(
+        self,
+        limit: spec.PageLimit = spec.DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+    ) -> spec.PostsWithCommentsListResponse:
+        after = decode_post_cursor(cursor) if cursor is not None else None
+        page = await self.post_repo.view_posts_with_comments(
+            limit, after, comments_per_post=spec.MAX_COMMENTS_PER_POST
+        )
+        return spec.PostsWithCommentsListResponse(
+            data=[_post_with_comments_response(post) for post in page.posts],
+            next_cursor=(
+                encode_post_cursor(page.next_key) if page.next_key is not None else None
+            ),
+        )
+
+    async def export_posts(self) -> StreamingResponse:
+        async def ndjson_chunks() -> AsyncIterator[str]:
+            # Buffer at most EXPORT_CHUNK_SIZE lines, the rest is pulled lazily
+            # from the DB cursor as the client reads the response
+            lines: list[str] = []
+            async for post in self.post_repo.stream_posts():
+                lines.append(_post_response(post).model_dump_json())
+                if len(lines) >= EXPORT_CHUNK_SIZE:
+                    yield "\n".join(lines) + "\n"
+                    lines.clear()
+            if lines:
+                yield "\n".join(lines) + "\n"
+
+        return StreamingResponse(ndjson_chunks(), media_type="application/x-ndjson")
 
     async def view_post(self, post_id: int) -> spec.PostResponse:
         post = await self.post_repo.view_post(post_id)
         if post is None:
             raise spec.PostNotFoundError(post_id)
-        return spec.PostResponse(
-            id=post.id,
-            title=post.title,
-            main_content=post.main_content,
-            created_at=post.created_at,
-            updated_at=post.updated_at,
-        )
+        return _post_response(post)
+
+    async def view_post_etag(self, post_id: int) -> str | None:
+        version = await self.post_repo.view_post_version(post_id)
+        if version is None:
+            return None
+        return spec.post_etag(post_id, version.updated_at, version.comment_count)
 
     async def update_post(
         self, post_id: int, post: spec.PostPayload
@@ -71,19 +173,11 @@ class DefaultApi(spec.Api):
         )
         if updated_post is None:
             raise spec.PostNotFoundError(post_id)
-        return spec.PostResponse(
-            id=updated_post.id,
-            title=updated_post.title,
-            main_content=updated_post.main_content,
-            created_at=updated_post.created_at,
-            updated_at=updated_post.updated_at,
-        )
+        return _post_response(updated_post)
 
     async def delete_post(self, post_id: int) -> None:
-        post = await self.post_repo.view_post(post_id)
-        if post is None:
+        if not await self.post_repo.delete_post(post_id):
             raise spec.PostNotFoundError(post_id)
-        await self.post_repo.delete_post(post_id)
 
 
 def api_router(application_context: ApplicationContext) -> APIRouter:
@@ -0,0 +1,64 @@
+"""
+Opaque pagination cursors
+
+Cursors are handed out to clients as url-safe tokens,
+clients must not rely on their content
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from {{cookiecutter.__project_slug}}.storage.post_repo import PostKey, SearchKey
+
+from . import spec
+
+
+def _encode(values: list) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _decode(cursor: str) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeError, ValueError) as exc:
+        raise spec.InvalidCursorError(cursor) from exc
+    if not isinstance(values, list):
+        raise spec.InvalidCursorError(cursor)
+    return values
+
+
+def encode_post_cursor(key: PostKey) -> str:
+    created_at, post_id = key
+    return _encode([created_at.isoformat(), post_id])
+
+
+def decode_post_cursor(cursor: str) -> PostKey:
+    values = _decode(cursor)
+    try:
+        created_at, post_id = values
+        created_at = datetime.fromisoformat(created_at)
+    except (TypeError, ValueError) as exc:
+        raise spec.InvalidCursorError(cursor) from exc
+    if created_at.tzinfo is None or type(post_id) is not int:
+        raise spec.InvalidCursorError(cursor)
+    return created_at, post_id
+
+
+def encode_search_cursor(key: SearchKey) -> str:
+    rank, post_id = key
+    return _encode([rank, post_id])
+
+
+def decode_search_cursor(cursor: str) -> SearchKey:
+    values = _decode(cursor)
+    try:
+        rank, post_id = values
+    except ValueError as exc:
+        raise spec.InvalidCursorError(cursor) from exc
+    if type(rank) not in (int, float) or type(post_id) is not int:
+        raise spec.InvalidCursorError(cursor)
+    return float(rank), post_id
@@ -7,17 +7,22 @@ must not depend on any other modules
 
 import abc
 import enum
+import hashlib
 import inspect
 import logging
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 from typing import (
+    Annotated,
     Any,
+    Awaitable,
     Callable,
     Generator,
     Generic,
+    Iterable,
     List,
+    Protocol,
     Tuple,
     Type,
     TypeVar,
@@ -27,16 +32,81 @@ from uuid import uuid4
 
 import fastapi
 from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.routing import APIRouter
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 logger = logging.getLogger(__name__)
 
 T = TypeVar("T")
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Use as `limit: PageLimit = DEFAULT_PAGE_SIZE` in paginated endpoints
+PageLimit = Annotated[int, fastapi.Query(ge=1, le=MAX_PAGE_SIZE)]
+
+MAX_BATCH_SIZE = 1000
+
+# Comments of every post of the pages of posts with comments
+MAX_COMMENTS_PER_POST = 20
+
+MAX_SEARCH_QUERY_LENGTH = 256
+
+# Use as `query: SearchQuery` in search endpoints
+SearchQuery = Annotated[
+    str, fastapi.Query(min_length=1, max_length=MAX_SEARCH_QUERY_LENGTH)
+]
+
 ErrorVariants = TypeVar("ErrorVariants")
 
 
+class Priority(enum.IntEnum):
+    """
+    Priority of the requests of an API section.
+    Under load, requests of lower priority are rejected first
+    """
+
+    LOW = 0
+    NORMAL = 1
+    HIGH = 2
+
+
+# OpenAPI extension of every operation with the name of its Priority
+PRIORITY_EXTENSION = "x-priority"
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def post_etag(post_id: int, updated_at: datetime, comment_count: int) -> str:
+    """
+    Strong ETag of a post, changes with every update of the post
+    and when its comments are added or deleted
+    """
+    micros = (updated_at - _EPOCH) // timedelta(microseconds=1)
+    return f'"{post_id}-{micros}-{comment_count}"'
+
+
+def posts_page_etag(
+    posts: Iterable[tuple[int, datetime, int]], next_cursor: str | None
+) -> str:
+    """
+    Strong ETag of a page of posts from the (id, updated_at, comment_count)
+    of its posts, changes when a post of the page is added, updated or deleted
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for post_id, updated_at, comment_count in posts:
+        digest.update(post_etag(post_id, updated_at, comment_count).encode())
+    digest.update((next_cursor or "").encode())
+    return f'"{digest.hexdigest()}"'
+
+
+class Versioned(Protocol):
+    """Response model of the routes registered with an etag"""
+
+    def etag(self) -> str: ...
+
+
 class UserError(BaseModel, Generic[ErrorVariants]):
     """
     Error model for all user errors.
@@ -56,16 +126,68 @@ class PostPayload(BaseModel):
     main_content: str
 
 
+class PostBatchItem(PostPayload):
+    # Retrying a batch with the same keys updates the posts instead of
+    # creating duplicates
+    client_key: str | None = None
+
+
+class PostsBatchPayload(BaseModel):
+    data: list[PostBatchItem] = Field(max_length=MAX_BATCH_SIZE)
+
+
 class PostResponse(BaseModel):
     id: int
     title: str
     main_content: str
     created_at: datetime
     updated_at: datetime
+    comment_count: int
+
+    def etag(self) -> str:
+        return post_etag(self.id, self.updated_at, self.comment_count)
 
 
 class PostsListResponse(BaseModel):
     data: list[PostResponse]
+    # Pass as `cursor` to get the next page, null on the last page
+    next_cursor: str | None = None
+
+    def etag(self) -> str:
+        return posts_page_etag(
+            ((post.id, post.updated_at, post.comment_count) for post in self.data),
+            self.next_cursor,
+        )
+
+
+class PostsSearchResponse(PostsListResponse):
+    # More posts matched than are ranked, only the newest of them were
+    # searched for the best matches. A more specific query finds the others
+    truncated: bool = False
+
+
+class CommentResponse(BaseModel):
+    id: int
+    content: str
+    created_at: datetime
+    updated_at: datetime
+
+
+class PostWithCommentsResponse(PostResponse):
+    # The oldest comments first, at most MAX_COMMENTS_PER_POST of the
+    # comment_count comments of the post
+    comments: list[CommentResponse]
+
+
+class PostsWithCommentsListResponse(BaseModel):
+    data: list[PostWithCommentsResponse]
+    # Pass as `cursor` to get the next page, null on the last page
+    next_cursor: str | None = None
+
+
+class PostsBatchResponse(BaseModel):
+    # In the same order as the items of the payload
+    data: list[PostResponse]
 
 
 class EchoExampleError(Exception):
@@ -78,6 +200,25 @@ class EchoExampleError(Exception):
         return f"Echo example error: {self.message}"
 
 
+class InvalidCursorError(Exception):
+    status_code = 400
+
+    def __init__(self, cursor: str):
+        self.cursor = cursor
+
+    def __str__(self):
+        return f"Invalid pagination cursor: {self.cursor!r}"
+
+
+class OverloadedError(Exception):
+    """Error of the requests rejected by admission.AdmissionMiddleware"""
+
+    status_code = 503
+
+    def __str__(self):
+        return "Server is overloaded, retry later"
+
+
 class PostNotFoundError(Exception):
     status_code = 404
 
@@ -109,6 +250,104 @@ def _create_error_enum(name: str, errors: List[Type[Exception]]):
     return enum.Enum(f"{name}_errors", variants, type=str)
 
 
+class PydanticJSONResponse(JSONResponse):
+    """
+    JSON response that serializes pydantic models straight to bytes
+    with pydantic-core, without an intermediate dict
+    """
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            return content.__pydantic_serializer__.to_json(content)
+        return super().render(content)
+
+
+def respond_with(func: Callable, response_class: Type[JSONResponse]):
+    """
+    Returns pydantic models returned by the function as `response_class`.
+    FastAPI passes responses through as they are, so the models are neither
+    validated against the response model again nor converted to a dict
+    """
+
+    @wraps(func)
+    async def _respond(*args: Any, **kwargs: Any):
+        result = await func(*args, **kwargs)
+        if isinstance(result, BaseModel):
+            return response_class(result)
+        return result
+
+    return _respond
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of If-None-Match, e.g. with ETags of compressed responses"""
+    if if_none_match.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in tags
+
+
+def conditional(
+    func: Callable[..., Awaitable[Versioned]],
+    etag: Callable[..., Awaitable[str | None]] | None,
+    response_class: Type[JSONResponse] | None,
+):
+    """
+    Answers requests whose If-None-Match matches the current ETag of
+    the resource with 304 Not Modified, without calling the function.
+    `etag` takes the arguments of the function and looks the ETag up,
+    None if the resource does not exist.
+
+    Without `etag`, the function is called and its ETag compared, which
+    saves sending the body only. For resources whose ETag costs about as
+    much to look up as the resource itself
+
+    Other responses carry the ETag of the returned model,
+    so it always describes the body that was sent
+    """
+
+    @wraps(func)
+    async def _conditional(
+        *args: Any,
+        if_none_match: str | None,
+        response: fastapi.Response,
+        **kwargs: Any,
+    ):
+        if if_none_match is not None and etag is not None:
+            current = await etag(*args, **kwargs)
+            if current is not None and _etag_matches(if_none_match, current):
+                return fastapi.Response(status_code=304, headers={"ETag": current})
+        result = await func(*args, **kwargs)
+        current = result.etag()
+        if if_none_match is not None and _etag_matches(if_none_match, current):
+            return fastapi.Response(status_code=304, headers={"ETag": current})
+        if response_class is None:
+            # Merged by FastAPI into the response it serializes
+            response.headers["ETag"] = current
+            return result
+        return response_class(result, headers={"ETag": current})
+
+    # FastAPI reads the parameters of the endpoint from its signature
+    signature = inspect.signature(func)
+    _conditional.__signature__ = signature.replace(  # type: ignore
+        parameters=[
+            *signature.parameters.values(),
+            inspect.Parameter(
+                "if_none_match",
+                inspect.Parameter.KEYWORD_ONLY,
+                default=fastapi.Header(None),
+                annotation=str | None,
+            ),
+            inspect.Parameter(
+                "response",
+                inspect.Parameter.KEYWORD_ONLY,
+                annotation=fastapi.Response,
+            ),
+        ]
+    )
+    return _conditional
+
+
 def expect_exceptions(func: Callable, exceptions: Tuple[Type[Exception], ...]):
     """
     Specifies which exceptions can function raise
@@ -197,9 +436,47 @@ class Api(abc.ABC):
         raise NotImplementedError()
 
     @abc.abstractmethod
-    async def view_posts(self) -> PostsListResponse:
+    async def new_posts_batch(self, batch: PostsBatchPayload) -> PostsBatchResponse:
         """
-        View all posts.
+        Create many posts at once, upserting items with a client_key.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def view_posts(
+        self, limit: PageLimit = DEFAULT_PAGE_SIZE, cursor: str | None = None
+    ) -> PostsListResponse:
+        """
+        View posts page by page, oldest first.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def search_posts(
+        self,
+        query: SearchQuery,
+        limit: PageLimit = DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+    ) -> PostsSearchResponse:
+        """
+        Search posts by title and content page by page, best matches first.
+        The query supports "quoted phrases", OR and -excluded words.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def view_posts_with_comments(
+        self, limit: PageLimit = DEFAULT_PAGE_SIZE, cursor: str | None = None
+    ) -> PostsWithCommentsListResponse:
+        """
+        View posts with their first comments page by page, oldest first.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def export_posts(self) -> StreamingResponse:
+        """
+        Export all posts as newline-delimited JSON (one PostResponse per line).
         """
         raise NotImplementedError()
 
@@ -210,6 +487,14 @@ class Api(abc.ABC):
         """
         raise NotImplementedError()
 
+    @abc.abstractmethod
+    async def view_post_etag(self, post_id: int) -> str | None:
+        """
+        ETag of view_post, looked up without loading the post.
+        None if the post does not exist.
+        """
+        raise NotImplementedError()
+
     @abc.abstractmethod
     async def update_post(self, post_id: int, post: PostPayload) -> PostResponse:
         """
@@ -231,10 +516,19 @@ class ApiSection:
     Registers methods in given router with specified prefix and tag
     """
 
-    def __init__(self, router: APIRouter, prefix: str, tag: str):
+    def __init__(
+        self,
+        router: APIRouter,
+        prefix: str,
+        tag: str,
+        priority: Priority,
+        response_class: Type[JSONResponse] | None,
+    ):
         self.router = router
         self.prefix = prefix
         self.tag = tag
+        self.priority = priority
+        self.response_class = response_class
 
     def register(
         self,
@@ -243,7 +537,21 @@ class ApiSection:
         endpoint: Any,
         *exceptions: Type[Exception],
         deprecated: bool = False,
+        etag: Callable[..., Awaitable[str | None]] | None = None,
+        etag_of_response: bool = False,
     ):
+        """
+        etag: looks up the current ETag of the resource from the arguments
+            of the endpoint to answer conditional requests, see conditional.
+            The endpoint must return a Versioned model
+        etag_of_response: answer conditional requests with the ETag of the
+            Versioned model returned by the endpoint, without an `etag` lookup
+        """
+        conditional_get = etag is not None or etag_of_response
+        if conditional_get:
+            endpoint = conditional(endpoint, etag, self.response_class)
+        elif self.response_class is not None:
+            endpoint = respond_with(endpoint, self.response_class)
         endpoint = expect_exceptions(endpoint, exceptions)
         response_model = get_type_hints(endpoint)["return"]
 
@@ -253,8 +561,16 @@ class ApiSection:
             response_model = None
 
         additional_responses = getattr(endpoint, "additional_responses", None)
-
-        path_with_prefix = f"{self.prefix.rstrip('/')}{'/' if path else ''}{path}"
+        if conditional_get:
+            additional_responses = {
+                **(additional_responses or {}),
+                304: {"description": "Not Modified, If-None-Match matches the ETag"},
+            }
+
+        # Paths starting with ':' are custom methods of the collection
+        # e.g. "/posts" + ":export" -> "/posts:export"
+        separator = "/" if path and not path.startswith(":") else ""
+        path_with_prefix = f"{self.prefix.rstrip('/')}{separator}{path}"
         self.router.add_api_route(
             path_with_prefix,
             endpoint,
@@ -265,23 +581,52 @@ class ApiSection:
             description=None,
             responses=additional_responses,
             deprecated=deprecated,
+            openapi_extra={PRIORITY_EXTENSION: self.priority.name.lower()},
         )
 
 
-def make_router(api: Api) -> APIRouter:
+def make_router(
+    api: Api, response_class: Type[JSONResponse] | None = PydanticJSONResponse
+) -> APIRouter:
+    """
+    response_class: serializes the response models of the endpoints,
+        None to leave their validation and serialization to FastAPI
+    """
     router = APIRouter()
 
     @contextmanager
-    def section(prefix: str, tag: str) -> Generator[ApiSection, None, None]:
-        yield ApiSection(router, prefix, tag)
+    def section(
+        prefix: str, tag: str, priority: Priority = Priority.NORMAL
+    ) -> Generator[ApiSection, None, None]:
+        yield ApiSection(router, prefix, tag, priority, response_class)
 
     # Add new API routes here
-    with section("/echo", "echo") as sec:
+    with section("/echo", "echo", Priority.LOW) as sec:
         sec.register("GET", "", api.echo, EchoExampleError)
     with section("/posts", "posts") as sec:
         sec.register("POST", "", api.new_post)
-        sec.register("GET", "", api.view_posts)
-        sec.register("GET", "{post_id}", api.view_post, PostNotFoundError)
+        sec.register("POST", ":batch", api.new_posts_batch)
+        # The versions of a page read the rows of its posts anyway,
+        # for their comment_count, see Post.comment_count
+        sec.register(
+            "GET", "", api.view_posts, InvalidCursorError, etag_of_response=True
+        )
+        sec.register("GET", ":export", api.export_posts)
+        # Before "{post_id}", which would match them as well
+        sec.register("GET", "search", api.search_posts, InvalidCursorError)
+        sec.register(
+            "GET",
+            "with-comments",
+            api.view_posts_with_comments,
+            InvalidCursorError,
+        )
+        sec.register(
+            "GET",
+            "{post_id}",
+            api.view_post,
+            PostNotFoundError,
+            etag=api.view_post_etag,
+        )
         sec.register("PUT", "{post_id}", api.update_post, PostNotFoundError)
         sec.register("DELETE", "{post_id}", api.delete_post, PostNotFoundError)
 
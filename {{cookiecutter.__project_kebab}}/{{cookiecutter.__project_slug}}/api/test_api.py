@@ -1,5 +1,18 @@
+import json
+import time
+from datetime import datetime, timezone
+from typing import Any
+
+import fastapi
 import pytest
-from httpx import AsyncClient
+from fastapi.responses import JSONResponse
+from httpx import ASGITransport, AsyncClient
+
+from {{cookiecutter.__project_slug}}.storage.connection_pool import ConnectionPool
+from {{cookiecutter.__project_slug}}.storage.post_repo import NewComment, PostRepo
+
+from . import spec
+from .api import DefaultApi
 
 
 @pytest.mark.asyncio
@@ -21,6 +34,35 @@ async def test_new_post(api_client: AsyncClient) -> None:
     assert data["updated_at"] is not None
 
 
+@pytest.mark.asyncio
+async def test_new_posts_batch(api_client: AsyncClient) -> None:
+    batch = {
+        "data": [
+            {"title": "A", "main_content": "content", "client_key": "a"},
+            {"title": "B", "main_content": "content"},
+        ]
+    }
+    response = await api_client.post("/posts:batch", json=batch)
+    assert response.status_code == 200
+    created = response.json()["data"]
+    assert [post["title"] for post in created] == ["A", "B"]
+
+    # Retrying with the same client key does not create a duplicate
+    batch["data"][0]["title"] = "A1"
+    response = await api_client.post("/posts:batch", json={"data": batch["data"][:1]})
+    assert response.status_code == 200
+    (upserted,) = response.json()["data"]
+    assert upserted["id"] == created[0]["id"]
+    assert upserted["title"] == "A1"
+
+
+@pytest.mark.asyncio
+async def test_new_posts_batch_too_large(api_client: AsyncClient) -> None:
+    post = {"title": "A", "main_content": "content"}
+    response = await api_client.post("/posts:batch", json={"data": [post] * 1001})
+    assert response.status_code == 422
+
+
 @pytest.mark.asyncio
 async def test_view_posts(api_client: AsyncClient) -> None:
     response = await api_client.get("/posts")
@@ -28,6 +70,144 @@ async def test_view_posts(api_client: AsyncClient) -> None:
     assert isinstance(response.json()["data"], list)
 
 
+@pytest.mark.asyncio
+async def test_view_posts_pagination(api_client: AsyncClient) -> None:
+    post_ids = []
+    for i in range(3):
+        res = await api_client.post(
+            "/posts", json={"title": f"Test {i}", "main_content": "content"}
+        )
+        post_ids.append(res.json()["id"])
+
+    response = await api_client.get("/posts", params={"limit": 2})
+    assert response.status_code == 200
+    first_page = response.json()
+    assert [post["id"] for post in first_page["data"]] == post_ids[:2]
+    assert first_page["next_cursor"] is not None
+
+    response = await api_client.get(
+        "/posts", params={"limit": 2, "cursor": first_page["next_cursor"]}
+    )
+    assert response.status_code == 200
+    second_page = response.json()
+    assert [post["id"] for post in second_page["data"]] == post_ids[2:]
+    assert second_page["next_cursor"] is None
+
+
+@pytest.mark.asyncio
+async def test_view_posts_invalid_cursor(api_client: AsyncClient) -> None:
+    response = await api_client.get("/posts", params={"cursor": "not a cursor"})
+    assert response.status_code == 400
+    assert response.json()["error"] == "InvalidCursorError"
+
+
+@pytest.mark.asyncio
+async def test_view_posts_invalid_limit(api_client: AsyncClient) -> None:
+    response = await api_client.get("/posts", params={"limit": 0})
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_view_posts_with_comments(
+    api_client: AsyncClient, db_connection_pool: ConnectionPool
+) -> None:
+    res = await api_client.post("/posts", json={"title": "A", "main_content": "a"})
+    post_id = res.json()["id"]
+    await PostRepo(db_connection_pool).create_comments_bulk(
+        [NewComment(post_id=post_id, content=f"Comment {i}") for i in range(2)]
+    )
+
+    response = await api_client.get("/posts/with-comments", params={"limit": 1})
+    assert response.status_code == 200
+    [post] = response.json()["data"]
+    assert post["id"] == post_id
+    assert post["comment_count"] == 2
+    assert [comment["content"] for comment in post["comments"]] == [
+        "Comment 0",
+        "Comment 1",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_comment_count(
+    api_client: AsyncClient, db_connection_pool: ConnectionPool
+) -> None:
+    res = await api_client.post("/posts", json={"title": "A", "main_content": "a"})
+    assert res.json()["comment_count"] == 0
+    post_id = res.json()["id"]
+    post_etag = (await api_client.get(f"/posts/{post_id}")).headers["etag"]
+    page_etag = (await api_client.get("/posts")).headers["etag"]
+
+    await PostRepo(db_connection_pool).create_comment(post_id, "Comment")
+
+    # Not an update of the post, but a new version of it
+    response = await api_client.get(
+        f"/posts/{post_id}", headers={"If-None-Match": post_etag}
+    )
+    assert response.status_code == 200
+    assert response.json()["comment_count"] == 1
+    assert response.json()["updated_at"] == res.json()["updated_at"]
+    response = await api_client.get("/posts", headers={"If-None-Match": page_etag})
+    assert response.status_code == 200
+    [post] = response.json()["data"]
+    assert post["comment_count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_search_posts(api_client: AsyncClient) -> None:
+    for title in ("Bread", "Baking bread", "Gardening"):
+        await api_client.post("/posts", json={"title": title, "main_content": "a"})
+
+    response = await api_client.get(
+        "/posts/search", params={"query": "bread", "limit": 1}
+    )
+    assert response.status_code == 200
+    [first] = response.json()["data"]
+    cursor = response.json()["next_cursor"]
+    response = await api_client.get(
+        "/posts/search", params={"query": "bread", "limit": 1, "cursor": cursor}
+    )
+    [second] = response.json()["data"]
+    assert response.json()["next_cursor"] is None
+    assert response.json()["truncated"] is False
+    assert {first["title"], second["title"]} == {"Bread", "Baking bread"}
+
+    # Cursors of the listing are not search cursors
+    listing_cursor = (await api_client.get("/posts", params={"limit": 1})).json()[
+        "next_cursor"
+    ]
+    response = await api_client.get(
+        "/posts/search", params={"query": "bread", "cursor": listing_cursor}
+    )
+    assert response.status_code == 400
+    assert response.json()["error"] == "InvalidCursorError"
+
+    for params in (
+        {},
+        {"query": ""},
+        {"query": "x" * (spec.MAX_SEARCH_QUERY_LENGTH + 1)},
+    ):
+        response = await api_client.get("/posts/search", params=params)
+        assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_export_posts(api_client: AsyncClient) -> None:
+    post_ids = []
+    for i in range(3):
+        res = await api_client.post(
+            "/posts", json={"title": f"Test {i}", "main_content": "content"}
+        )
+        post_ids.append(res.json()["id"])
+
+    response = await api_client.get("/posts:export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == post_ids
+    assert lines[0]["title"] == "Test 0"
+
+
 @pytest.mark.asyncio
 async def test_view_post(api_client: AsyncClient) -> None:
     res = await api_client.post(
@@ -92,3 +272,192 @@ async def test_update_post_not_found(api_client: AsyncClient) -> None:
 async def test_delete_post_not_found(api_client: AsyncClient) -> None:
     response = await api_client.delete("/posts/999999")
     assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_view_post_etag(api_client: AsyncClient) -> None:
+    res = await api_client.post("/posts", json={"title": "A", "main_content": "a"})
+    post_id = res.json()["id"]
+    response = await api_client.get(f"/posts/{post_id}")
+    etag = response.headers["etag"]
+
+    for if_none_match in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        response = await api_client.get(
+            f"/posts/{post_id}", headers={"If-None-Match": if_none_match}
+        )
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+        assert response.content == b""
+
+    await api_client.put(f"/posts/{post_id}", json={"title": "B", "main_content": "b"})
+    response = await api_client.get(
+        f"/posts/{post_id}", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.json()["title"] == "B"
+    assert response.headers["etag"] != etag
+
+    response = await api_client.get("/posts/999999", headers={"If-None-Match": "*"})
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_view_posts_etag(api_client: AsyncClient) -> None:
+    for i in range(3):
+        await api_client.post("/posts", json={"title": f"{i}", "main_content": "a"})
+    response = await api_client.get("/posts", params={"limit": 2})
+    etag = response.headers["etag"]
+    cursor = response.json()["next_cursor"]
+
+    response = await api_client.get(
+        "/posts", params={"limit": 2}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+
+    # Pages are versioned separately
+    response = await api_client.get(
+        "/posts", params={"limit": 2, "cursor": cursor}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    next_etag = response.headers["etag"]
+
+    # A new post is on the second page only
+    await api_client.post("/posts", json={"title": "3", "main_content": "a"})
+    response = await api_client.get(
+        "/posts", params={"limit": 2}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    response = await api_client.get(
+        "/posts",
+        params={"limit": 2, "cursor": cursor},
+        headers={"If-None-Match": next_etag},
+    )
+    assert response.status_code == 200
+    assert len(response.json()["data"]) == 2
+
+
+class _PostsPageApi(DefaultApi):
+    """Serves the same page of posts without a database"""
+
+    def __init__(self, page: spec.PostsListResponse):
+        self.page = page
+        self.pages_served = 0
+        self.posts_served = 0
+
+    async def view_posts(
+        self,
+        limit: spec.PageLimit = spec.DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+    ) -> spec.PostsListResponse:
+        self.pages_served += 1
+        return self.page
+
+    async def view_post(self, post_id: int) -> spec.PostResponse:
+        self.posts_served += 1
+        return self.page.data[0]
+
+    async def view_post_etag(self, post_id: int) -> str | None:
+        return self.page.data[0].etag()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("response_class", [None, spec.PydanticJSONResponse])
+async def test_not_modified_skips_endpoint(
+    response_class: type[JSONResponse] | None,
+) -> None:
+    now = datetime.now(timezone.utc)
+    post = spec.PostResponse(
+        id=1,
+        title="Title",
+        main_content="x",
+        created_at=now,
+        updated_at=now,
+        comment_count=0,
+    )
+    api = _PostsPageApi(spec.PostsListResponse(data=[post]))
+    app = fastapi.FastAPI()
+    app.include_router(spec.make_router(api, response_class))
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        etag = post.etag()
+        response = await client.get("/posts/1")
+        assert response.status_code == 200
+        assert response.headers["etag"] == etag
+
+        response = await client.get("/posts/1", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert api.posts_served == 1
+
+        # The ETag of a page is the one of the loaded page, only the body is saved
+        response = await client.get("/posts")
+        assert response.headers["etag"] == api.page.etag()
+        response = await client.get(
+            "/posts", headers={"If-None-Match": api.page.etag()}
+        )
+        assert response.status_code == 304
+        assert response.content == b""
+        assert api.pages_served == 2
+
+
+async def _posts_page_responses_per_second(
+    app: fastapi.FastAPI, requests: int
+) -> float:
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        # Warm up
+        await client.get("/posts")
+        start = time.perf_counter()
+        for _ in range(requests):
+            response = await client.get("/posts")
+            assert response.status_code == 200
+        return requests / (time.perf_counter() - start)
+
+
+@pytest.mark.benchmark
+@pytest.mark.asyncio
+async def test_response_serialization_throughput():
+    """
+    Responses per second of a page of MAX_PAGE_SIZE posts serialized by
+    PydanticJSONResponse, compared to FastAPI's response model handling.
+    Run with `pytest -m benchmark -s`
+    """
+    now = datetime.now(timezone.utc)
+    post = spec.PostResponse(
+        id=1,
+        title="Title",
+        main_content="x" * 500,
+        created_at=now,
+        updated_at=now,
+        comment_count=0,
+    )
+    api = _PostsPageApi(
+        spec.PostsListResponse(data=[post] * spec.MAX_PAGE_SIZE, next_cursor="abc")
+    )
+    requests = 300
+
+    def posts_app(
+        response_class: type[JSONResponse] | None, **kwargs: Any
+    ) -> fastapi.FastAPI:
+        app = fastapi.FastAPI(**kwargs)
+        app.include_router(spec.make_router(api, response_class))
+        return app
+
+    # FastAPI validates the returned model against the response model,
+    # then dumps it to JSON bytes, or to a dict for json.dumps
+    # if a response class is set
+    dump_json = await _posts_page_responses_per_second(posts_app(None), requests)
+    json_dumps = await _posts_page_responses_per_second(
+        posts_app(None, default_response_class=JSONResponse), requests
+    )
+    pydantic_json = await _posts_page_responses_per_second(
+        posts_app(spec.PydanticJSONResponse), requests
+    )
+
+    print(
+        f"\nresponses/s of {spec.MAX_PAGE_SIZE} posts: FastAPI json.dumps "
+        f"{json_dumps:.0f}, FastAPI dump_json {dump_json:.0f}, "
+        f"PydanticJSONResponse {pydantic_json:.0f}"
+    )
+    assert pydantic_json > json_dumps
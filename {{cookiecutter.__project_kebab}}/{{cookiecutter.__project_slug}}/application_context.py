@@ -4,7 +4,9 @@ This module is used to store the global services that are used in the applicatio
 
 from dataclasses import dataclass
 
+from {{cookiecutter.__project_slug}}.health import HealthMonitor
 from {{cookiecutter.__project_slug}}.storage.connection_pool import ConnectionPool
+from {{cookiecutter.__project_slug}}.storage.post_cache import PostCache
 from {{cookiecutter.__project_slug}}.storage.post_repo import PostRepo
 
 
@@ -16,16 +18,80 @@ class AppSettings:
     root_path: str
     debug: bool = False
     timeout_graceful_shutdown: int | None = 30
+    # See ConnectionPool for the meaning of db_pool_* and db_statement_* settings
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = -1
+    db_pool_pre_ping: bool = False
+    db_statement_cache_size: int = 100
+    db_pgbouncer: bool = False
+    # Direct connection for LISTEN, needed by the post cache with db_pgbouncer
+    db_listen_url: str | None = None
+    # Read-only queries are balanced over these, see ConnectionPool
+    db_replica_urls: tuple[str, ...] = ()
+    db_read_your_writes: bool = True
+    # Max number of posts cached in memory, 0 disables the cache
+    post_cache_size: int = 0
+    post_cache_ttl: float = 30.0
+    # PostRepo read methods whose concurrent identical calls share one query
+    coalesced_methods: tuple[str, ...] = ()
+    # Max comments inserted together by PostRepo.create_comment, 0 writes
+    # every comment in its own transaction, see PostRepo
+    comment_batch_size: int = 0
+    comment_batch_delay: float = 0.005
+    # See tracking.AccessLogSampler for the meaning of access_log_* settings
+    access_log_sample_rate: float = 1.0
+    access_log_slow_seconds: float | None = None
+    access_log_path_rates: tuple[tuple[str, float], ...] = ()
+    access_log_max_per_second: float = 0.0
+    # See admission.ConcurrencyLimit, 0 max in flight disables admission control
+    admission_max_in_flight: int = 0
+    admission_adaptive: bool = False
+    admission_min_in_flight: int = 1
+    admission_target_latency_seconds: float = 0.5
+    admission_retry_after_seconds: int = 1
+    # See response_compression.CompressionMiddleware
+    compression: bool = True
+    compression_encodings: tuple[str, ...] = ("zstd", "br", "gzip")
+    compression_minimum_size: int = 1000
+    compression_levels: tuple[tuple[str, int], ...] = ()
+    # See health.HealthMonitor for the meaning of health_check_* settings
+    health_check_interval: float = 5.0
+    health_check_max_acquire_seconds: float = 1.0
+    health_check_max_pool_saturation: float = 0.9
+    health_check_max_loop_lag_seconds: float = 0.5
+    health_check_max_replica_lag_seconds: float = 30.0
 
 
 @dataclass
 class ApplicationContext:
     connection_pool: ConnectionPool
     post_repo: PostRepo
+    health_monitor: HealthMonitor
     app_settings: AppSettings
 
     @classmethod
     def create_with_settings(cls, pool: ConnectionPool, settings: AppSettings):
+        post_cache = None
+        if settings.post_cache_size > 0:
+            post_cache = PostCache(settings.post_cache_size, settings.post_cache_ttl)
         return cls(
-            connection_pool=pool, post_repo=PostRepo(pool), app_settings=settings
+            connection_pool=pool,
+            post_repo=PostRepo(
+                pool,
+                post_cache,
+                settings.coalesced_methods,
+                comment_batch_size=settings.comment_batch_size,
+                comment_batch_delay=settings.comment_batch_delay,
+            ),
+            health_monitor=HealthMonitor(
+                pool,
+                interval=settings.health_check_interval,
+                max_acquire_seconds=settings.health_check_max_acquire_seconds,
+                max_pool_saturation=settings.health_check_max_pool_saturation,
+                max_loop_lag_seconds=settings.health_check_max_loop_lag_seconds,
+                max_replica_lag_seconds=settings.health_check_max_replica_lag_seconds,
+            ),
+            app_settings=settings,
         )
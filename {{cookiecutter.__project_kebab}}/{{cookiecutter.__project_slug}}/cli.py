@@ -11,6 +11,8 @@ to allow for fast --help calls
 import asyncio
 import logging
 import logging.config
+from dataclasses import dataclass
+from typing import Any
 
 import typer
 
@@ -37,17 +39,265 @@ app = typer.Typer(
 )
 
 
+@dataclass
+class ProcessSetup:
+    """
+    Logging and sentry configuration of the process,
+    applied again in every worker process of `run --workers`
+    """
+
+    logging_config: dict[str, Any]
+    sentry_dsn: str | None = None
+    sentry_environment: str | None = None
+
+    def apply(self) -> None:
+        import sentry_sdk
+
+        # Configure logging
+        logging.config.dictConfig(self.logging_config)
+
+        # Configure setnry
+        sentry_sdk.init(
+            dsn=self.sentry_dsn,
+            environment=self.sentry_environment,
+        )
+
+
 @app.command()
 def run(
+    ctx: typer.Context,
     host: str = "127.0.0.1",
     port: int = 8000,
     root_path: str = typer.Option("", envvar="API_ROOT_PATH"),
     db_url: str = typer.Option(..., envvar="DB_URL"),
     debug: bool = typer.Option(False, envvar="DEBUG"),
+    workers: int = typer.Option(
+        1, envvar="WORKERS", min=1, help="Number of server processes sharing the port"
+    ),
+    db_connection_budget: int = typer.Option(
+        0,
+        envvar="DB_CONNECTION_BUDGET",
+        help="Max connections of all workers together to each database, "
+        "splits it into the pool size of every worker, 0 for no limit",
+    ),
+    db_pool_size: int = typer.Option(
+        5, envvar="DB_POOL_SIZE", help="Connections kept open in the pool"
+    ),
+    db_max_overflow: int = typer.Option(
+        10, envvar="DB_MAX_OVERFLOW", help="Extra connections allowed under load"
+    ),
+    db_pool_timeout: float = typer.Option(
+        30.0, envvar="DB_POOL_TIMEOUT", help="Seconds to wait for a free connection"
+    ),
+    db_pool_recycle: int = typer.Option(
+        -1, envvar="DB_POOL_RECYCLE", help="Max connection age in seconds, -1 for none"
+    ),
+    db_pool_pre_ping: bool = typer.Option(
+        False, envvar="DB_POOL_PRE_PING", help="Test connections on checkout"
+    ),
+    db_statement_cache_size: int = typer.Option(
+        100,
+        envvar="DB_STATEMENT_CACHE_SIZE",
+        help="Prepared statements cached per connection, 0 to disable",
+    ),
+    db_pgbouncer: bool = typer.Option(
+        False,
+        envvar="DB_PGBOUNCER",
+        help="Connect through PgBouncer in transaction mode",
+    ),
+    db_listen_url: str | None = typer.Option(
+        None,
+        envvar="DB_LISTEN_URL",
+        help="Direct connection to the primary for LISTEN, "
+        "required by the post cache with --db-pgbouncer",
+    ),
+    db_replica_url: list[str] = typer.Option(
+        [],
+        envvar="DB_REPLICA_URLS",
+        help="Read replica for read-only queries, can be repeated",
+    ),
+    db_read_your_writes: bool = typer.Option(
+        True,
+        envvar="DB_READ_YOUR_WRITES",
+        help="Read from the primary for the rest of a request once it wrote",
+    ),
+    post_cache_size: int = typer.Option(
+        0, envvar="POST_CACHE_SIZE", help="Max number of cached posts, 0 to disable"
+    ),
+    post_cache_ttl: float = typer.Option(
+        30.0, envvar="POST_CACHE_TTL", help="Seconds a cached post is kept"
+    ),
+    coalesce: list[str] = typer.Option(
+        [],
+        envvar="COALESCED_METHODS",
+        help="PostRepo read method (view_post, view_posts, view_comment) "
+        "whose concurrent identical calls share one DB query, can be repeated",
+    ),
+    comment_batch_size: int = typer.Option(
+        0,
+        envvar="COMMENT_BATCH_SIZE",
+        min=0,
+        help="Insert concurrently created comments together, up to this many "
+        "per transaction, 0 to write every comment in its own transaction",
+    ),
+    comment_batch_delay: float = typer.Option(
+        0.005,
+        envvar="COMMENT_BATCH_DELAY",
+        min=0.0,
+        help="Max seconds a comment waits for more comments to be inserted with",
+    ),
+    access_log_sample_rate: float = typer.Option(
+        1.0,
+        envvar="ACCESS_LOG_SAMPLE_RATE",
+        help="Fraction of successful requests that are logged",
+    ),
+    access_log_slow_seconds: float | None = typer.Option(
+        None,
+        envvar="ACCESS_LOG_SLOW_SECONDS",
+        help="Always log requests slower than this",
+    ),
+    access_log_path_rate: list[str] = typer.Option(
+        [],
+        envvar="ACCESS_LOG_PATH_RATES",
+        help="PATH_PREFIX=RATE sample rate of successful requests "
+        "to matching paths, can be repeated",
+    ),
+    access_log_max_per_second: float = typer.Option(
+        0.0,
+        envvar="ACCESS_LOG_MAX_PER_SECOND",
+        help="Max access log lines per second, 0 for no limit",
+    ),
+    admission_max_in_flight: int = typer.Option(
+        0,
+        envvar="ADMISSION_MAX_IN_FLIGHT",
+        help="Reject API requests with 503 when this many are in flight "
+        "in the process, 0 for no limit",
+    ),
+    admission_adaptive: bool = typer.Option(
+        False,
+        envvar="ADMISSION_ADAPTIVE",
+        help="Lower the in-flight limit while responses are slow",
+    ),
+    admission_min_in_flight: int = typer.Option(
+        1,
+        envvar="ADMISSION_MIN_IN_FLIGHT",
+        help="Lowest adaptive in-flight limit",
+    ),
+    admission_target_latency_seconds: float = typer.Option(
+        0.5,
+        envvar="ADMISSION_TARGET_LATENCY_SECONDS",
+        help="Responses slower than this lower the adaptive limit",
+    ),
+    admission_retry_after_seconds: int = typer.Option(
+        1,
+        envvar="ADMISSION_RETRY_AFTER_SECONDS",
+        help="Retry-After of rejected requests",
+    ),
+    compression: bool = typer.Option(
+        True, envvar="COMPRESSION", help="Compress responses"
+    ),
+    compression_encoding: list[str] = typer.Option(
+        ["zstd", "br", "gzip"],
+        envvar="COMPRESSION_ENCODINGS",
+        help="Encoding to compress responses with, in order of preference, "
+        "can be repeated, encodings without an installed codec are skipped",
+    ),
+    compression_minimum_size: int = typer.Option(
+        1000,
+        envvar="COMPRESSION_MINIMUM_SIZE",
+        help="Responses with fewer bytes are not compressed",
+    ),
+    compression_level: list[str] = typer.Option(
+        [],
+        envvar="COMPRESSION_LEVELS",
+        help="ENCODING=LEVEL compression level, can be repeated",
+    ),
+    health_check_interval: float = typer.Option(
+        5.0,
+        envvar="HEALTH_CHECK_INTERVAL",
+        help="Seconds between background checks behind /ready",
+    ),
+    health_check_max_acquire_seconds: float = typer.Option(
+        1.0,
+        envvar="HEALTH_CHECK_MAX_ACQUIRE_SECONDS",
+        help="Not ready when getting a primary connection takes longer",
+    ),
+    health_check_max_pool_saturation: float = typer.Option(
+        0.9,
+        envvar="HEALTH_CHECK_MAX_POOL_SATURATION",
+        help="Not ready when a larger share of the primary pool is checked out",
+    ),
+    health_check_max_loop_lag_seconds: float = typer.Option(
+        0.5,
+        envvar="HEALTH_CHECK_MAX_LOOP_LAG_SECONDS",
+        help="Not ready when the event loop lags more",
+    ),
+    health_check_max_replica_lag_seconds: float = typer.Option(
+        30.0,
+        envvar="HEALTH_CHECK_MAX_REPLICA_LAG_SECONDS",
+        help="Eject read replicas that lag behind more",
+    ),
 ) -> None:
     """
     Run server
     """
+    settings = AppSettings(
+        db_url=db_url,
+        host=host,
+        port=port,
+        root_path=root_path,
+        debug=debug,
+        db_pool_size=db_pool_size,
+        db_max_overflow=db_max_overflow,
+        db_pool_timeout=db_pool_timeout,
+        db_pool_recycle=db_pool_recycle,
+        db_pool_pre_ping=db_pool_pre_ping,
+        db_statement_cache_size=db_statement_cache_size,
+        db_pgbouncer=db_pgbouncer,
+        db_listen_url=db_listen_url,
+        db_replica_urls=tuple(db_replica_url),
+        db_read_your_writes=db_read_your_writes,
+        post_cache_size=post_cache_size,
+        post_cache_ttl=post_cache_ttl,
+        coalesced_methods=tuple(coalesce),
+        comment_batch_size=comment_batch_size,
+        comment_batch_delay=comment_batch_delay,
+        access_log_sample_rate=access_log_sample_rate,
+        access_log_slow_seconds=access_log_slow_seconds,
+        access_log_path_rates=tuple(
+            _parse_path_rate(path_rate) for path_rate in access_log_path_rate
+        ),
+        access_log_max_per_second=access_log_max_per_second,
+        admission_max_in_flight=admission_max_in_flight,
+        admission_adaptive=admission_adaptive,
+        admission_min_in_flight=admission_min_in_flight,
+        admission_target_latency_seconds=admission_target_latency_seconds,
+        admission_retry_after_seconds=admission_retry_after_seconds,
+        compression=compression,
+        compression_encodings=tuple(compression_encoding),
+        compression_minimum_size=compression_minimum_size,
+        compression_levels=tuple(
+            _parse_encoding_level(encoding_level)
+            for encoding_level in compression_level
+        ),
+        health_check_interval=health_check_interval,
+        health_check_max_acquire_seconds=health_check_max_acquire_seconds,
+        health_check_max_pool_saturation=health_check_max_pool_saturation,
+        health_check_max_loop_lag_seconds=health_check_max_loop_lag_seconds,
+        health_check_max_replica_lag_seconds=health_check_max_replica_lag_seconds,
+    )
+
+    if workers > 1:
+        from {{cookiecutter.__project_slug}}.workers import run_workers, worker_settings
+
+        try:
+            settings = worker_settings(settings, workers, db_connection_budget)
+        except ValueError as e:
+            raise typer.BadParameter(str(e), param_hint="--db-connection-budget")
+        process_setup: ProcessSetup = ctx.obj
+        run_workers(settings, process_setup.apply, workers)
+        return
+
     import uvloop
 
     from {{cookiecutter.__project_slug}}.main import run_server
@@ -55,21 +305,53 @@ def run(
     uvloop.install()
 
     # Create event loop and run our server
-    asyncio.run(
-        run_server(
-            AppSettings(
-                db_url=db_url, host=host, port=port, root_path=root_path, debug=debug
-            )
-        )
-    )
+    asyncio.run(run_server(settings))
+
+
+@app.command()
+def reconcile_comment_counts(
+    db_url: str = typer.Option(..., envvar="DB_URL"),
+    batch_size: int = typer.Option(
+        1000, min=1, help="Posts recounted and locked per transaction"
+    ),
+    after_id: int = typer.Option(
+        0, help="Start after the post with this id, to resume an interrupted run"
+    ),
+) -> None:
+    """
+    Recount the comments of every post and fix posts.comment_count,
+    e.g. to backfill it after the migration that added it.
+    Safe to run while the server is running
+    """
+    import uvloop
+
+    from {{cookiecutter.__project_slug}} import main
+
+    uvloop.install()
+
+    asyncio.run(main.reconcile_comment_counts(db_url, batch_size, after_id))
 
 
 @app.callback()
 def global_vars(
+    ctx: typer.Context,
     verbose: bool = False,
     sentry_dsn: str | None = typer.Option(None, envvar="SENTRY_DSN"),
     sentry_environment: str | None = typer.Option(None, envvar="SENTRY_ENVIRONMENT"),
-    formatter: str = typer.Option("standard", envvar="LOG_FORMATTER"),
+    formatter: str = typer.Option(
+        "standard", envvar="LOG_FORMATTER", help="standard, json or json_fast"
+    ),
+    log_queue_size: int = typer.Option(
+        0,
+        envvar="LOG_QUEUE_SIZE",
+        help="Format and write logs in a background thread with a queue of up to "
+        "this many records, 0 to write them synchronously",
+    ),
+    log_queue_when_full: str = typer.Option(
+        "drop",
+        envvar="LOG_QUEUE_WHEN_FULL",
+        help="Whether to drop new records or block when the log queue is full",
+    ),
 ) -> None:
     """
     Hook that sets up
@@ -77,24 +359,57 @@ def global_vars(
 
     Will be executed before any other app command
     """
-    import sentry_sdk
-
     loglevel = logging.INFO
 
     if verbose:
         loglevel = logging.DEBUG
 
-    # Configure logging
-    logging.config.dictConfig(_get_logging_config(loglevel, formatter))
-
-    # Configure setnry
-    sentry_sdk.init(
-        dsn=sentry_dsn,
-        environment=sentry_environment,
+    process_setup = ProcessSetup(
+        logging_config=_get_logging_config(
+            loglevel, formatter, log_queue_size, log_queue_when_full
+        ),
+        sentry_dsn=sentry_dsn,
+        sentry_environment=sentry_environment,
     )
+    process_setup.apply()
+    ctx.obj = process_setup
+
+
+def _parse_path_rate(path_rate: str) -> tuple[str, float]:
+    prefix, _, rate = path_rate.rpartition("=")
+    try:
+        if prefix:
+            return prefix, float(rate)
+    except ValueError:
+        pass
+    raise typer.BadParameter(f"Expected PATH_PREFIX=RATE, got {path_rate!r}")
+
+
+def _parse_encoding_level(encoding_level: str) -> tuple[str, int]:
+    encoding, _, level = encoding_level.partition("=")
+    try:
+        if encoding:
+            return encoding, int(level)
+    except ValueError:
+        pass
+    raise typer.BadParameter(f"Expected ENCODING=LEVEL, got {encoding_level!r}")
 
 
-def _get_logging_config(level: int, formatter: str):
+def _get_logging_config(
+    level: int, formatter: str, queue_size: int = 0, queue_when_full: str = "drop"
+):
+    console: dict = {
+        "class": "logging.StreamHandler",
+        "formatter": formatter,
+    }
+    if queue_size > 0:
+        # Keeps formatting and writing of logs off the event loop
+        console = {
+            "()": "{{cookiecutter.__project_slug}}.log_queue.QueueStreamHandler",
+            "max_size": queue_size,
+            "when_full": queue_when_full,
+            "formatter": formatter,
+        }
     return {
         "version": 1,
         "disable_existing_loggers": False,
@@ -106,12 +421,14 @@ def _get_logging_config(level: int, formatter: str):
             "json": {
                 "()": "{{cookiecutter.__project_slug}}.slog.GcpStructuredFormatter",
             },
+            # json with orjson if it is installed
+            "json_fast": {
+                "()": "{{cookiecutter.__project_slug}}.slog.GcpStructuredFormatter",
+                "fast_json": True,
+            },
         },
         "handlers": {
-            "console": {
-                "class": "logging.StreamHandler",
-                "formatter": formatter,
-            },
+            "console": console,
         },
         "loggers": {
             "uvicorn": {"level": "WARNING"},
@@ -0,0 +1,196 @@
+"""
+Readiness of the service to receive traffic
+
+HealthMonitor checks the database in a background task every `interval`
+seconds and keeps the result, so that readiness probes never wait for
+the database and do not add load to it no matter how often they come.
+
+The service is not ready when:
+- the primary does not answer or a connection takes too long to acquire
+- the pool of the primary is (almost) exhausted
+- the event loop lags behind, i.e. the process is overloaded
+- the last check is too old, e.g. because the monitor hangs
+
+Replicas that lag behind the primary are ejected (see storage.replicas)
+instead, their reads go to the other replicas or the primary.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import asdict, dataclass, field
+from types import TracebackType
+from typing import Any, Callable, Optional, Type
+
+import sqlalchemy as sa
+
+from {{cookiecutter.__project_slug}}.storage.connection_pool import ConnectionPool
+from {{cookiecutter.__project_slug}}.storage.pool_metrics import InstrumentedAsyncQueuePool
+from {{cookiecutter.__project_slug}}.storage.replicas import Replica
+
+logger = logging.getLogger(__name__)
+
+# 0 when the standby replayed everything it received, so that an idle
+# primary does not look like lag. NULL on a database that is not a standby
+_REPLICA_LAG_QUERY = sa.text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+@dataclass(frozen=True)
+class HealthStatus:
+    # Reasons why the service is not ready, empty if it is
+    problems: tuple[str, ...]
+    # Monotonic time of the check
+    checked_at: float
+    acquire_seconds: float | None = None
+    pool_saturation: float = 0.0
+    loop_lag_seconds: float = 0.0
+    # None if the lag is unknown, e.g. the replica is unreachable
+    replica_lag_seconds: dict[str, float | None] = field(default_factory=dict)
+
+
+class HealthMonitor:
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        *,
+        interval: float = 5.0,
+        timeout: float = 2.0,
+        max_acquire_seconds: float = 1.0,
+        max_pool_saturation: float = 0.9,
+        max_loop_lag_seconds: float = 0.5,
+        max_replica_lag_seconds: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        interval: seconds between checks
+        timeout: max seconds a query of a check may take
+        max_acquire_seconds: max time to get a connection of the primary
+        max_pool_saturation: max share of the primary's pool (with overflow)
+            that is checked out
+        max_loop_lag_seconds: max delay of the event loop
+        max_replica_lag_seconds: replicas lagging more are ejected
+        """
+        self.pool = pool
+        self.interval = interval
+        self.timeout = timeout
+        self.max_acquire_seconds = max_acquire_seconds
+        self.max_pool_saturation = max_pool_saturation
+        self.max_loop_lag_seconds = max_loop_lag_seconds
+        self.max_replica_lag_seconds = max_replica_lag_seconds
+        self._clock = clock
+        self.status: HealthStatus | None = None
+        self._stopping = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def report(self) -> dict[str, Any]:
+        """Last status with the readiness verdict, does not touch the database"""
+        status = self.status
+        if status is None:
+            return {"ready": False, "problems": ["not checked yet"]}
+        problems = list(status.problems)
+        age = self._clock() - status.checked_at
+        if age > 3 * self.interval + self.timeout:
+            problems.append(f"last check {age:.1f}s ago")
+        report = asdict(status)
+        # Monotonic time means nothing outside of the process
+        del report["checked_at"]
+        return {
+            **report,
+            "ready": not problems,
+            "problems": problems,
+            "age_seconds": round(age, 3),
+        }
+
+    async def check(self, loop_lag_seconds: float = 0.0) -> HealthStatus:
+        problems: list[str] = []
+        if loop_lag_seconds > self.max_loop_lag_seconds:
+            problems.append(f"event loop lags {loop_lag_seconds:.3f}s")
+
+        acquire_seconds = None
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.timeout):
+                async with self.pool.engine.connect() as connection:
+                    acquire_seconds = time.perf_counter() - start
+                    await connection.execute(sa.text("SELECT 1"))
+        except Exception as e:
+            problems.append(f"primary failed: {e!r}")
+        else:
+            if acquire_seconds > self.max_acquire_seconds:
+                problems.append(f"primary connection took {acquire_seconds:.3f}s")
+
+        pool_saturation = 0.0
+        engine_pool = self.pool.engine.pool
+        if isinstance(engine_pool, InstrumentedAsyncQueuePool):
+            pool_saturation = engine_pool.saturation()
+        if pool_saturation > self.max_pool_saturation:
+            problems.append(f"primary pool {pool_saturation:.0%} checked out")
+
+        replica_lag_seconds: dict[str, float | None] = {}
+        for replica in self.pool.replicas:
+            lag = await self._replica_lag(replica)
+            if lag is not None and lag > self.max_replica_lag_seconds:
+                replica.eject()
+            replica_lag_seconds[replica.name] = lag
+
+        return HealthStatus(
+            problems=tuple(problems),
+            checked_at=self._clock(),
+            acquire_seconds=acquire_seconds,
+            pool_saturation=pool_saturation,
+            loop_lag_seconds=loop_lag_seconds,
+            replica_lag_seconds=replica_lag_seconds,
+        )
+
+    async def _replica_lag(self, replica: Replica) -> float | None:
+        try:
+            async with asyncio.timeout(self.timeout):
+                async with replica.engine.connect() as connection:
+                    lag = await connection.scalar(_REPLICA_LAG_QUERY)
+        except Exception:
+            # Unreachable replicas are ejected by their connection errors
+            logger.warning("Lag check of %s failed", replica.name, exc_info=True)
+            return None
+        return None if lag is None else float(lag)
+
+    async def _run(self) -> None:
+        loop_lag_seconds = 0.0
+        while not self._stopping.is_set():
+            try:
+                status = await self.check(loop_lag_seconds)
+            except Exception:
+                logger.exception("Health check failed")
+            else:
+                was_ready = self.status is not None and not self.status.problems
+                if status.problems and (was_ready or self.status is None):
+                    logger.warning("Not ready: %s", "; ".join(status.problems))
+                elif not status.problems and not was_ready:
+                    logger.info("Ready")
+                self.status = status
+            # The wait takes longer than requested when the loop is busy
+            started = self._clock()
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except TimeoutError:
+                loop_lag_seconds = max(self._clock() - started - self.interval, 0.0)
+
+    async def __aenter__(self):
+        self._stopping.clear()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ):
+        if self._task is not None:
+            # Cancelling a query in progress would break its connection,
+            # let the current check finish, its queries have a timeout
+            self._stopping.set()
+            await self._task
+            self._task = None
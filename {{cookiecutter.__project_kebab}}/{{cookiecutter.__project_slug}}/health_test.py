@@ -0,0 +1,131 @@
+"""
+Tests of the readiness checks (health.py)
+"""
+
+import asyncio
+
+import pytest
+from httpx import AsyncClient
+
+from .health import HealthMonitor, HealthStatus
+from .storage.connection_pool import ConnectionPool
+from .storage.replicas import Replica
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _db_url(pool: ConnectionPool) -> str:
+    return pool.engine.url.render_as_string(hide_password=False)
+
+
+@pytest.mark.asyncio
+async def test_ready(db_connection_pool: ConnectionPool):
+    monitor = HealthMonitor(db_connection_pool)
+
+    status = await monitor.check()
+
+    assert status.problems == ()
+    assert status.acquire_seconds is not None
+    # The connection of the check is back in the pool
+    assert status.pool_saturation == 0.0
+    monitor.status = status
+    report = monitor.report()
+    assert report["ready"] is True
+    assert report["problems"] == []
+
+
+@pytest.mark.asyncio
+async def test_not_ready_before_first_check(api_client: AsyncClient):
+    response = await api_client.get("/ready")
+    assert response.status_code == 503
+    assert response.json() == {"ready": False, "problems": ["not checked yet"]}
+
+    # Liveness does not depend on the checks
+    response = await api_client.get("/health")
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_not_ready_when_primary_is_unreachable():
+    async with ConnectionPool("postgresql+asyncpg://postgres@127.0.0.1:1/test") as pool:
+        status = await HealthMonitor(pool).check()
+
+    [problem] = status.problems
+    assert problem.startswith("primary failed")
+    assert status.acquire_seconds is None
+
+
+@pytest.mark.asyncio
+async def test_not_ready_when_pool_is_exhausted(db_connection_pool: ConnectionPool):
+    async with ConnectionPool(
+        _db_url(db_connection_pool), pool_size=1, max_overflow=0
+    ) as pool:
+        monitor = HealthMonitor(pool, timeout=0.2)
+        async with pool.engine.connect():
+            status = await monitor.check()
+
+    assert status.pool_saturation == 1.0
+    assert [problem.split(":")[0] for problem in status.problems] == [
+        "primary failed",
+        "primary pool 100% checked out",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_not_ready_when_event_loop_lags(db_connection_pool: ConnectionPool):
+    monitor = HealthMonitor(db_connection_pool, max_loop_lag_seconds=0.5)
+    status = await monitor.check(loop_lag_seconds=0.7)
+    assert status.problems == ("event loop lags 0.700s",)
+
+
+@pytest.mark.asyncio
+async def test_not_ready_when_check_is_stale(db_connection_pool: ConnectionPool):
+    clock = _Clock()
+    monitor = HealthMonitor(db_connection_pool, interval=5, timeout=2, clock=clock)
+    monitor.status = HealthStatus(problems=(), checked_at=0.0)
+
+    clock.now = 17.0
+    assert monitor.report()["ready"] is True
+
+    clock.now = 17.5
+    report = monitor.report()
+    assert report["ready"] is False
+    assert report["problems"] == ["last check 17.5s ago"]
+
+
+class _LaggingMonitor(HealthMonitor):
+    async def _replica_lag(self, replica: Replica) -> float | None:
+        return {"replica0": 60.0, "replica1": 1.0}[replica.name]
+
+
+@pytest.mark.asyncio
+async def test_lagging_replica_is_ejected(db_connection_pool: ConnectionPool):
+    db_url = _db_url(db_connection_pool)
+    async with ConnectionPool(db_url, replica_urls=[db_url, db_url]) as pool:
+        # The test database is not a standby, its lag is unknown
+        status = await HealthMonitor(pool).check()
+        assert status.replica_lag_seconds == {"replica0": None, "replica1": None}
+        assert all(replica.healthy for replica in pool.replicas)
+
+        status = await _LaggingMonitor(pool, max_replica_lag_seconds=30).check()
+
+        # Lagging replicas do not make the service unready
+        assert status.problems == ()
+        assert status.replica_lag_seconds == {"replica0": 60.0, "replica1": 1.0}
+        assert [replica.healthy for replica in pool.replicas] == [False, True]
+
+
+@pytest.mark.asyncio
+async def test_checks_in_background(db_connection_pool: ConnectionPool):
+    async with HealthMonitor(db_connection_pool, interval=0.01) as monitor:
+        for _ in range(100):
+            if monitor.status is not None:
+                break
+            await asyncio.sleep(0.01)
+        assert monitor.report()["ready"] is True
@@ -0,0 +1,117 @@
+"""
+Non-blocking log output
+
+QueueStreamHandler only puts records into a bounded queue,
+formatting and writing them to the stream happens in a background thread,
+so that slow stdout does not block the event loop.
+
+Usage:
+
+configure it as a handler with "()": "{{cookiecutter.__project_slug}}.log_queue.QueueStreamHandler"
+and any formatter, see cli._get_logging_config
+"""
+
+import copy
+import logging
+import queue
+import traceback
+from logging.handlers import QueueHandler, QueueListener
+from typing import TextIO
+
+from prometheus_client import Counter
+
+from {{cookiecutter.__project_slug}}.slog import CAPTURED_LABELS, CONTEXT_LABELS
+
+__all__ = ["QueueStreamHandler", "QUEUE_FULL_POLICIES"]
+
+# What to do with a new record when the queue is full:
+# "drop" it (and count it) or "block" the logging thread until there is space
+QUEUE_FULL_POLICIES = ("drop", "block")
+
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped",
+    "Log records dropped because the log queue was full",
+)
+
+
+class _Listener(QueueListener):
+    def __init__(
+        self, records: "queue.Queue[logging.LogRecord | None]", handler: logging.Handler
+    ):
+        super().__init__(records, handler)
+        self._records = records
+
+    def enqueue_sentinel(self) -> None:
+        # The queue may be full, wait for the thread to make space
+        # instead of failing to stop. None is the sentinel of QueueListener
+        self._records.put(None)
+
+
+class QueueStreamHandler(QueueHandler):
+    def __init__(
+        self,
+        max_size: int = 10000,
+        when_full: str = "drop",
+        stream: TextIO | None = None,
+    ):
+        """
+        max_size: max number of records waiting to be written
+        when_full: one of QUEUE_FULL_POLICIES
+        stream: where to write, stderr by default
+        """
+        if when_full not in QUEUE_FULL_POLICIES:
+            raise ValueError(
+                f"when_full must be one of {QUEUE_FULL_POLICIES}, got {when_full!r}"
+            )
+        if max_size <= 0:
+            raise ValueError("max_size must be positive, the queue must be bounded")
+        self._queue = queue.Queue[logging.LogRecord | None](max_size)
+        super().__init__(self._queue)
+        self.when_full = when_full
+        self.stream_handler = logging.StreamHandler(stream)
+        self._listener = _Listener(self._queue, self.stream_handler)
+        self._listener.start()
+        self._listening = True
+
+    def setFormatter(self, fmt: logging.Formatter | None) -> None:
+        # Records are formatted by the stream handler in the background thread
+        self.stream_handler.setFormatter(fmt)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Do not spend time on preparing a record that is dropped anyway
+        if self.when_full == "drop" and self._queue.full():
+            LOG_RECORDS_DROPPED.inc()
+            return
+        super().emit(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Resolve everything that depends on the calling thread or context,
+        the rest of formatting is left to the background thread
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        setattr(record, CAPTURED_LABELS, CONTEXT_LABELS.get() or {})
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info))
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.when_full == "block":
+            self._queue.put(record)
+            return
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+    def close(self) -> None:
+        """Write out all queued records, called on logging.shutdown at exit"""
+        # close() is called again by logging.shutdown after reconfiguration
+        if self._listening:
+            self._listening = False
+            self._listener.stop()
+            self.stream_handler.close()
+        super().close()
@@ -0,0 +1,123 @@
+"""
+Tests of the background log queue (log_queue.py)
+"""
+
+import io
+import logging
+import threading
+from typing import Generator
+
+import pytest
+from prometheus_client import REGISTRY
+
+from .log_queue import QueueStreamHandler
+from .slog import GcpStructuredFormatter, logging_context
+from .testing_utils.log import JsonLogs
+
+
+class _ThreadRecordingFormatter(GcpStructuredFormatter):
+    def __init__(self):
+        super().__init__()
+        self.threads: set[int] = set()
+
+    def format(self, record: logging.LogRecord) -> str:
+        self.threads.add(threading.get_ident())
+        return super().format(record)
+
+
+class _BlockingStream(io.StringIO):
+    """Stream whose writes wait until released"""
+
+    def __init__(self):
+        super().__init__()
+        self.writing = threading.Event()
+        self.released = threading.Event()
+
+    def write(self, s: str) -> int:
+        self.writing.set()
+        self.released.wait(timeout=5)
+        return super().write(s)
+
+
+@pytest.fixture()
+def queue_logger() -> Generator[logging.Logger, None, None]:
+    logger = logging.getLogger("log_queue_test")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    try:
+        yield logger
+    finally:
+        for handler in logger.handlers.copy():
+            logger.removeHandler(handler)
+            handler.close()
+
+
+def _dropped() -> float:
+    return REGISTRY.get_sample_value("log_records_dropped_total") or 0.0
+
+
+def test_queue_stream_handler(queue_logger: logging.Logger):
+    output = JsonLogs()
+    formatter = _ThreadRecordingFormatter()
+    handler = QueueStreamHandler(stream=output)
+    handler.setFormatter(formatter)
+    queue_logger.addHandler(handler)
+
+    with logging_context(request_id="abc"):
+        queue_logger.info("hello %s", "world", extra={"a": 1})
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            queue_logger.exception("failed")
+
+    # Closing writes out everything that is still queued
+    handler.close()
+
+    [hello, failed] = output.parse()
+    assert hello["message"] == "hello world"
+    assert hello["logging.googleapis.com/labels"] == {
+        "logger": "log_queue_test",
+        "request_id": "abc",
+        "a": "1",
+    }
+    assert failed["logging.googleapis.com/labels"]["request_id"] == "abc"
+    assert "ValueError: boom" in failed["traceback"]
+    assert formatter.threads and threading.get_ident() not in formatter.threads
+
+
+def test_queue_stream_handler_drops_when_full(queue_logger: logging.Logger):
+    stream = _BlockingStream()
+    handler = QueueStreamHandler(max_size=1, stream=stream)
+    queue_logger.addHandler(handler)
+    dropped = _dropped()
+
+    queue_logger.info("being written")
+    assert stream.writing.wait(timeout=5)
+    queue_logger.info("queued")
+    queue_logger.info("dropped")
+    assert _dropped() == dropped + 1
+
+    stream.released.set()
+    handler.close()
+    assert stream.getvalue().splitlines() == ["being written", "queued"]
+
+
+def test_queue_stream_handler_blocks_when_full(queue_logger: logging.Logger):
+    stream = _BlockingStream()
+    handler = QueueStreamHandler(max_size=1, when_full="block", stream=stream)
+    queue_logger.addHandler(handler)
+
+    queue_logger.info("being written")
+    assert stream.writing.wait(timeout=5)
+    queue_logger.info("queued")
+    threading.Timer(0.1, stream.released.set).start()
+    # Waits for the writer instead of dropping
+    queue_logger.info("blocked")
+
+    handler.close()
+    assert stream.getvalue().splitlines() == ["being written", "queued", "blocked"]
+
+
+def test_queue_stream_handler_invalid_policy():
+    with pytest.raises(ValueError):
+        QueueStreamHandler(when_full="retry")
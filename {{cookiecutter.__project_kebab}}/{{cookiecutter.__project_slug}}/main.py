@@ -4,33 +4,66 @@ Server entry-point with FastAPI app defined
 
 import logging
 import logging.config
-from typing import Any
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
 
 import uvicorn
 from fastapi import FastAPI, Request
 from fastapi.openapi.utils import get_openapi
-from fastapi.responses import RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse
 from starlette_exporter import handle_metrics
 from starlette_exporter.middleware import PrometheusMiddleware
 
+from {{cookiecutter.__project_slug}}.admission import (
+    AdmissionMiddleware,
+    ConcurrencyLimit,
+    route_priorities,
+)
 from {{cookiecutter.__project_slug}}.api import api_router
 from {{cookiecutter.__project_slug}}.application_context import ApplicationContext, AppSettings
+from {{cookiecutter.__project_slug}}.response_compression import CompressionMiddleware
 from {{cookiecutter.__project_slug}}.storage.connection_pool import ConnectionPool
-from {{cookiecutter.__project_slug}}.tracking import TrackingMiddleware
+from {{cookiecutter.__project_slug}}.storage.post_repo import PostRepo
+from {{cookiecutter.__project_slug}}.tracking import AccessLogSampler, TrackingMiddleware
 
 logger = logging.getLogger(__name__)
 
 # Configuration of prometheus middleware
 BUCKETS = [0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0]
-SKIP_PATHS = ["/health", "/metrics", "/", "/docs", "/openapi.json"]
+SKIP_PATHS = ["/health", "/ready", "/metrics", "/", "/docs", "/openapi.json"]
 
 
 def make_app(application_context: ApplicationContext) -> FastAPI:
     """
     Creates fastapi APP and registers basic health and metrics endpoints
     """
-    root_path = application_context.app_settings.root_path
+    settings = application_context.app_settings
+    root_path = settings.root_path
     app = FastAPI(root_path=root_path)
+    router = api_router(application_context)
+
+    # Innermost, so that rejected requests are still logged and measured
+    if settings.admission_max_in_flight > 0:
+        app.add_middleware(
+            AdmissionMiddleware,
+            limit=ConcurrencyLimit(
+                settings.admission_max_in_flight,
+                adaptive=settings.admission_adaptive,
+                min_in_flight=settings.admission_min_in_flight,
+                target_latency=settings.admission_target_latency_seconds,
+            ),
+            priority_of=route_priorities(router.routes),
+            retry_after_seconds=settings.admission_retry_after_seconds,
+        )
+
+    # Inside tracking, so that the access log reports the compressed size
+    if settings.compression:
+        app.add_middleware(
+            CompressionMiddleware,
+            encodings=settings.compression_encodings,
+            minimum_size=settings.compression_minimum_size,
+            levels=dict(settings.compression_levels),
+        )
 
     app.add_middleware(
         PrometheusMiddleware,
@@ -42,16 +75,31 @@ def make_app(application_context: ApplicationContext) -> FastAPI:
     )
 
     # Enable context based tracking
-    app.add_middleware(TrackingMiddleware)
+    app.add_middleware(
+        TrackingMiddleware,
+        sampler=AccessLogSampler(
+            success_rate=settings.access_log_sample_rate,
+            slow_seconds=settings.access_log_slow_seconds,
+            path_rates=dict(settings.access_log_path_rates),
+            max_per_second=settings.access_log_max_per_second,
+        ),
+    )
 
     app.add_route("/metrics", handle_metrics)
 
-    # Health check endpoint
+    # Liveness, must not depend on the database:
+    # restarting the process does not help when the database is down
     @app.get("/health", include_in_schema=False)
     async def health() -> str:
-        """Checks health of application, including database and all systems"""
+        """Checks that the application is up and serves requests"""
         return "OK"
 
+    # Readiness from the last background check of the database and load
+    @app.get("/ready", include_in_schema=False)
+    async def ready() -> JSONResponse:
+        report = application_context.health_monitor.report()
+        return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
     @app.get("/", include_in_schema=False)
     async def index(request: Request) -> RedirectResponse:
         # the redirect must be absolute (start with /) because
@@ -60,7 +108,7 @@ def make_app(application_context: ApplicationContext) -> FastAPI:
         # /app/ -> /app/docs
         return RedirectResponse(f"{str(request.base_url).rstrip('/')}/docs")
 
-    app.include_router(api_router(application_context))
+    app.include_router(router)
 
     # We need to specify custom OpenAPI to add app.root_path to servers
     def custom_openapi() -> Any:
@@ -81,11 +129,37 @@ def make_app(application_context: ApplicationContext) -> FastAPI:
     return app
 
 
+@asynccontextmanager
+async def open_app(settings: AppSettings) -> AsyncIterator[FastAPI]:
+    """App with its own connection pool, which is closed on exit"""
+    async with ConnectionPool(
+        settings.db_url,
+        settings.debug,
+        replica_urls=settings.db_replica_urls,
+        read_your_writes=settings.db_read_your_writes,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        statement_cache_size=settings.db_statement_cache_size,
+        pgbouncer=settings.db_pgbouncer,
+        listen_url=settings.db_listen_url,
+    ) as pool:
+        application_context = ApplicationContext.create_with_settings(pool, settings)
+        async with application_context.health_monitor:
+            try:
+                yield make_app(application_context)
+            finally:
+                # After the server stopped taking requests, the comments
+                # still waiting for their batch are written before the
+                # connection pool is closed
+                await application_context.post_repo.close()
+
+
 # This is called in cli.py on "run" command
 async def run_server(settings: AppSettings):
-    async with ConnectionPool(settings.db_url, settings.debug) as pool:
-        application_context = ApplicationContext.create_with_settings(pool, settings)
-        app = make_app(application_context)
+    async with open_app(settings) as app:
         config = uvicorn.Config(
             app,
             host=settings.host,
@@ -98,3 +172,18 @@ async def run_server(settings: AppSettings):
         logging.info("Serving on http://%s:%s", settings.host, settings.port)
 
         await api_server.serve()
+
+
+async def reconcile_comment_counts(
+    db_url: str, batch_size: int = 1000, after_id: int = 0
+) -> None:
+    """Fix the comment counts of all posts, see PostRepo.reconcile_comment_counts"""
+    async with ConnectionPool(db_url) as pool:
+        post_repo = PostRepo(pool)
+        async for batch in post_repo.reconcile_comment_counts(batch_size, after_id):
+            logging.info(
+                "Reconciled comment counts of %d posts up to id %d, fixed %d",
+                batch.posts,
+                batch.last_id,
+                batch.fixed,
+            )
@@ -0,0 +1,245 @@
+"""
+Response compression
+
+Compresses text-like responses (JSON, NDJSON, text) with the encoding
+preferred by the client's Accept-Encoding among the configured ones.
+Streamed responses are compressed chunk by chunk, every chunk is flushed
+so that the client receives it right away.
+"""
+
+import zlib
+from functools import partial
+from typing import Callable, Iterable, Mapping, Protocol
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli  # pyright: ignore[reportMissingImports]
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    # Standard library since python 3.14
+    from compression import zstd  # pyright: ignore[reportMissingImports]
+except ImportError:  # pragma: no cover
+    zstd = None
+
+# In order of preference when the client accepts several of them equally
+ENCODINGS = ("zstd", "br", "gzip")
+
+DEFAULT_LEVELS = {
+    "zstd": 3,
+    # Brotli's default 11 is meant for static files, too slow for responses
+    "br": 4,
+    "gzip": 6,
+}
+
+
+class _Compressor(Protocol):
+    def compress(self, data: bytes, final: bool) -> bytes:
+        """
+        Compressed `data`, flushed so that it can be decompressed as it is.
+        `final` ends the compressed stream
+        """
+        ...
+
+
+class _GzipCompressor:
+    def __init__(self, level: int):
+        # wbits 16 + 15 writes the gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        mode = zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH
+        return self._compressor.compress(data) + self._compressor.flush(mode)
+
+
+class _BrotliCompressor:
+    def __init__(self, level: int):
+        assert brotli is not None
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        compressed = self._compressor.process(data)
+        if final:
+            return compressed + self._compressor.finish()
+        return compressed + self._compressor.flush()
+
+
+class _ZstdCompressor:
+    def __init__(self, level: int):
+        assert zstd is not None
+        self._compressor = zstd.ZstdCompressor(level=level)
+        self._flush_block = zstd.ZstdCompressor.FLUSH_BLOCK
+        self._flush_frame = zstd.ZstdCompressor.FLUSH_FRAME
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        mode = self._flush_frame if final else self._flush_block
+        return self._compressor.compress(data, mode)
+
+
+def available_encodings() -> list[str]:
+    """ENCODINGS whose codec is installed"""
+    installed = {"zstd": zstd is not None, "br": brotli is not None, "gzip": True}
+    return [encoding for encoding in ENCODINGS if installed[encoding]]
+
+
+def _accepted(accept_encoding: str) -> dict[str, float]:
+    """Quality value of every encoding listed in Accept-Encoding"""
+    accepted: dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        encoding, _, params = item.partition(";")
+        quality = 1.0
+        name, _, value = params.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        accepted[encoding.strip().lower()] = quality
+    return accepted
+
+
+def _is_compressible(content_type: str | None) -> bool:
+    if content_type is None:
+        return False
+    media_type = content_type.partition(";")[0].strip().lower()
+    return media_type.startswith("text/") or media_type.endswith(
+        ("json", "xml", "javascript")
+    )
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        encodings: Iterable[str] = ENCODINGS,
+        minimum_size: int = 1000,
+        levels: Mapping[str, int] | None = None,
+    ):
+        """
+        encodings: in order of preference, those without
+            an installed codec (see available_encodings) are skipped
+        minimum_size: responses with a smaller body are sent uncompressed,
+            streamed responses are always compressed
+        levels: compression level of each encoding, see DEFAULT_LEVELS
+        """
+        encodings = list(encodings)
+        if unknown := (set(encodings) | set(levels or {})) - set(ENCODINGS):
+            raise ValueError(f"Unknown encodings {sorted(unknown)}")
+        self.app = app
+        available = available_encodings()
+        self.encodings = [encoding for encoding in encodings if encoding in available]
+        self.minimum_size = minimum_size
+        self.levels = {**DEFAULT_LEVELS, **(levels or {})}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # The body of HEAD responses is empty, their headers describe
+        # the body of GET responses, which is compressed or not by its size
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = None
+        for key, value in scope.get("headers", ()):
+            if key.lower() == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = self._negotiate(accept_encoding)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = _CompressingResponder(
+            send, encoding, partial(self._compressor, encoding), self.minimum_size
+        )
+        await self.app(scope, receive, responder.send)
+
+    def _negotiate(self, accept_encoding: str | None) -> str | None:
+        if not accept_encoding:
+            return None
+        accepted = _accepted(accept_encoding)
+        best, best_quality = None, 0.0
+        for encoding in self.encodings:
+            quality = accepted.get(encoding, accepted.get("*", 0.0))
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def _compressor(self, encoding: str) -> _Compressor:
+        level = self.levels[encoding]
+        if encoding == "zstd":
+            return _ZstdCompressor(level)
+        if encoding == "br":
+            return _BrotliCompressor(level)
+        return _GzipCompressor(level)
+
+
+class _CompressingResponder:
+    """
+    Holds back the response start until the first body message
+    tells whether the response is worth compressing
+    """
+
+    def __init__(
+        self,
+        send: Send,
+        encoding: str,
+        new_compressor: Callable[[], _Compressor],
+        minimum_size: int,
+    ):
+        self._send = send
+        self._encoding = encoding
+        self._new_compressor = new_compressor
+        self._minimum_size = minimum_size
+        self._start: Message | None = None
+        # Created only for responses that are compressed
+        self._compressor: _Compressor | None = None
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self._start = message
+            return
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+        if self._start is None:
+            if self._compressor is not None:
+                message = self._compress(message)
+            await self._send(message)
+            return
+
+        start, self._start = self._start, None
+        headers = MutableHeaders(raw=list(start.get("headers", [])))
+        body: bytes = message.get("body", b"")
+        more_body: bool = message.get("more_body", False)
+        if (
+            "content-encoding" not in headers
+            and _is_compressible(headers.get("content-type"))
+            and (more_body or len(body) >= self._minimum_size)
+        ):
+            self._compressor = self._new_compressor()
+            message = self._compress(message)
+            headers["content-encoding"] = self._encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                # Unknown until the whole body is compressed
+                del headers["content-length"]
+            else:
+                headers["content-length"] = str(len(message["body"]))
+            # The compressed body is no longer byte-for-byte the same
+            if (etag := headers.get("etag")) is not None and not etag.startswith("W/"):
+                headers["etag"] = f"W/{etag}"
+            start = {**start, "headers": headers.raw}
+        await self._send(start)
+        await self._send(message)
+
+    def _compress(self, message: Message) -> Message:
+        assert self._compressor is not None
+        more_body = message.get("more_body", False)
+        return {
+            "type": "http.response.body",
+            "body": self._compressor.compress(
+                message.get("body", b""), final=not more_body
+            ),
+            "more_body": more_body,
+        }
@@ -0,0 +1,186 @@
+"""
+Tests of response compression (response_compression.py)
+"""
+
+import asyncio
+import gzip
+import zlib
+
+import pytest
+from starlette.responses import Response, StreamingResponse
+from starlette.types import ASGIApp, Message, Scope
+
+from .response_compression import CompressionMiddleware, available_encodings
+from .testing_utils.log import JsonLogs
+from .tracking import TrackingMiddleware
+
+BODY = b'{"title": "Post"}' * 100
+
+
+def _scope(accept_encoding: str | None, method: str = "GET") -> Scope:
+    headers = []
+    if accept_encoding is not None:
+        headers.append((b"accept-encoding", accept_encoding.encode()))
+    return {
+        "type": "http",
+        "method": method,
+        "http_version": "1.1",
+        "headers": headers,
+        "path": "/posts",
+        "query_string": b"",
+    }
+
+
+async def _call(app: ASGIApp, scope: Scope) -> list[Message]:
+    sent: list[Message] = []
+    body_received = False
+
+    async def receive() -> Message:
+        nonlocal body_received
+        if body_received:
+            # Client stays connected
+            await asyncio.Future()
+        body_received = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: Message) -> None:
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent
+
+
+def _headers(start: Message) -> dict[str, str]:
+    return {key.decode(): value.decode() for key, value in start["headers"]}
+
+
+def _response(
+    body: bytes = BODY,
+    media_type: str = "application/json",
+    headers: dict[str, str] | None = None,
+) -> ASGIApp:
+    return Response(body, media_type=media_type, headers=headers)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "accept_encoding, encoding",
+    [
+        ("gzip", "gzip"),
+        ("gzip, deflate", "gzip"),
+        ("GZIP;q=0.5", "gzip"),
+        ("*", "gzip"),
+        ("gzip;q=0", None),
+        ("*, gzip;q=0", None),
+        ("deflate", None),
+        ("", None),
+        (None, None),
+    ],
+)
+async def test_negotiation(accept_encoding: str | None, encoding: str | None):
+    app = CompressionMiddleware(_response(), encodings=["gzip"])
+    start, body = await _call(app, _scope(accept_encoding))
+    headers = _headers(start)
+    assert headers.get("content-encoding") == encoding
+    if encoding is None:
+        assert body["body"] == BODY
+    else:
+        assert gzip.decompress(body["body"]) == BODY
+        assert headers["content-length"] == str(len(body["body"]))
+        assert headers["vary"] == "Accept-Encoding"
+
+
+def test_preferred_encoding():
+    app = CompressionMiddleware(_response(), encodings=["zstd", "br", "gzip"])
+    # Ties go to the server order, higher quality wins
+    assert app._negotiate("gzip, br, zstd") == app.encodings[0]
+    assert app._negotiate("gzip;q=1, zstd;q=0.5, br;q=0.5") == "gzip"
+    # Codecs that are not installed are never negotiated
+    assert app.encodings == [
+        encoding
+        for encoding in ["zstd", "br", "gzip"]
+        if encoding in available_encodings()
+    ]
+
+
+def test_unknown_encoding():
+    with pytest.raises(ValueError, match="deflate"):
+        CompressionMiddleware(_response(), encodings=["deflate"])
+    with pytest.raises(ValueError, match="lzma"):
+        CompressionMiddleware(_response(), levels={"lzma": 1})
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "response, method, content_encoding",
+    [
+        # Below minimum_size
+        (_response(b'{"id": 1}'), "GET", None),
+        # Not worth compressing
+        (_response(media_type="image/png"), "GET", None),
+        # Already compressed
+        (_response(headers={"content-encoding": "br"}), "GET", "br"),
+        (_response(), "HEAD", None),
+    ],
+)
+async def test_not_compressed(
+    response: ASGIApp, method: str, content_encoding: str | None
+):
+    app = CompressionMiddleware(response, encodings=["gzip"])
+    start, _ = await _call(app, _scope("gzip", method=method))
+    headers = _headers(start)
+    assert headers.get("content-encoding") == content_encoding
+    assert "vary" not in headers
+
+
+@pytest.mark.asyncio
+async def test_streaming():
+    chunks = [b'{"id": %d}\n' % i for i in range(3)]
+
+    async def lines():
+        for chunk in chunks:
+            yield chunk
+
+    app = CompressionMiddleware(
+        StreamingResponse(lines(), media_type="application/x-ndjson"),
+        encodings=["gzip"],
+    )
+    start, *bodies = await _call(app, _scope("gzip"))
+    headers = _headers(start)
+    assert headers["content-encoding"] == "gzip"
+    assert "content-length" not in headers
+
+    # Every chunk is decompressed as soon as it arrives
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk, body in zip(chunks, bodies):
+        assert body["more_body"]
+        assert decompressor.decompress(body["body"]) == chunk
+    assert not bodies[-1]["more_body"]
+    assert decompressor.decompress(bodies[-1]["body"]) == b""
+    assert decompressor.eof
+
+
+@pytest.mark.asyncio
+async def test_weak_etag():
+    app = CompressionMiddleware(
+        _response(headers={"etag": '"abc"'}), encodings=["gzip"]
+    )
+    start, _ = await _call(app, _scope("gzip"))
+    assert _headers(start)["etag"] == 'W/"abc"'
+
+    app = CompressionMiddleware(
+        _response(headers={"etag": 'W/"abc"'}), encodings=["gzip"]
+    )
+    start, _ = await _call(app, _scope("gzip"))
+    assert _headers(start)["etag"] == 'W/"abc"'
+
+
+@pytest.mark.asyncio
+async def test_access_log_response_size(structured_logs_capture: JsonLogs):
+    sent = await _call(
+        TrackingMiddleware(CompressionMiddleware(_response(), encodings=["gzip"])),
+        _scope("gzip"),
+    )
+    [log] = structured_logs_capture.parse()
+    assert log["httpRequest"]["responseSize"] == len(sent[1]["body"])
+    assert log["httpRequest"]["responseSize"] < len(BODY)
@@ -16,10 +16,17 @@ see 'slog_tests.test_structured_logging' for more detailed usage example
 import contextvars
 import json
 import logging
+import math
+import time
 import traceback
 from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import orjson  # pyright: ignore[reportMissingImports]
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
 
 __all__ = ["GcpStructuredFormatter", "logging_context"]
 
@@ -29,6 +36,10 @@ CONTEXT_LABELS = contextvars.ContextVar[Optional[Dict[str, Any]]](
     default=None,
 )
 
+# Record attribute with the logging context labels captured when the record
+# was created, for records formatted outside of that context (e.g. in a thread)
+CAPTURED_LABELS = "context_labels"
+
 
 @contextmanager
 def logging_context(**kwargs: Any | None):
@@ -72,8 +83,18 @@ RESERVED = {
     "process",
     "httpRequest",
     "taskName",
+    # Set on the record by logging.Formatter if another handler formatted it first
+    "message",
+    "asctime",
+    CAPTURED_LABELS,
 }
 
+# Attributes of a record that are never labels: the reserved ones
+# and everything a plain LogRecord has, precomputed once instead of per record
+_NOT_LABELS = frozenset(RESERVED) | frozenset(
+    logging.LogRecord("", logging.INFO, "", 0, "", None, None).__dict__
+)
+
 
 def _local_timestamp_to_utc(local_unix_timestamp: float) -> str:
     """
@@ -96,6 +117,20 @@ def _local_timestamp_to_utc(local_unix_timestamp: float) -> str:
 
 
 class GcpStructuredFormatter(logging.Formatter):
+    def __init__(self, fast_json: bool = False):
+        """
+        fast_json: encode with orjson if it is installed, its output
+            has no whitespace between items but is otherwise the same
+        """
+        super().__init__()
+        self._dumps: Callable[[dict[str, Any]], str] = json.JSONEncoder().encode
+        if fast_json and orjson is not None:
+            dumps = orjson.dumps
+            self._dumps = lambda payload: dumps(payload).decode()
+        # (second, formatted second) of the last record,
+        # records of the same second only need their microseconds formatted
+        self._time_cache: tuple[int, str] = (-1, "")
+
     def format(self, record: logging.LogRecord) -> str:
         payload = {
             "severity": record.levelname,
@@ -103,7 +138,7 @@ class GcpStructuredFormatter(logging.Formatter):
             # Since we are formating with 'Z' at the end (a.k.a UTC time)
             # we must use our own converter oppsed to self.converter
             # to prevent invalid time formats if user configures self.converter
-            "time": _local_timestamp_to_utc(record.created),
+            "time": self._format_time(record.created),
             "logging.googleapis.com/labels": self._format_labels(record),
         }
 
@@ -112,21 +147,45 @@ class GcpStructuredFormatter(logging.Formatter):
 
         if exc_info := record.exc_info:
             payload["traceback"] = "".join(traceback.format_exception(*exc_info))
-
-        return json.dumps(payload)
+        elif record.exc_text:
+            # Already rendered, e.g. before passing the record to another thread
+            payload["traceback"] = record.exc_text
+
+        return self._dumps(payload)
+
+    def _format_time(self, unix_timestamp: float) -> str:
+        """Same as _local_timestamp_to_utc, caching everything but microseconds"""
+        # Split the same way datetime.fromtimestamp does, rounding half to even
+        fraction, whole = math.modf(unix_timestamp)
+        second, microsecond = int(whole), round(fraction * 1e6)
+        if microsecond >= 1_000_000:
+            second, microsecond = second + 1, microsecond - 1_000_000
+
+        cached_second, prefix = self._time_cache
+        if cached_second != second:
+            prefix = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+            self._time_cache = (second, prefix)
+        return f"{prefix}.{microsecond:06d}Z"
 
     def _format_labels(self, record: logging.LogRecord) -> dict[str, Any]:
         labels = {"logger": record.name}
 
-        if ctx_labels := CONTEXT_LABELS.get():
+        ctx_labels = getattr(record, CAPTURED_LABELS, None)
+        if ctx_labels is None:
+            ctx_labels = CONTEXT_LABELS.get()
+
+        if ctx_labels:
             for key, value in ctx_labels.items():
                 # if value is not of type 'string' it will be dropped by google cloud
-                if value is not None and key not in RESERVED:
+                if value is not None and key not in _NOT_LABELS:
                     labels[key] = str(value)
 
-        for key, value in record.__dict__.items():
-            if value is not None and key not in RESERVED:
-                # if value is not of type 'string' it will be dropped by google cloud
-                labels[key] = str(value)
+        # Most records have no extra attributes, find out without a python loop
+        if extra_keys := record.__dict__.keys() - _NOT_LABELS:
+            for key, value in record.__dict__.items():
+                if value is not None and key in extra_keys:
+                    # if value is not of type 'string' it will be dropped
+                    # by google cloud
+                    labels[key] = str(value)
 
         return labels
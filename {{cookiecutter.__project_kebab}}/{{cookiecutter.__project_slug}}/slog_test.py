@@ -3,14 +3,22 @@ tests for structured logging module (slog.py)
 """
 
 import asyncio
+import json
 import logging
 import time
 import uuid
+from typing import Any
 from unittest.mock import ANY
 
 import pytest
 
-from .slog import logging_context
+from .slog import (
+    CONTEXT_LABELS,
+    RESERVED,
+    GcpStructuredFormatter,
+    _local_timestamp_to_utc,
+    logging_context,
+)
 from .testing_utils.log import JsonLogs
 
 logger = logging.getLogger("test_logger")
@@ -176,3 +184,105 @@ def test_structured_info_http(structured_logs_capture: JsonLogs):
             "logging.googleapis.com/labels": {"logger": "test_logger"},
         }
     ]
+
+
+@pytest.mark.parametrize(
+    "timestamp",
+    [
+        1689083906.744488,
+        1689083906.9999996,
+        1689083906.0000004,
+        1700000000.0,
+        0.5,
+    ],
+)
+def test_format_time(timestamp: float):
+    formatter = GcpStructuredFormatter()
+    # twice to also go through the cached second
+    for _ in range(2):
+        assert formatter._format_time(timestamp) == _local_timestamp_to_utc(timestamp)
+
+
+def test_format_time_next_second():
+    formatter = GcpStructuredFormatter()
+    assert formatter._format_time(1689083906.5) == "2023-07-11T13:58:26.500000Z"
+    assert formatter._format_time(1689083907.25) == "2023-07-11T13:58:27.250000Z"
+
+
+def _access_log_record() -> logging.LogRecord:
+    return logger.makeRecord(
+        logger.name,
+        logging.INFO,
+        __file__,
+        0,
+        "%s %s %s",
+        ("GET", "/v1/posts", "HTTP/1.1"),
+        None,
+        extra={
+            "httpRequest": {
+                "requestMethod": "GET",
+                "requestUrl": "/v1/posts",
+                "remoteIp": "10.1.1.10:10",
+                "protocol": "HTTP/1.1",
+                "userAgent": "agent",
+                "requestSize": None,
+                "responseSize": 1024,
+                "latency": "0.001234s",
+                "status": 200,
+            }
+        },
+    )
+
+
+def test_fast_json():
+    pytest.importorskip("orjson")
+    record = _access_log_record()
+    with logging_context(request_id="abc"):
+        standard = GcpStructuredFormatter().format(record)
+        fast = GcpStructuredFormatter(fast_json=True).format(record)
+    assert json.loads(fast) == json.loads(standard)
+
+
+class _BaselineFormatter(GcpStructuredFormatter):
+    """Formatting without cached timestamps and precomputed attributes"""
+
+    def _format_time(self, unix_timestamp: float) -> str:
+        return _local_timestamp_to_utc(unix_timestamp)
+
+    def _format_labels(self, record: logging.LogRecord) -> dict[str, Any]:
+        labels = {"logger": record.name}
+        if ctx_labels := CONTEXT_LABELS.get():
+            for key, value in ctx_labels.items():
+                if value is not None and key not in RESERVED:
+                    labels[key] = str(value)
+        for key, value in record.__dict__.items():
+            if value is not None and key not in RESERVED:
+                labels[key] = str(value)
+        return labels
+
+
+def _records_per_second(formatter: logging.Formatter, records: int) -> float:
+    record = _access_log_record()
+    start = time.perf_counter()
+    for _ in range(records):
+        formatter.format(record)
+    return records / (time.perf_counter() - start)
+
+
+@pytest.mark.benchmark
+def test_formatter_throughput():
+    """
+    Records per second of the access log formatting,
+    run with `pytest -m benchmark -s`
+    """
+    records = 50000
+    with logging_context(request_id="abc"):
+        baseline = _records_per_second(_BaselineFormatter(), records)
+        current = _records_per_second(GcpStructuredFormatter(), records)
+        fast_json = _records_per_second(GcpStructuredFormatter(fast_json=True), records)
+
+    print(
+        f"\nrecords/s: before {baseline:.0f}, after {current:.0f}, "
+        f"after with fast_json {fast_json:.0f}"
+    )
+    assert current > baseline
@@ -3,20 +3,125 @@ This module provides a ConnectionPool class for managing database connections
 using SQLAlchemy's asynchronous engine and session maker.
 """
 
+import contextvars
+import uuid
 from types import TracebackType
-from typing import Optional, Type
+from typing import Any, Awaitable, Callable, Optional, Sequence, Type, TypeVar
 
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 
 from {{cookiecutter.__project_slug}}.storage.db_utils import normalize_db_url
+from {{cookiecutter.__project_slug}}.storage.notifications import NotificationListener
+from {{cookiecutter.__project_slug}}.storage.pool_metrics import InstrumentedAsyncQueuePool
+from {{cookiecutter.__project_slug}}.storage.replicas import Replica, ReplicaSet
+
+T = TypeVar("T")
+
+# Set once a primary session was opened in the current context (e.g. request),
+# so that later reads of that context see its writes
+_USED_PRIMARY = contextvars.ContextVar("_db_used_primary_", default=False)
+
+
+def _unique_statement_name() -> str:
+    return f"__asyncpg_{uuid.uuid4()}__"
 
 
 class ConnectionPool:
-    def __init__(self, db_url: str, echo: bool = False):
-        self._engine = create_async_engine(normalize_db_url(db_url), echo=echo)
+    def __init__(
+        self,
+        db_url: str,
+        echo: bool = False,
+        *,
+        replica_urls: Sequence[str] = (),
+        read_your_writes: bool = True,
+        replica_ejection_seconds: float = 30.0,
+        pool_size: int = 5,
+        max_overflow: int = 10,
+        pool_timeout: float = 30.0,
+        pool_recycle: int = -1,
+        pool_pre_ping: bool = False,
+        statement_cache_size: int = 100,
+        pgbouncer: bool = False,
+        listen_url: str | None = None,
+    ):
+        """
+        replica_urls: read replicas used by new_read_session
+        read_your_writes: send reads to the primary for the rest of the context
+            (request) once it opened a primary session
+        replica_ejection_seconds: how long a replica with connection errors
+            gets no reads
+
+        Every engine gets its own pool with these settings:
+        pool_size: connections kept open in the pool
+        max_overflow: connections opened on top of pool_size under load
+        pool_timeout: seconds to wait for a free connection before giving up
+        pool_recycle: seconds after which a connection is reopened, -1 to never
+        pool_pre_ping: test connections for liveness on every checkout
+        statement_cache_size: prepared statements cached per connection,
+            0 to prepare every statement anew
+        pgbouncer: compatibility with PgBouncer in transaction mode, where
+            consecutive transactions of a connection may run on different
+            server connections: statements are not cached and prepared
+            statements get unique names, so they never clash.
+            LISTEN does not work in transaction mode, the `listener`
+            needs a `listen_url`
+        listen_url: direct connection to the primary for the `listener`,
+            e.g. bypassing PgBouncer, db_url by default
+        """
+        connect_args: dict[str, Any] = dict(
+            prepared_statement_cache_size=statement_cache_size
+        )
+        if pgbouncer:
+            connect_args.update(
+                # asyncpg's own cache and sqlalchemy's cache on top of it
+                statement_cache_size=0,
+                prepared_statement_cache_size=0,
+                prepared_statement_name_func=_unique_statement_name,
+            )
+        engine_options: dict[str, Any] = dict(
+            echo=echo,
+            poolclass=InstrumentedAsyncQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_recycle=pool_recycle,
+            pool_pre_ping=pool_pre_ping,
+            connect_args=connect_args,
+        )
+        url = normalize_db_url(db_url)
+        self._engine = create_async_engine(
+            url, pool_logging_name="primary", **engine_options
+        )
         self._async_session_factory = async_sessionmaker(
             self._engine, expire_on_commit=False
         )
+        self._replicas = ReplicaSet(
+            [
+                Replica(
+                    f"replica{index}",
+                    create_async_engine(
+                        normalize_db_url(replica_url),
+                        pool_logging_name=f"replica{index}",
+                        **engine_options,
+                    ),
+                    replica_ejection_seconds,
+                )
+                for index, replica_url in enumerate(replica_urls)
+            ]
+        )
+        self._read_your_writes = read_your_writes
+        # Uses its own connection outside of the pool,
+        # it is opened on the first subscription
+        self._listener: NotificationListener | None = None
+        if listen_url is not None:
+            self._listener = NotificationListener(normalize_db_url(listen_url))
+        elif not pgbouncer:
+            self._listener = NotificationListener(url)
         self._inside_context = False
 
     @property
@@ -24,11 +129,88 @@ class ConnectionPool:
         assert self._inside_context
         return self._engine
 
+    @property
+    def replica_engines(self) -> list[AsyncEngine]:
+        assert self._inside_context
+        return [replica.engine for replica in self._replicas.replicas]
+
+    @property
+    def replicas(self) -> list[Replica]:
+        assert self._inside_context
+        return self._replicas.replicas
+
+    @property
+    def listener(self) -> NotificationListener:
+        assert self._inside_context
+        if self._listener is None:
+            # Subscribers would never be notified, e.g. the post cache
+            # would serve changed posts until they expire
+            raise ValueError("Notifications need a listen_url that bypasses PgBouncer")
+        return self._listener
+
     def new_session(self) -> AsyncSession:
+        """Session on the primary, use it for writes"""
         assert self._inside_context
+        _USED_PRIMARY.set(True)
         return self._async_session_factory()
 
+    def note_primary_write(self) -> None:
+        """
+        Like opening a new_session, for a write to the primary done on behalf
+        of the current context by another task, e.g. a write-behind batch
+        """
+        _USED_PRIMARY.set(True)
+
+    def new_read_session(self) -> AsyncSession:
+        """
+        Session for read-only queries on one of the healthy replicas.
+        Falls back to the primary if there are no healthy replicas
+        or if this context already wrote to the primary.
+        """
+        assert self._inside_context
+        if (replica := self._pick_replica()) is not None:
+            return replica.session_factory()
+        return self._async_session_factory()
+
+    async def read(
+        self, fn: Callable[[AsyncSession], Awaitable[T]], *, use_primary: bool = False
+    ) -> T:
+        """
+        Run `fn` in a read-only transaction of a new_read_session.
+        If the replica turns out to be unreachable, it is retried on the primary.
+
+        use_primary: read from the primary, e.g. for results that must not lag
+            behind, without making later reads of the context stick to it
+        """
+        assert self._inside_context
+        replica = None if use_primary else self._pick_replica()
+        if replica is not None:
+            try:
+                async with replica.session_factory() as session, session.begin():
+                    return await fn(session)
+            except Exception:
+                # Replicas are ejected on connectivity errors only,
+                # other errors would fail on the primary as well
+                if replica.healthy:
+                    raise
+        async with self._async_session_factory() as session, session.begin():
+            return await fn(session)
+
+    def _pick_replica(self) -> Replica | None:
+        if self.reads_use_primary():
+            return None
+        return self._replicas.pick()
+
+    def reads_use_primary(self) -> bool:
+        """True if read sessions of the current context must skip the replicas"""
+        return bool(self._replicas.replicas) and (
+            self._read_your_writes and _USED_PRIMARY.get()
+        )
+
     async def close(self):
+        if self._listener is not None:
+            await self._listener.close()
+        await self._replicas.dispose()
         await self._engine.dispose()
 
     async def __aenter__(self):
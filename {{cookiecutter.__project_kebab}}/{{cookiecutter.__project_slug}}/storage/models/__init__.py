@@ -3,4 +3,4 @@ This module contains the base class and all models.
 """
 
 from .base import Base  # noqa
-from .posts import Comment, Post  # noqa
+from .posts import SEARCH_CONFIG, Comment, Post, PostRow  # noqa
@@ -3,22 +3,43 @@ Example Post and Comment models.
 """
 
 from datetime import datetime
-from typing import List
+from typing import List, NamedTuple
 
-from sqlalchemy import ForeignKey, text
+from sqlalchemy import Column, Computed, ForeignKey, Index, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from {{cookiecutter.__project_slug}}.storage.models import Base
 from {{cookiecutter.__project_slug}}.storage.models.custom_types import DatetimeWithTimezone
 
+# Text search configuration of Post.search_vector and of the search queries
+SEARCH_CONFIG = "english"
+
 
 class Post(Base):
     __tablename__ = "posts"
-    __mapper_args__ = {"eager_defaults": True}
+    # search_vector is a column of the table only, so that the inserts
+    # and updates of posts do not return it with the eager defaults
+    __mapper_args__ = {"eager_defaults": True, "exclude_properties": ["search_vector"]}
+    __table_args__ = (
+        # Keyset pagination order, see PostRepo.view_posts.
+        # updated_at is included, though the ETags of the pages are
+        # computed from the pages, as they need comment_count as well
+        Index(
+            "ix_posts_created_at_id",
+            "created_at",
+            "id",
+            postgresql_include=["updated_at"],
+        ),
+        # Full-text search, see PostRepo.search_posts
+        Index("ix_posts_search_vector", "search_vector", postgresql_using="gin"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     title: Mapped[str]
     main_content: Mapped[str]
+    # Idempotency key of posts created in batches, see PostRepo.create_posts_bulk
+    client_key: Mapped[str | None] = mapped_column(index=True, unique=True)
     created_at: Mapped[datetime] = mapped_column(
         DatetimeWithTimezone,
         server_default=text("CURRENT_TIMESTAMP"),
@@ -28,13 +49,54 @@ class Post(Base):
         server_default=text("CURRENT_TIMESTAMP"),
         onupdate=text("CURRENT_TIMESTAMP"),
     )
+    # Maintained by triggers on comments, so that listings do not count
+    # the comments of every post. Changing it does not touch updated_at.
+    # Not indexed, which keeps the updates of every new comment HOT
+    # (indexed columns such as updated_at do not change), with the free
+    # space of the table's fillfactor set by the migration.
+    # See PostRepo.reconcile_comment_counts
+    comment_count: Mapped[int] = mapped_column(server_default=text("0"))
+    # Lexemes of the title, ranked above those of the content
+    search_vector = Column(
+        TSVECTOR,
+        Computed(
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', title), 'A') || "
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', main_content), 'B')",
+            persisted=True,
+        ),
+        nullable=False,
+    )
 
-    comments: Mapped[List["Comment"]] = relationship()
+    # Never loaded lazily, which would be a query per post and fails under
+    # asyncio anyway, see PostRepo.view_posts_with_comments
+    comments: Mapped[List["Comment"]] = relationship(
+        order_by="Comment.id", lazy="raise"
+    )
+
+
+class PostRow(NamedTuple):
+    """
+    Read-only post loaded without the ORM, see PostRepo.view_post.
+    Fields are columns of the posts table
+    """
+
+    id: int
+    title: str
+    main_content: str
+    created_at: datetime
+    updated_at: datetime
+    comment_count: int
 
 
 class Comment(Base):
     __tablename__ = "comments"
     __mapper_args__ = {"eager_defaults": True}
+    __table_args__ = (
+        # First comments of a post in id order, see
+        # PostRepo.view_posts_with_comments, and the foreign key check
+        # of every deleted post would scan the table without it
+        Index("ix_comments_post_id_id", "post_id", "id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     post_id: Mapped[int] = mapped_column(ForeignKey("posts.id"))
@@ -0,0 +1,102 @@
+"""
+Postgres LISTEN/NOTIFY subscriptions over a dedicated connection.
+
+Notifications are delivered only to sessions that are listening at the moment
+of the commit, so whenever the listener (re)connects subscribers are told
+that they might have missed some.
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Callable
+
+import asyncpg
+import sqlalchemy as sa
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Subscription:
+    channel: str
+    on_notification: Callable[[str], None]
+    on_connect: Callable[[], None] | None
+
+
+class NotificationListener:
+    def __init__(self, db_url: sa.URL, reconnect_delay: float = 1.0):
+        # asyncpg does not understand sqlalchemy's driver suffix
+        self._dsn = db_url.set(drivername="postgresql").render_as_string(
+            hide_password=False
+        )
+        self._reconnect_delay = reconnect_delay
+        self._subscriptions: list[_Subscription] = []
+        self._task: asyncio.Task | None = None
+        self._connection: asyncpg.Connection | None = None
+
+    def subscribe(
+        self,
+        channel: str,
+        on_notification: Callable[[str], None],
+        on_connect: Callable[[], None] | None = None,
+    ) -> None:
+        """
+        Call `on_notification(payload)` for each notification on `channel`
+        and `on_connect()` every time the listening connection is established.
+
+        Must be called from a running event loop.
+        """
+        self._subscriptions.append(_Subscription(channel, on_notification, on_connect))
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        elif self._connection is not None:
+            # Reconnect to LISTEN on the new channel as well
+            self._connection.terminate()
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _dispatch(
+        self, _connection: object, _pid: int, channel: str, payload: str
+    ) -> None:
+        for subscription in self._subscriptions:
+            if subscription.channel != channel:
+                continue
+            try:
+                subscription.on_notification(payload)
+            except Exception:
+                logger.exception("Failed to handle notification on %s", channel)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._listen_until_disconnected()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Notification listener failed", exc_info=True)
+            await asyncio.sleep(self._reconnect_delay)
+
+    async def _listen_until_disconnected(self) -> None:
+        connection = await asyncpg.connect(self._dsn)
+        disconnected = asyncio.Event()
+        connection.add_termination_listener(lambda _: disconnected.set())
+        try:
+            for channel in {sub.channel for sub in self._subscriptions}:
+                await connection.add_listener(channel, self._dispatch)
+            self._connection = connection
+            for subscription in self._subscriptions:
+                if subscription.on_connect is not None:
+                    subscription.on_connect()
+            await disconnected.wait()
+        finally:
+            self._connection = None
+            if not connection.is_closed():
+                await connection.close()
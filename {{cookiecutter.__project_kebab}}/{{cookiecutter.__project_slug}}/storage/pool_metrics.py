@@ -0,0 +1,97 @@
+"""
+Prometheus metrics of the SQLAlchemy connection pools.
+
+Pools are told apart by their `pool_logging_name` (e.g. "primary").
+Gauges are refreshed on every checkout, checkin, connection close
+and dispose instead of at scrape time, so that they also work
+in prometheus multiprocess mode.
+
+Idle connections are the entries waiting in the pool. After the whole pool
+was invalidated (e.g. on a database restart) entries stay counted as idle
+until their next checkout reopens their connection.
+"""
+
+import time
+
+from prometheus_client import Gauge, Histogram
+from sqlalchemy.engine.interfaces import DBAPIConnection
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry
+
+POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections",
+    "Connections currently used by the application",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+POOL_IDLE = Gauge(
+    "db_pool_idle_connections",
+    "Open connections waiting in the pool",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+POOL_OVERFLOW = Gauge(
+    "db_pool_overflow_connections",
+    "Checked out connections above pool_size",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+POOL_ACQUIRE_SECONDS = Histogram(
+    "db_pool_acquire_seconds",
+    "Time spent waiting for a connection from the pool, including connecting",
+    ["pool"],
+    buckets=[0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0],
+)
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """
+    Default pool of async engines that also measures how long callers wait
+    for a connection and how many connections are in use
+    """
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_ACQUIRE_SECONDS.labels(self._metrics_label()).observe(
+                time.perf_counter() - start
+            )
+            self._update_gauges()
+
+    def _do_return_conn(self, record: ConnectionPoolEntry) -> None:
+        try:
+            super()._do_return_conn(record)
+        finally:
+            self._update_gauges()
+
+    def _close_connection(
+        self, connection: DBAPIConnection, *, terminate: bool = False
+    ) -> None:
+        # Connections are also closed outside of checkout and checkin:
+        # on invalidation, recycling, discarded overflow and dispose
+        try:
+            super()._close_connection(connection, terminate=terminate)
+        finally:
+            self._update_gauges()
+
+    def dispose(self) -> None:
+        super().dispose()
+        self._update_gauges()
+
+    def saturation(self) -> float:
+        """Share of pool_size + max_overflow connections that is checked out"""
+        if self._max_overflow < 0:
+            # Unlimited overflow never runs out of connections
+            return 0.0
+        return self.checkedout() / max(self.size() + self._max_overflow, 1)
+
+    def _metrics_label(self) -> str:
+        return self.logging_name or "default"
+
+    def _update_gauges(self) -> None:
+        label = self._metrics_label()
+        POOL_CHECKED_OUT.labels(label).set(self.checkedout())
+        POOL_IDLE.labels(label).set(self.checkedin())
+        # overflow() is negative while fewer than pool_size connections are open
+        POOL_OVERFLOW.labels(label).set(max(self.overflow(), 0))
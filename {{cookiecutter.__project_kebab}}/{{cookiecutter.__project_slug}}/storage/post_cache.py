@@ -0,0 +1,93 @@
+"""
+In-process LRU cache of posts with a TTL.
+
+Entries are invalidated on every replica through postgres notifications
+sent by the posts_changed trigger (see alembic revision 5a7c9e2d4f18),
+the TTL only bounds staleness while the notification listener is down.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from prometheus_client import Counter
+
+from .models import PostRow
+
+# Channel used by the posts_changed trigger, payload is the post id
+POSTS_CHANGED_CHANNEL = "posts_changed"
+
+CACHE_HITS = Counter("post_cache_hits", "Post lookups served from the cache")
+CACHE_MISSES = Counter("post_cache_misses", "Post lookups that went to the database")
+CACHE_EVICTIONS = Counter(
+    "post_cache_evictions", "Posts evicted from the cache because it was full"
+)
+
+
+class PostCache:
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        assert max_size > 0
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        # post id -> (expiration time, post), least recently used first
+        self._entries: OrderedDict[int, tuple[float, PostRow]] = OrderedDict()
+        # Bumped on every invalidation, so that a load that started before
+        # an invalidation does not put a stale post back into the cache
+        self._generation = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get_or_load(
+        self, post_id: int, load: Callable[[], Awaitable[PostRow | None]]
+    ) -> PostRow | None:
+        """
+        Return the cached post or load it with `load()` and cache the result.
+        Missing posts are not cached.
+        """
+        if (entry := self._entries.get(post_id)) is not None:
+            expires_at, post = entry
+            if expires_at > self._clock():
+                self._entries.move_to_end(post_id)
+                CACHE_HITS.inc()
+                return post
+            del self._entries[post_id]
+
+        CACHE_MISSES.inc()
+        generation = self._generation
+        post = await load()
+        if post is not None and generation == self._generation:
+            self._put(post_id, post)
+        return post
+
+    def peek(self, post_id: int) -> PostRow | None:
+        """The cached post, without loading it or counting a hit"""
+        if (entry := self._entries.get(post_id)) is not None:
+            expires_at, post = entry
+            if expires_at > self._clock():
+                return post
+        return None
+
+    def invalidate(self, post_id: int) -> None:
+        self._generation += 1
+        self._entries.pop(post_id, None)
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._entries.clear()
+
+    def on_notification(self, payload: str) -> None:
+        self.invalidate(int(payload))
+
+    def _put(self, post_id: int, post: PostRow) -> None:
+        self._entries[post_id] = (self._clock() + self.ttl, post)
+        self._entries.move_to_end(post_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            CACHE_EVICTIONS.inc()
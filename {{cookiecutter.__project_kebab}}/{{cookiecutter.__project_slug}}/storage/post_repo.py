@@ -2,16 +2,328 @@
 This is example module for the PostRepo class.
 """
 
+from dataclasses import dataclass
+from datetime import datetime
+from functools import partial
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Collection,
+    NamedTuple,
+    Sequence,
+    TypeVar,
+)
+
+from sqlalchemy import (
+    REAL,
+    Integer,
+    Result,
+    Select,
+    and_,
+    any_,
+    bindparam,
+    delete,
+    func,
+    literal,
+    or_,
+    text,
+    true,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.dialects.postgresql.ext import websearch_to_tsquery
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.attributes import set_committed_value
 
 from {{cookiecutter.__project_slug}}.storage.connection_pool import ConnectionPool
 
-from .models import Comment, Post
+from .models import SEARCH_CONFIG, Comment, Post, PostRow
+from .post_cache import POSTS_CHANGED_CHANNEL, PostCache
+from .single_flight import SingleFlight
+from .write_behind import WriteBehindBuffer
+
+T = TypeVar("T")
+R = TypeVar("R", PostRow, Post)
+
+# Read methods that can share in-flight queries between concurrent callers
+COALESCABLE_METHODS = ("view_post", "view_posts", "view_comment")
+
+# Position of a post in the (created_at, id) listing order
+PostKey = tuple[datetime, int]
+# Position of a post in the search results, by (rank descending, id)
+SearchKey = tuple[float, int]
+# Max matches of a search that are ranked, the newest ones. Finding the
+# newest matches reads more of the table the more of them there are:
+# the cost of the words in a few percent of the posts grows with the
+# square root of this and of the number of posts
+SEARCH_MAX_RANKED = 500
+
+# Statements of the hot queries are built once with bound parameters.
+# Executing the same statement object skips building it and computing
+# its key in SQLAlchemy's compiled cache on every call
+_posts = Post.__table__.c
+# Read-only queries select plain columns of the table (Core) instead of
+# the Post entity, so rows are not tracked by the session's identity map
+_SELECT_POST_ROW = select(*[_posts[field] for field in PostRow._fields])
+_SELECT_POST = _SELECT_POST_ROW.where(_posts.id == bindparam("post_id"))
+_POST_VERSION_COLUMNS = (
+    _posts.id,
+    _posts.created_at,
+    _posts.updated_at,
+    _posts.comment_count,
+)
+_SELECT_POST_VERSION = select(*_POST_VERSION_COLUMNS).where(
+    _posts.id == bindparam("post_id")
+)
+
+
+def _page_statements(stmt: Select) -> tuple[Select, Select]:
+    """Statements of the first and of the next pages of the keyset pagination"""
+    first = stmt.order_by(_posts.created_at, _posts.id).limit(
+        bindparam("limit", type_=Integer)
+    )
+    after = first.where(
+        tuple_(_posts.created_at, _posts.id)
+        > tuple_(
+            bindparam("after_created_at", type_=_posts.created_at.type),
+            bindparam("after_id", type_=Integer),
+        )
+    )
+    return first, after
+
+
+_SELECT_POSTS_PAGE, _SELECT_POSTS_PAGE_AFTER = _page_statements(_SELECT_POST_ROW)
+_SELECT_POSTS_WITH_COMMENTS_PAGE, _SELECT_POSTS_WITH_COMMENTS_PAGE_AFTER = (
+    _page_statements(select(Post))
+)
+# Comments of all the posts of a page, loaded with one more query whatever
+# the number of posts. The first `per_post` comments of every post are read
+# in id order from ix_comments_post_id_id
+_page_posts = (
+    func.unnest(bindparam("post_ids", type_=ARRAY(Integer)))
+    .table_valued("id", name="page_posts")
+    .render_derived()
+)
+_first_comments = (
+    select(Comment.__table__)
+    .where(Comment.post_id == _page_posts.c.id)
+    .order_by(Comment.id)
+    .limit(bindparam("per_post", type_=Integer))
+    .lateral("first_comments")
+)
+_SELECT_FIRST_COMMENTS = (
+    select(aliased(Comment, _first_comments))
+    .select_from(_page_posts)
+    .join(_first_comments, true())
+    .order_by(_first_comments.c.post_id, _first_comments.c.id)
+)
+# The query is parsed once per statement, as a FROM item
+_search_query = websearch_to_tsquery(SEARCH_CONFIG, bindparam("query")).alias("query")
+# The newest matches, and the one after the last ranked one if there are
+# more. Postgres scans pk_posts backwards for words in many posts, and
+# sorts the matches found with ix_posts_search_vector for the others
+_search_candidates = (
+    select(
+        *_SELECT_POST_ROW.selected_columns,
+        _posts.search_vector,
+        _search_query.column.label("query"),
+        func.row_number().over(order_by=_posts.id.desc()).label("position"),
+    )
+    .select_from(Post.__table__)
+    .join(_search_query, _posts.search_vector.bool_op("@@")(_search_query.column))
+    .order_by(_posts.id.desc())
+    # Inlined, the plan does not depend on how many rows it stops after
+    .limit(literal(SEARCH_MAX_RANKED + 1, literal_execute=True))
+    .subquery("candidates")
+)
+# The outer keyset conditions are not pushed below the window functions
+_search_matches = select(
+    *[_search_candidates.c[field] for field in PostRow._fields],
+    func.ts_rank(
+        _search_candidates.c.search_vector, _search_candidates.c.query, type_=REAL
+    ).label("rank"),
+    _search_candidates.c.position,
+    func.count().over().label("matched"),
+).subquery("matches")
+_SEARCH_POSTS = (
+    select(
+        *[_search_matches.c[field] for field in PostRow._fields],
+        _search_matches.c.rank,
+        _search_matches.c.matched,
+    )
+    .where(_search_matches.c.position <= SEARCH_MAX_RANKED)
+    .order_by(_search_matches.c.rank.desc(), _search_matches.c.id)
+    .limit(bindparam("limit", type_=Integer))
+)
+_SEARCH_POSTS_AFTER = _SEARCH_POSTS.where(
+    or_(
+        _search_matches.c.rank < bindparam("after_rank", type_=REAL),
+        and_(
+            _search_matches.c.rank == bindparam("after_rank", type_=REAL),
+            _search_matches.c.id > bindparam("after_id", type_=Integer),
+        ),
+    )
+)
+# Set for the transaction of a search. The plan of the newest matches
+# depends on how many posts the query matches, which a generic plan of
+# the prepared statement does not know. With the default random_page_cost,
+# meant for spinning disks, postgres scans pk_posts backwards for words
+# whose matches are several times faster to read with ix_posts_search_vector
+_SEARCH_SETTINGS = select(
+    func.set_config("plan_cache_mode", "force_custom_plan", true()),
+    func.set_config("random_page_cost", "1.1", true()),
+)
+_UPDATE_POST = (
+    update(Post)
+    .where(Post.id == bindparam("post_id"))
+    .values(title=bindparam("new_title"), main_content=bindparam("new_main_content"))
+    .returning(Post)
+)
+_DELETE_POST = delete(Post).where(Post.id == bindparam("post_id")).returning(Post.id)
+_SELECT_COMMENT = select(Comment).where(Comment.id == bindparam("comment_id"))
+_UPDATE_COMMENT = (
+    update(Comment)
+    .where(Comment.id == bindparam("comment_id"))
+    .values(content=bindparam("new_content"))
+    .returning(Comment)
+)
+_DELETE_COMMENT = (
+    delete(Comment)
+    .where(Comment.id == bindparam("comment_id"))
+    .returning(Comment.post_id)
+)
+# Posts of a batch of reconcile_comment_counts. FOR NO KEY UPDATE holds off
+# the comment triggers but not the foreign key checks of new comments
+_LOCK_POSTS_BATCH = (
+    select(_posts.id)
+    .where(_posts.id > bindparam("after_id"))
+    .order_by(_posts.id)
+    .limit(bindparam("limit", type_=Integer))
+    .with_for_update(key_share=True)
+)
+_counted = (
+    select(_posts.id, func.count(Comment.id).label("comment_count"))
+    .select_from(Post.__table__.outerjoin(Comment.__table__))
+    .where(_posts.id == any_(bindparam("post_ids", type_=ARRAY(Integer))))
+    .group_by(_posts.id)
+    .subquery("counted")
+)
+_FIX_COMMENT_COUNTS = (
+    update(Post)
+    .where(
+        _posts.id == _counted.c.id,
+        _posts.comment_count != _counted.c.comment_count,
+    )
+    # Counts are not edits of the post, keeps updated_at from its onupdate
+    .values(comment_count=_counted.c.comment_count, updated_at=_posts.updated_at)
+    .returning(_posts.id)
+)
+
+
+@dataclass
+class NewPost:
+    title: str
+    main_content: str
+    # Posts with a client key are upserted: creating a post with a key
+    # that already exists updates that post instead of adding a new one
+    client_key: str | None = None
+
+
+@dataclass
+class NewComment:
+    post_id: int
+    content: str
+
+
+@dataclass
+class PostsPage:
+    posts: list[PostRow]
+    # Key of the last returned post if there are more posts after it
+    next_key: PostKey | None
+
+
+@dataclass
+class PostsSearchPage:
+    # Best matches first
+    posts: list[PostRow]
+    # Key of the last returned post if there are more matches after it
+    next_key: SearchKey | None
+    # More than SEARCH_MAX_RANKED posts matched, only the newest were ranked
+    truncated: bool = False
+
+
+@dataclass
+class PostsWithCommentsPage:
+    # With their comments loaded, ordered by id
+    posts: list[Post]
+    next_key: PostKey | None
+
+
+class PostVersion(NamedTuple):
+    id: int
+    created_at: datetime
+    updated_at: datetime
+    comment_count: int
+
+
+@dataclass
+class ReconciledBatch:
+    # Id of the last post of the batch, pass as `after_id` to resume after it
+    last_id: int
+    posts: int
+    # Posts whose comment_count was off
+    fixed: int
+
+
+def _post_rows(result: Result) -> list[PostRow]:
+    return [PostRow._make(row) for row in result]
+
+
+def _posts_with_comments(result: Result) -> list[Post]:
+    return list(result.scalars().all())
 
 
 class PostRepo:
-    def __init__(self, pool: ConnectionPool):
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        cache: PostCache | None = None,
+        coalesce: Collection[str] = (),
+        comment_batch_size: int = 0,
+        comment_batch_delay: float = 0.005,
+    ):
+        """
+        `coalesce` lists methods of COALESCABLE_METHODS whose concurrent calls
+        with the same arguments share a single DB query.
+
+        With a positive `comment_batch_size`, create_comment writes behind:
+        concurrent comments are inserted together, up to `comment_batch_size`
+        per INSERT and waiting at most `comment_batch_delay` seconds for more.
+        Call close() to write the comments waiting for their batch.
+        """
+        if unknown := set(coalesce) - set(COALESCABLE_METHODS):
+            raise ValueError(f"Methods {sorted(unknown)} cannot be coalesced")
         self.pool = pool
+        self.cache = cache
+        self._single_flights = {method: SingleFlight(method) for method in coalesce}
+        self._comment_writes: WriteBehindBuffer[NewComment, Comment] | None = None
+        if comment_batch_size > 0:
+            self._comment_writes = WriteBehindBuffer(
+                "comments",
+                self.create_comments_bulk,
+                max_items=comment_batch_size,
+                max_delay=comment_batch_delay,
+            )
+        if cache is not None:
+            # Posts changed by other replicas are dropped from the cache
+            # through the notifications of the posts_changed trigger
+            pool.listener.subscribe(
+                POSTS_CHANGED_CHANNEL, cache.on_notification, cache.clear
+            )
 
     async def create_post(self, title: str, main_content: str) -> Post:
         async with self.pool.new_session() as session, session.begin():
@@ -19,56 +331,379 @@ class PostRepo:
             session.add(new_post)
             return new_post
 
-    async def view_post(self, post_id: int) -> Post | None:
-        async with self.pool.new_session() as session, session.begin():
-            result = await session.execute(select(Post).filter_by(id=post_id))
-            return result.scalars().first()
+    async def create_posts_bulk(self, posts: Sequence[NewPost]) -> list[Post]:
+        """
+        Create (or upsert by client key) many posts at once.
+
+        Rows are sent as multi-row INSERT ... RETURNING statements
+        in a single transaction. Returned posts are in the order of `posts`,
+        items sharing a client key resolve to the same post (the last one wins).
+        """
+        new_rows: list[dict] = []
+        # ON CONFLICT cannot touch the same row twice in one statement,
+        # so collapse duplicate client keys before sending the batch
+        upsert_rows: dict[str, dict] = {}
+        # Where every item of `posts` ends up: index into new_rows or a client key
+        targets: list[int | str] = []
+        for post in posts:
+            row = {
+                "title": post.title,
+                "main_content": post.main_content,
+                "client_key": post.client_key,
+            }
+            if post.client_key is None:
+                targets.append(len(new_rows))
+                new_rows.append(row)
+            else:
+                targets.append(post.client_key)
+                upsert_rows[post.client_key] = row
 
-    async def view_posts(self) -> list[Post]:
+        created: list[Post] = []
+        upserted: dict[str, Post] = {}
         async with self.pool.new_session() as session, session.begin():
-            result = await session.execute(select(Post))
-            return list(result.scalars().all())
+            if new_rows:
+                # Plain inserts get fresh ids in the order of the rows,
+                # which is what sort_by_parameter_order relies on
+                stmt = insert(Post).returning(Post, sort_by_parameter_order=True)
+                result = await session.execute(stmt, new_rows)
+                created = list(result.scalars().all())
+            if upsert_rows:
+                # Updated rows keep their old ids, so match them by client key
+                stmt = insert(Post)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[Post.client_key],
+                    set_={
+                        "title": stmt.excluded.title,
+                        "main_content": stmt.excluded.main_content,
+                        "updated_at": text("CURRENT_TIMESTAMP"),
+                    },
+                ).returning(Post)
+                result = await session.execute(stmt, list(upsert_rows.values()))
+                upserted = {
+                    post.client_key: post
+                    for post in result.scalars().all()
+                    if post.client_key is not None
+                }
+        for post in upserted.values():
+            self._invalidate_cached(post.id)
+        return [
+            created[target] if isinstance(target, int) else upserted[target]
+            for target in targets
+        ]
+
+    async def view_post(self, post_id: int) -> PostRow | None:
+        """Read-only post, loaded without the ORM like the posts of view_posts"""
+        load = partial(self._read, "view_post", self._fetch_post, post_id)
+        if self.cache is not None:
+            return await self.cache.get_or_load(post_id, load)
+        return await load()
+
+    async def _fetch_post(self, post_id: int) -> PostRow | None:
+        async def fetch(session: AsyncSession) -> PostRow | None:
+            result = await session.execute(_SELECT_POST, {"post_id": post_id})
+            row = result.first()
+            return PostRow._make(row) if row is not None else None
+
+        # Cached posts are invalidated once a change is committed on the primary,
+        # a lagging replica could refill the cache with the old post for the ttl
+        return await self.pool.read(fetch, use_primary=self.cache is not None)
+
+    async def view_post_version(self, post_id: int) -> PostVersion | None:
+        """
+        Version of the post that view_post returns, without reading
+        the whole post. None if the post does not exist
+        """
+        if self.cache is not None and (post := self.cache.peek(post_id)) is not None:
+            return PostVersion(
+                post.id, post.created_at, post.updated_at, post.comment_count
+            )
+
+        async def fetch(session: AsyncSession) -> PostVersion | None:
+            result = await session.execute(_SELECT_POST_VERSION, {"post_id": post_id})
+            row = result.first()
+            return PostVersion._make(row) if row is not None else None
+
+        return await self.pool.read(fetch, use_primary=self.cache is not None)
+
+    async def view_posts(self, limit: int, after: PostKey | None = None) -> PostsPage:
+        """
+        View a page of at most `limit` posts ordered by (created_at, id),
+        starting right after the post with key `after`.
+
+        Uses keyset pagination over ix_posts_created_at_id, so every page
+        costs the same regardless of how deep into the table it is.
+        """
+        return await self._read("view_posts", self._fetch_posts_page, limit, after)
+
+    async def _fetch_posts_page(self, limit: int, after: PostKey | None) -> PostsPage:
+        posts, next_key = await self._fetch_page(
+            _SELECT_POSTS_PAGE, _SELECT_POSTS_PAGE_AFTER, _post_rows, limit, after
+        )
+        return PostsPage(posts=posts, next_key=next_key)
+
+    async def search_posts(
+        self, query: str, limit: int, after: SearchKey | None = None
+    ) -> PostsSearchPage:
+        """
+        Search the titles and contents of the posts with a web search style
+        `query`: words, "quoted phrases", OR and -excluded words. Returns at
+        most `limit` matches, best first, starting right after the post with
+        key `after`. Queries of stop words only, like "the", match nothing.
+
+        Queries matching more than SEARCH_MAX_RANKED posts return the best
+        of the newest SEARCH_MAX_RANKED matches, which keeps them about as
+        fast as selective queries, and their pages are `truncated`.
+        """
+        stmt = _SEARCH_POSTS
+        params: dict[str, object] = {"query": query, "limit": limit + 1}
+        if after is not None:
+            stmt = _SEARCH_POSTS_AFTER
+            params.update(after_rank=after[0], after_id=after[1])
+
+        async def fetch(session: AsyncSession) -> list[tuple[PostRow, float, int]]:
+            await session.execute(_SEARCH_SETTINGS)
+            result = await session.execute(stmt, params)
+            return [(PostRow._make(row[:-2]), row.rank, row.matched) for row in result]
+
+        matches = await self.pool.read(fetch)
+        # Every row has the number of matches, none on a page past the last
+        truncated = bool(matches) and matches[0][2] > SEARCH_MAX_RANKED
+        next_key = None
+        if len(matches) > limit:
+            matches = matches[:limit]
+            last_post, last_rank, _ = matches[-1]
+            next_key = (last_rank, last_post.id)
+        return PostsSearchPage(
+            posts=[post for post, _, _ in matches],
+            next_key=next_key,
+            truncated=truncated,
+        )
+
+    async def view_posts_with_comments(
+        self,
+        limit: int,
+        after: PostKey | None = None,
+        *,
+        comments_per_post: int,
+    ) -> PostsWithCommentsPage:
+        """
+        Like view_posts, with the first `comments_per_post` comments of every
+        post, oldest first, so that a page is bounded however many comments
+        its posts have. Post.comment_count tells how many there are.
+        Takes two queries whatever the number of posts and comments
+        """
+
+        async def load_comments(session: AsyncSession, posts: list[Post]) -> None:
+            params = {
+                "post_ids": [post.id for post in posts],
+                "per_post": comments_per_post,
+            }
+            result = await session.execute(_SELECT_FIRST_COMMENTS, params)
+            comments: dict[int, list[Comment]] = {post.id: [] for post in posts}
+            for comment in result.scalars():
+                comments[comment.post_id].append(comment)
+            for post in posts:
+                # Loaded, as if by the relationship itself
+                set_committed_value(post, "comments", comments[post.id])
+
+        posts, next_key = await self._fetch_page(
+            _SELECT_POSTS_WITH_COMMENTS_PAGE,
+            _SELECT_POSTS_WITH_COMMENTS_PAGE_AFTER,
+            _posts_with_comments,
+            limit,
+            after,
+            load_comments,
+        )
+        return PostsWithCommentsPage(posts=posts, next_key=next_key)
+
+    async def _fetch_page(
+        self,
+        first_page: Select,
+        next_page: Select,
+        load: Callable[[Result], list[R]],
+        limit: int,
+        after: PostKey | None,
+        load_more: Callable[[AsyncSession, list[R]], Awaitable[None]] | None = None,
+    ) -> tuple[list[R], PostKey | None]:
+        """
+        load_more: loads more of the posts of a non-empty page,
+            in the same transaction
+        """
+        # One more row tells whether there is a next page
+        stmt = first_page
+        params: dict[str, object] = {"limit": limit + 1}
+        if after is not None:
+            stmt = next_page
+            params.update(after_created_at=after[0], after_id=after[1])
+
+        async def fetch(session: AsyncSession) -> tuple[list[R], PostKey | None]:
+            posts = load(await session.execute(stmt, params))
+            next_key = None
+            if len(posts) > limit:
+                posts = posts[:limit]
+                next_key = (posts[-1].created_at, posts[-1].id)
+            if load_more is not None and posts:
+                await load_more(session, posts)
+            return posts, next_key
+
+        return await self.pool.read(fetch)
+
+    async def stream_posts(self, batch_size: int = 1000) -> AsyncIterator[Post]:
+        """
+        Iterate over all posts ordered by (created_at, id).
+
+        Rows are fetched through a server-side cursor `batch_size` rows at a time,
+        so memory usage does not depend on the size of the table.
+        The session stays open until the iterator is exhausted or closed.
+        Unlike other reads it is not retried on the primary if the replica fails,
+        as posts may have been yielded already.
+        """
+        stmt = (
+            select(Post)
+            .order_by(Post.created_at, Post.id)
+            .execution_options(yield_per=batch_size)
+        )
+        async with self.pool.new_read_session() as session, session.begin():
+            result = await session.stream(stmt)
+            async for post in result.scalars():
+                yield post
 
     async def update_post(
         self, post_id: int, title: str, main_content: str
     ) -> Post | None:
+        params = {
+            "post_id": post_id,
+            "new_title": title,
+            "new_main_content": main_content,
+        }
         async with self.pool.new_session() as session, session.begin():
-            result = await session.execute(select(Post).filter_by(id=post_id))
+            result = await session.execute(_UPDATE_POST, params)
             post = result.scalars().first()
-            if post:
-                post.title = title
-                post.main_content = main_content
-            return post
+        # Do not wait for the notification to see our own write
+        self._invalidate_cached(post_id)
+        return post
 
-    async def delete_post(self, post_id: int) -> None:
+    async def delete_post(self, post_id: int) -> bool:
+        """Returns False if the post does not exist"""
         async with self.pool.new_session() as session, session.begin():
-            result = await session.execute(select(Post).filter_by(id=post_id))
-            post = result.scalars().first()
-            if post:
-                await session.delete(post)
+            result = await session.execute(_DELETE_POST, {"post_id": post_id})
+            deleted = result.first() is not None
+        self._invalidate_cached(post_id)
+        return deleted
 
     async def create_comment(self, post_id: int, content: str) -> Comment:
+        """
+        When writing behind, the comment is inserted with the comments of
+        concurrent calls by create_comments_bulk. An error of the batch,
+        e.g. a comment of a post that does not exist, fails all its calls
+        """
+        if self._comment_writes is not None:
+            comment = await self._comment_writes.submit(NewComment(post_id, content))
+            # Written by the task of the buffer, not in this context
+            self.pool.note_primary_write()
+            return comment
         async with self.pool.new_session() as session, session.begin():
             new_comment = Comment(post_id=post_id, content=content)
             session.add(new_comment)
-            return new_comment
+        # The trigger counting the comments updated the post
+        self._invalidate_cached(post_id)
+        return new_comment
 
-    async def view_comment(self, comment_id: int) -> Comment | None:
+    async def create_comments_bulk(
+        self, comments: Sequence[NewComment]
+    ) -> list[Comment]:
+        """
+        Create many comments with multi-row INSERT ... RETURNING statements
+        in a single transaction. Returned comments are in the order of `comments`.
+        """
+        if not comments:
+            return []
+        stmt = insert(Comment).returning(Comment, sort_by_parameter_order=True)
+        rows = [
+            {"post_id": comment.post_id, "content": comment.content}
+            for comment in comments
+        ]
         async with self.pool.new_session() as session, session.begin():
-            result = await session.execute(select(Comment).filter_by(id=comment_id))
+            result = await session.execute(stmt, rows)
+            created = list(result.scalars().all())
+        for post_id in {comment.post_id for comment in comments}:
+            self._invalidate_cached(post_id)
+        return created
+
+    async def view_comment(self, comment_id: int) -> Comment | None:
+        return await self._read("view_comment", self._fetch_comment, comment_id)
+
+    async def _fetch_comment(self, comment_id: int) -> Comment | None:
+        async def fetch(session: AsyncSession) -> Comment | None:
+            result = await session.execute(_SELECT_COMMENT, {"comment_id": comment_id})
             return result.scalars().first()
 
+        return await self.pool.read(fetch)
+
     async def update_comment(self, comment_id: int, content: str) -> Comment | None:
+        params = {"comment_id": comment_id, "new_content": content}
         async with self.pool.new_session() as session, session.begin():
-            result = await session.execute(select(Comment).filter_by(id=comment_id))
-            comment = result.scalars().first()
-            if comment:
-                comment.content = content
-            return comment
+            result = await session.execute(_UPDATE_COMMENT, params)
+            return result.scalars().first()
 
-    async def delete_comment(self, comment_id: int) -> None:
+    async def delete_comment(self, comment_id: int) -> bool:
+        """Returns False if the comment does not exist"""
         async with self.pool.new_session() as session, session.begin():
-            result = await session.execute(select(Comment).filter_by(id=comment_id))
-            comment = result.scalars().first()
-            if comment:
-                await session.delete(comment)
+            result = await session.execute(_DELETE_COMMENT, {"comment_id": comment_id})
+            post_id = result.scalar()
+        if post_id is None:
+            return False
+        self._invalidate_cached(post_id)
+        return True
+
+    async def reconcile_comment_counts(
+        self, batch_size: int = 1000, after_id: int = 0
+    ) -> AsyncIterator[ReconciledBatch]:
+        """
+        Recount the comments of the posts with an id above `after_id` and fix
+        the comment_count of the posts where it is off, e.g. to backfill it.
+
+        Posts are processed in id order, `batch_size` posts per transaction,
+        so only the posts of one batch are locked at a time. Comments may be
+        added and deleted meanwhile: the triggers of comments wait for the
+        lock and count them on top of the fixed count.
+        """
+        while True:
+            params = {"after_id": after_id, "limit": batch_size}
+            async with self.pool.new_session() as session, session.begin():
+                result = await session.execute(_LOCK_POSTS_BATCH, params)
+                post_ids = list(result.scalars().all())
+                if not post_ids:
+                    return
+                # A new statement sees the comments committed until the lock
+                result = await session.execute(
+                    _FIX_COMMENT_COUNTS, {"post_ids": post_ids}
+                )
+                fixed = list(result.scalars().all())
+            for post_id in fixed:
+                self._invalidate_cached(post_id)
+            after_id = post_ids[-1]
+            yield ReconciledBatch(
+                last_id=after_id, posts=len(post_ids), fixed=len(fixed)
+            )
+            if len(post_ids) < batch_size:
+                return
+
+    async def close(self) -> None:
+        """Write the comments waiting for their batch, see __init__"""
+        if self._comment_writes is not None:
+            await self._comment_writes.close()
+
+    async def _read(
+        self, method: str, fetch: Callable[..., Awaitable[T]], *args: object
+    ) -> T:
+        single_flight = self._single_flights.get(method)
+        # Calls that must read their own writes on the primary
+        # cannot share a result that may come from a lagging replica
+        if single_flight is not None and not self.pool.reads_use_primary():
+            return await single_flight.do(args, partial(fetch, *args))
+        return await fetch(*args)
+
+    def _invalidate_cached(self, post_id: int) -> None:
+        if self.cache is not None:
+            self.cache.invalidate(post_id)
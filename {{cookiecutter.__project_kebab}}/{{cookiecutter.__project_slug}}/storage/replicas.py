@@ -0,0 +1,99 @@
+"""
+Load balancing of read-only sessions over read replicas.
+
+Replicas are picked round-robin. A replica that cannot be connected to
+or loses its connection is ejected for a while and reads go to the remaining
+replicas, or to the primary once no replica is left.
+"""
+
+import itertools
+import logging
+import time
+from typing import Any, Callable
+
+from prometheus_client import Gauge
+from sqlalchemy import event
+from sqlalchemy.engine import Dialect, ExceptionContext
+from sqlalchemy.engine.interfaces import DBAPIConnection
+from sqlalchemy.pool import ConnectionPoolEntry
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+
+logger = logging.getLogger(__name__)
+
+REPLICA_HEALTHY = Gauge(
+    "db_replica_healthy",
+    "1 if the replica receives reads, 0 if it is ejected",
+    ["pool"],
+    multiprocess_mode="liveall",
+)
+
+
+class Replica:
+    def __init__(
+        self,
+        name: str,
+        engine: AsyncEngine,
+        ejection_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.engine = engine
+        self.session_factory = async_sessionmaker(engine, expire_on_commit=False)
+        self._ejection_seconds = ejection_seconds
+        self._clock = clock
+        self._ejected_until = 0.0
+        event.listen(engine.sync_engine, "do_connect", self._connect)
+        event.listen(engine.sync_engine, "handle_error", self._on_error)
+        REPLICA_HEALTHY.labels(name).set(1)
+
+    @property
+    def healthy(self) -> bool:
+        return self._clock() >= self._ejected_until
+
+    def eject(self) -> None:
+        logger.warning(
+            "Ejecting read replica %s for %ss", self.name, self._ejection_seconds
+        )
+        self._ejected_until = self._clock() + self._ejection_seconds
+        REPLICA_HEALTHY.labels(self.name).set(0)
+
+    def _connect(
+        self,
+        dialect: Dialect,
+        conn_rec: ConnectionPoolEntry,
+        cargs: tuple[Any, ...],
+        cparams: dict[str, Any],
+    ) -> DBAPIConnection:
+        # Errors of the driver's connect() do not reach handle_error
+        try:
+            return dialect.connect(*cargs, **cparams)
+        except Exception:
+            self.eject()
+            raise
+
+    def _on_error(self, context: ExceptionContext) -> None:
+        # Only connectivity problems make a replica unhealthy,
+        # errors in the queries themselves would fail on any replica
+        if context.is_disconnect:
+            self.eject()
+
+
+class ReplicaSet:
+    def __init__(self, replicas: list[Replica]):
+        self.replicas = replicas
+        self._next = itertools.cycle(range(len(replicas))) if replicas else None
+
+    def pick(self) -> Replica | None:
+        """Next healthy replica, None if there are none"""
+        if self._next is None:
+            return None
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._next)]
+            if replica.healthy:
+                REPLICA_HEALTHY.labels(replica.name).set(1)
+                return replica
+        return None
+
+    async def dispose(self) -> None:
+        for replica in self.replicas:
+            await replica.engine.dispose()
@@ -0,0 +1,49 @@
+"""
+Request coalescing for concurrent identical reads.
+
+While a call for some key is in flight, other calls with the same key
+do not run their own query but wait for the result of the first one.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+from prometheus_client import Counter
+
+T = TypeVar("T")
+
+COALESCED_REQUESTS = Counter(
+    "coalesced_requests",
+    "Calls that waited for an identical in-flight call instead of querying the DB",
+    ["method"],
+)
+
+
+class SingleFlight(Generic[T]):
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight: dict[Hashable, asyncio.Future[T]] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Return the result of `fn()`, sharing it with all concurrent calls
+        with the same key. Exceptions of `fn()` are raised in every caller.
+        """
+        if (future := self._in_flight.get(key)) is not None:
+            COALESCED_REQUESTS.labels(self.name).inc()
+        else:
+            future = asyncio.ensure_future(fn())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        # A cancelled caller must not cancel the call for everybody else
+        return await asyncio.shield(future)
+
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def _forget(self, key: Hashable, future: asyncio.Future[T]) -> None:
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        # Mark the exception as retrieved in case all callers were cancelled
+        if not future.cancelled():
+            future.exception()
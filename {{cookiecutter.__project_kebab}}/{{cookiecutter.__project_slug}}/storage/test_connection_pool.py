@@ -0,0 +1,226 @@
+import asyncio
+import contextvars
+from typing import Any, Coroutine, TypeVar
+
+import pytest
+import sqlalchemy as sa
+from prometheus_client import REGISTRY
+from sqlalchemy import event, exc
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from {{cookiecutter.__project_slug}}.storage.connection_pool import ConnectionPool
+from {{cookiecutter.__project_slug}}.storage.models import Post
+from {{cookiecutter.__project_slug}}.storage.post_cache import PostCache
+from {{cookiecutter.__project_slug}}.storage.post_repo import PostRepo
+
+T = TypeVar("T")
+
+
+def _metric(name: str) -> float:
+    return REGISTRY.get_sample_value(name, {"pool": "primary"}) or 0.0
+
+
+@pytest.mark.asyncio
+async def test_pool_metrics(db_connection_pool: ConnectionPool):
+    url = db_connection_pool.engine.url.render_as_string(hide_password=False)
+    acquired = _metric("db_pool_acquire_seconds_count")
+
+    async with ConnectionPool(url, pool_size=1, max_overflow=1) as pool:
+        async with pool.engine.connect() as first:
+            await first.execute(sa.text("SELECT 1"))
+            assert _metric("db_pool_checked_out_connections") == 1
+            assert _metric("db_pool_overflow_connections") == 0
+
+            async with pool.engine.connect() as second:
+                await second.execute(sa.text("SELECT 1"))
+                assert _metric("db_pool_checked_out_connections") == 2
+                assert _metric("db_pool_overflow_connections") == 1
+
+        assert _metric("db_pool_checked_out_connections") == 0
+        assert _metric("db_pool_idle_connections") == 1
+
+    assert _metric("db_pool_acquire_seconds_count") == acquired + 2
+
+
+@pytest.mark.asyncio
+async def test_pool_metrics_after_invalidate_and_dispose(
+    db_connection_pool: ConnectionPool,
+):
+    url = db_connection_pool.engine.url.render_as_string(hide_password=False)
+
+    async with ConnectionPool(url, pool_size=2) as pool:
+        async with pool.engine.connect() as first, pool.engine.connect() as second:
+            await first.execute(sa.text("SELECT 1"))
+            await second.execute(sa.text("SELECT 1"))
+            # The invalidated connection is closed and its entry returned
+            await second.invalidate()
+            assert _metric("db_pool_checked_out_connections") == 1
+            assert _metric("db_pool_idle_connections") == 1
+        assert _metric("db_pool_idle_connections") == 2
+
+        await pool.engine.dispose()
+        assert _metric("db_pool_checked_out_connections") == 0
+        assert _metric("db_pool_idle_connections") == 0
+
+
+@pytest.mark.asyncio
+async def test_pool_timeout(db_connection_pool: ConnectionPool):
+    url = db_connection_pool.engine.url.render_as_string(hide_password=False)
+
+    async with ConnectionPool(
+        url, pool_size=1, max_overflow=0, pool_timeout=0.1
+    ) as pool:
+        async with pool.engine.connect() as conn:
+            await conn.execute(sa.text("SELECT 1"))
+            with pytest.raises(exc.TimeoutError):
+                await asyncio.wait_for(pool.engine.connect().start(), timeout=5)
+
+
+@pytest.mark.asyncio
+async def test_pgbouncer_prepared_statements(db_connection_pool: ConnectionPool):
+    url = db_connection_pool.engine.url.render_as_string(hide_password=False)
+
+    async with ConnectionPool(url, pool_size=1, pgbouncer=True) as pool:
+        async with pool.engine.connect() as conn:
+            for value in range(3):
+                await conn.execute(sa.select(sa.literal(value)))
+            result = await conn.execute(
+                sa.text("SELECT name FROM pg_prepared_statements")
+            )
+            names = list(result.scalars())
+
+    # Only the statement being executed is prepared, under a name
+    # that cannot clash with statements of other clients of the server connection
+    assert len(names) == 1
+    assert not names[0].startswith("__asyncpg_stmt_")
+
+
+@pytest.mark.asyncio
+async def test_pgbouncer_listener(db_connection_pool: ConnectionPool):
+    url = db_connection_pool.engine.url.render_as_string(hide_password=False)
+
+    # LISTEN does not work through PgBouncer in transaction mode
+    async with ConnectionPool(url, pgbouncer=True) as pool:
+        with pytest.raises(ValueError):
+            PostRepo(pool, PostCache(max_size=10, ttl=30))
+
+    async with ConnectionPool(url, pgbouncer=True, listen_url=url) as pool:
+        post_repo = PostRepo(pool, PostCache(max_size=10, ttl=30))
+        post = await post_repo.create_post(title="Post", main_content="content")
+        await post_repo.view_post(post.id)
+        # Notified through the direct connection
+        async with pool.new_session() as session, session.begin():
+            await session.execute(
+                sa.update(Post).where(Post.id == post.id).values(title="Changed")
+            )
+        for _ in range(100):
+            cached = await post_repo.view_post(post.id)
+            if cached is not None and cached.title == "Changed":
+                break
+            await asyncio.sleep(0.05)
+        else:
+            pytest.fail("The cached post was not invalidated")
+
+
+async def _in_new_request(coro: Coroutine[Any, Any, T]) -> T:
+    """Run coro like a new request would, without the caller's context"""
+    return await asyncio.create_task(coro, context=contextvars.Context())
+
+
+@pytest.mark.asyncio
+async def test_reads_go_to_replica(db_connection_pool: ConnectionPool):
+    url = db_connection_pool.engine.url.render_as_string(hide_password=False)
+
+    async with ConnectionPool(url, replica_urls=[url]) as pool:
+        [replica_engine] = pool.replica_engines
+
+        async def read_bind():
+            async with pool.new_read_session() as session:
+                return session.bind
+
+        assert await _in_new_request(read_bind()) is replica_engine
+
+        async def write_then_read_bind():
+            async with pool.new_session() as session:
+                await session.execute(sa.text("SELECT 1"))
+            return await read_bind()
+
+        # Reads after a write in the same request see the primary
+        assert await _in_new_request(write_then_read_bind()) is pool.engine
+
+
+@pytest.mark.asyncio
+async def test_read_your_writes_disabled(db_connection_pool: ConnectionPool):
+    url = db_connection_pool.engine.url.render_as_string(hide_password=False)
+
+    async with ConnectionPool(url, replica_urls=[url], read_your_writes=False) as pool:
+
+        async def write_then_read_bind():
+            pool.new_session()
+            async with pool.new_read_session() as session:
+                return session.bind
+
+        assert await _in_new_request(write_then_read_bind()) is not pool.engine
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "broken",
+    [{"database": "no_such_database"}, {"host": "127.0.0.1", "port": 1}],
+    ids=["missing_database", "closed_port"],
+)
+async def test_broken_replica_is_ejected(
+    db_connection_pool: ConnectionPool, broken: dict[str, Any]
+):
+    url = db_connection_pool.engine.url
+    broken_url = url.set(**broken).render_as_string(hide_password=False)
+
+    async with ConnectionPool(
+        url.render_as_string(hide_password=False), replica_urls=[broken_url]
+    ) as pool:
+
+        async def select_one(session: AsyncSession) -> int | None:
+            result = await session.execute(sa.text("SELECT 1"))
+            return result.scalar()
+
+        # The failed read is retried on the primary
+        assert await _in_new_request(pool.read(select_one)) == 1
+        assert (
+            REGISTRY.get_sample_value("db_replica_healthy", {"pool": "replica0"}) == 0
+        )
+
+        async def read_bind():
+            async with pool.new_read_session() as session:
+                return session.bind
+
+        # Falls back to the primary while the only replica is ejected
+        assert await _in_new_request(read_bind()) is pool.engine
+
+
+@pytest.mark.asyncio
+async def test_cached_posts_read_from_primary(db_connection_pool: ConnectionPool):
+    url = db_connection_pool.engine.url.render_as_string(hide_password=False)
+
+    async with ConnectionPool(url, replica_urls=[url]) as pool:
+        post_repo = PostRepo(pool, PostCache(max_size=10, ttl=30))
+        post = await _in_new_request(
+            post_repo.create_post(title="Post", main_content="content")
+        )
+
+        replica_statements: list[str] = []
+
+        def count_statements(
+            _conn: object, _cursor: object, statement: str, *args: object
+        ) -> None:
+            replica_statements.append(statement)
+
+        [replica_engine] = pool.replica_engines
+        event.listen(
+            replica_engine.sync_engine, "before_cursor_execute", count_statements
+        )
+        viewed = await _in_new_request(post_repo.view_post(post.id))
+        await _in_new_request(post_repo.view_posts(limit=10))
+
+        assert viewed is not None and viewed.id == post.id
+        # Only the uncached listing went to the replica
+        assert len(replica_statements) == 1
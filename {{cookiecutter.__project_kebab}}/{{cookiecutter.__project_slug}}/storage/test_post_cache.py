@@ -0,0 +1,141 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from prometheus_client import REGISTRY
+
+from {{cookiecutter.__project_slug}}.storage.connection_pool import ConnectionPool
+from {{cookiecutter.__project_slug}}.storage.models import PostRow
+from {{cookiecutter.__project_slug}}.storage.post_cache import PostCache
+from {{cookiecutter.__project_slug}}.storage.post_repo import PostRepo
+
+
+def _metric(name: str) -> float:
+    return REGISTRY.get_sample_value(name) or 0.0
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _post(post_id: int, title: str = "Title") -> PostRow:
+    now = datetime.now(timezone.utc)
+    return PostRow(
+        post_id, title, "Content", created_at=now, updated_at=now, comment_count=0
+    )
+
+
+def _loader(post: PostRow | None, calls: list[int]):
+    async def load() -> PostRow | None:
+        calls.append(1)
+        return post
+
+    return load
+
+
+@pytest.mark.asyncio
+async def test_cache_hit_and_miss():
+    cache = PostCache(max_size=10, ttl=10)
+    post = _post(1)
+    calls: list[int] = []
+    hits = _metric("post_cache_hits_total")
+    misses = _metric("post_cache_misses_total")
+
+    assert await cache.get_or_load(1, _loader(post, calls)) is post
+    assert await cache.get_or_load(1, _loader(post, calls)) is post
+    assert len(calls) == 1
+    assert _metric("post_cache_hits_total") == hits + 1
+    assert _metric("post_cache_misses_total") == misses + 1
+
+
+@pytest.mark.asyncio
+async def test_cache_does_not_store_missing_posts():
+    cache = PostCache(max_size=10, ttl=10)
+    calls: list[int] = []
+    assert await cache.get_or_load(1, _loader(None, calls)) is None
+    assert await cache.get_or_load(1, _loader(None, calls)) is None
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_cache_ttl():
+    clock = FakeClock()
+    cache = PostCache(max_size=10, ttl=10, clock=clock)
+    post = _post(1)
+    calls: list[int] = []
+
+    await cache.get_or_load(1, _loader(post, calls))
+    clock.now = 9
+    assert cache.peek(1) is post
+    await cache.get_or_load(1, _loader(post, calls))
+    assert len(calls) == 1
+    clock.now = 10
+    assert cache.peek(1) is None
+    await cache.get_or_load(1, _loader(post, calls))
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_cache_evicts_least_recently_used():
+    cache = PostCache(max_size=2, ttl=10)
+    posts = {i: _post(i) for i in range(3)}
+    calls: list[int] = []
+    evictions = _metric("post_cache_evictions_total")
+
+    await cache.get_or_load(0, _loader(posts[0], calls))
+    await cache.get_or_load(1, _loader(posts[1], calls))
+    # Touch post 0 so that post 1 becomes the least recently used one
+    await cache.get_or_load(0, _loader(posts[0], calls))
+    await cache.get_or_load(2, _loader(posts[2], calls))
+    assert len(cache) == 2
+    assert _metric("post_cache_evictions_total") == evictions + 1
+
+    calls.clear()
+    await cache.get_or_load(0, _loader(posts[0], calls))
+    assert calls == []
+    await cache.get_or_load(1, _loader(posts[1], calls))
+    assert calls == [1]
+
+
+@pytest.mark.asyncio
+async def test_cache_ignores_load_racing_with_invalidation():
+    cache = PostCache(max_size=10, ttl=10)
+    stale = _post(1, "Stale")
+
+    async def slow_load() -> PostRow | None:
+        await asyncio.sleep(0)
+        return stale
+
+    load = asyncio.create_task(cache.get_or_load(1, slow_load))
+    await asyncio.sleep(0)
+    cache.invalidate(1)
+    assert await load is stale
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_cache_invalidated_by_other_replica(db_connection_pool: ConnectionPool):
+    # Two repos with separate caches act as two replicas of the service
+    cached_repo = PostRepo(db_connection_pool, PostCache(max_size=10, ttl=60))
+    other_repo = PostRepo(db_connection_pool)
+    assert cached_repo.cache is not None
+
+    post = await other_repo.create_post(title="Original", main_content="Content")
+    cached = await cached_repo.view_post(post.id)
+    assert cached is not None
+    assert cached.title == "Original"
+    assert len(cached_repo.cache) == 1
+
+    await other_repo.update_post(post.id, title="Updated", main_content="Content")
+
+    for _ in range(100):
+        if len(cached_repo.cache) == 0:
+            break
+        await asyncio.sleep(0.05)
+    cached = await cached_repo.view_post(post.id)
+    assert cached is not None
+    assert cached.title == "Updated"
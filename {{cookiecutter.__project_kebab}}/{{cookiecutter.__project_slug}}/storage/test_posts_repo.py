@@ -1,7 +1,27 @@
+import asyncio
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterator
+
 import pytest
+from sqlalchemy import event, make_url, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from {{cookiecutter.__project_slug}}.api.spec import MAX_PAGE_SIZE
 from {{cookiecutter.__project_slug}}.storage.connection_pool import ConnectionPool
-from {{cookiecutter.__project_slug}}.storage.post_repo import PostRepo
+from {{cookiecutter.__project_slug}}.storage.models import Comment, Post, PostRow
+from {{cookiecutter.__project_slug}}.storage.post_cache import PostCache
+from {{cookiecutter.__project_slug}}.storage.post_repo import (
+    SEARCH_MAX_RANKED,
+    NewComment,
+    NewPost,
+    PostRepo,
+)
+from {{cookiecutter.__project_slug}}.testing_utils.db_setup import drop_database
+from {{cookiecutter.__project_slug}}.testing_utils.query_plans import create_seeded_database
 
 
 @pytest.mark.asyncio
@@ -39,7 +59,17 @@ async def test_update_record(db_connection_pool: ConnectionPool):
     )
     assert updated_post is not None
     assert updated_post.title == "Updated Post"
-    assert updated_post.updated_at >= new_post.created_at
+    assert updated_post.updated_at > new_post.updated_at
+    assert updated_post.created_at == new_post.created_at
+
+
+@pytest.mark.asyncio
+async def test_update_missing_record(db_connection_pool: ConnectionPool):
+    post_repo = PostRepo(db_connection_pool)
+    updated_post = await post_repo.update_post(
+        999999, title="Updated Post", main_content="This is the first post"
+    )
+    assert updated_post is None
 
 
 @pytest.mark.asyncio
@@ -48,9 +78,10 @@ async def test_delete_record(db_connection_pool: ConnectionPool):
     new_post = await post_repo.create_post(
         title="First Post", main_content="This is the first post"
     )
-    await post_repo.delete_post(new_post.id)
+    assert await post_repo.delete_post(new_post.id) is True
     post = await post_repo.view_post(new_post.id)
     assert post is None
+    assert await post_repo.delete_post(new_post.id) is False
 
 
 @pytest.mark.asyncio
@@ -95,6 +126,8 @@ async def test_update_comment(db_connection_pool: ConnectionPool):
     )
     assert updated_comment is not None
     assert updated_comment.content == "Updated Comment"
+    assert updated_comment.updated_at > new_comment.updated_at
+    assert await post_repo.update_comment(999999, content="Updated") is None
 
 
 @pytest.mark.asyncio
@@ -106,6 +139,547 @@ async def test_delete_comment(db_connection_pool: ConnectionPool):
     new_comment = await post_repo.create_comment(
         post_id=new_post.id, content="This is a comment"
     )
-    await post_repo.delete_comment(new_comment.id)
+    assert await post_repo.delete_comment(new_comment.id) is True
     comment = await post_repo.view_comment(new_comment.id)
     assert comment is None
+    assert await post_repo.delete_comment(new_comment.id) is False
+
+
+@pytest.mark.asyncio
+async def test_view_posts_pages(db_connection_pool: ConnectionPool):
+    post_repo = PostRepo(db_connection_pool)
+    created = [
+        await post_repo.create_post(title=f"Post {i}", main_content="content")
+        for i in range(5)
+    ]
+
+    first = await post_repo.view_posts(limit=2)
+    assert [post.id for post in first.posts] == [created[0].id, created[1].id]
+    assert first.next_key == (created[1].created_at, created[1].id)
+
+    second = await post_repo.view_posts(limit=2, after=first.next_key)
+    assert [post.id for post in second.posts] == [created[2].id, created[3].id]
+    assert second.next_key is not None
+
+    last = await post_repo.view_posts(limit=2, after=second.next_key)
+    assert [post.id for post in last.posts] == [created[4].id]
+    assert last.next_key is None
+
+
+@pytest.mark.asyncio
+async def test_stream_posts(db_connection_pool: ConnectionPool):
+    post_repo = PostRepo(db_connection_pool)
+    created = [
+        await post_repo.create_post(title=f"Post {i}", main_content="content")
+        for i in range(5)
+    ]
+    streamed = [post async for post in post_repo.stream_posts(batch_size=2)]
+    assert [post.id for post in streamed] == [post.id for post in created]
+
+
+@pytest.mark.asyncio
+async def test_create_posts_bulk(db_connection_pool: ConnectionPool):
+    post_repo = PostRepo(db_connection_pool)
+    posts = await post_repo.create_posts_bulk(
+        [NewPost(title=f"Post {i}", main_content="content") for i in range(3)]
+    )
+    assert [post.title for post in posts] == ["Post 0", "Post 1", "Post 2"]
+    assert len({post.id for post in posts}) == 3
+    assert all(post.created_at.tzinfo is not None for post in posts)
+    assert await post_repo.create_posts_bulk([]) == []
+
+
+@pytest.mark.asyncio
+async def test_create_posts_bulk_upsert(db_connection_pool: ConnectionPool):
+    post_repo = PostRepo(db_connection_pool)
+    first = await post_repo.create_posts_bulk(
+        [
+            NewPost(title="A", main_content="content", client_key="a"),
+            NewPost(title="B", main_content="content"),
+        ]
+    )
+    second = await post_repo.create_posts_bulk(
+        [
+            NewPost(title="A1", main_content="content", client_key="a"),
+            NewPost(title="C", main_content="content", client_key="c"),
+            NewPost(title="A2", main_content="content", client_key="a"),
+        ]
+    )
+    assert second[0].id == second[2].id == first[0].id
+    assert second[0].title == "A2"
+    assert second[1].id != first[1].id
+
+    post = await post_repo.view_post(first[0].id)
+    assert post is not None
+    assert post.title == "A2"
+    assert post.updated_at > first[0].updated_at
+
+
+@pytest.mark.asyncio
+async def test_create_posts_bulk_upsert_order(db_connection_pool: ConnectionPool):
+    post_repo = PostRepo(db_connection_pool)
+    [existing] = await post_repo.create_posts_bulk(
+        [NewPost(title="A", main_content="content", client_key="order-a")]
+    )
+    posts = await post_repo.create_posts_bulk(
+        [
+            NewPost(title="N1", main_content="content"),
+            NewPost(title="N2", main_content="content", client_key="order-n2"),
+            NewPost(title="A1", main_content="content", client_key="order-a"),
+            NewPost(title="N3", main_content="content"),
+        ]
+    )
+    assert [post.title for post in posts] == ["N1", "N2", "A1", "N3"]
+    assert [post.client_key for post in posts] == [None, "order-n2", "order-a", None]
+    assert posts[2].id == existing.id
+
+
+@pytest.mark.asyncio
+async def test_create_comments_bulk(db_connection_pool: ConnectionPool):
+    post_repo = PostRepo(db_connection_pool)
+    new_post = await post_repo.create_post(
+        title="First Post", main_content="This is the first post"
+    )
+    comments = await post_repo.create_comments_bulk(
+        [NewComment(post_id=new_post.id, content=f"Comment {i}") for i in range(3)]
+    )
+    assert [comment.content for comment in comments] == [
+        "Comment 0",
+        "Comment 1",
+        "Comment 2",
+    ]
+    assert all(comment.post_id == new_post.id for comment in comments)
+
+
+@pytest.mark.asyncio
+async def test_search_posts(db_connection_pool: ConnectionPool):
+    post_repo = PostRepo(db_connection_pool)
+    in_content = await post_repo.create_post("Cooking", "Baking bread at home")
+    in_title = await post_repo.create_post("Bread", "Flour, water and salt")
+    other = await post_repo.create_post("Gardening", "Growing tomatoes")
+
+    async def search(query: str) -> list[int]:
+        page = await post_repo.search_posts(query, 10)
+        return [post.id for post in page.posts]
+
+    # Matches in the title rank higher, words are stemmed
+    assert await search("breads") == [in_title.id, in_content.id]
+    assert await search("bread -salt") == [in_content.id]
+    assert await search("tomato OR salt") == [in_title.id, other.id]
+    assert await search('"home baking"') == []
+    assert await search('"baking bread"') == [in_content.id]
+    # Stop words only
+    assert await search("the") == []
+
+    await post_repo.update_post(other.id, "Bread", "Growing wheat")
+    assert await search("wheat") == [other.id]
+
+
+@pytest.mark.asyncio
+async def test_search_posts_pages(db_connection_pool: ConnectionPool):
+    post_repo = PostRepo(db_connection_pool)
+    # Ties of the rank are ordered by id
+    for i in range(5):
+        await post_repo.create_post(f"Post {i}", "Same words")
+    await post_repo.create_post("Same words", "Same words")
+
+    all_posts = await post_repo.search_posts("same words", 10)
+    assert all_posts.next_key is None
+    assert not all_posts.truncated
+    assert [post.title for post in all_posts.posts] == ["Same words"] + [
+        f"Post {i}" for i in range(5)
+    ]
+
+    seen: list[PostRow] = []
+    page = await post_repo.search_posts("same words", 2)
+    seen += page.posts
+    while page.next_key is not None:
+        page = await post_repo.search_posts("same words", 2, page.next_key)
+        seen += page.posts
+    assert seen == all_posts.posts
+
+
+@pytest.mark.asyncio
+async def test_search_posts_truncated(db_connection_pool: ConnectionPool):
+    post_repo = PostRepo(db_connection_pool)
+    # The best match, but the oldest one
+    await post_repo.create_post("Same words", "Same words")
+    await post_repo.create_posts_bulk(
+        [NewPost(f"Post {i}", "Same words") for i in range(SEARCH_MAX_RANKED)]
+    )
+
+    seen: list[PostRow] = []
+    page = await post_repo.search_posts("same words", 300)
+    seen += page.posts
+    assert page.truncated
+    while page.next_key is not None:
+        page = await post_repo.search_posts("same words", 300, page.next_key)
+        seen += page.posts
+        assert page.truncated
+    # The newest matches, every one of them once
+    assert sorted(post.title for post in seen) == sorted(
+        f"Post {i}" for i in range(SEARCH_MAX_RANKED)
+    )
+
+
+async def _comment_counts(pool: ConnectionPool, *post_ids: int) -> list[int]:
+    async with pool.new_session() as session:
+        result = await session.execute(
+            select(Post.comment_count).where(Post.id.in_(post_ids)).order_by(Post.id)
+        )
+        return list(result.scalars().all())
+
+
+@pytest.mark.asyncio
+async def test_comment_count(db_connection_pool: ConnectionPool):
+    post_repo = PostRepo(db_connection_pool, PostCache(max_size=10, ttl=30))
+    first = await post_repo.create_post(title="First", main_content="Content")
+    second = await post_repo.create_post(title="Second", main_content="Content")
+    assert first.comment_count == 0
+    await post_repo.view_post(first.id)
+
+    comment = await post_repo.create_comment(first.id, "Comment")
+    await post_repo.create_comments_bulk(
+        [NewComment(first.id, "Comment"), NewComment(second.id, "Comment")] * 2
+    )
+    assert await _comment_counts(db_connection_pool, first.id, second.id) == [3, 2]
+    # The cached post was invalidated
+    post = await post_repo.view_post(first.id)
+    assert post is not None and post.comment_count == 3
+    version = await post_repo.view_post_version(first.id)
+    assert version is not None and version.comment_count == 3
+    assert version.updated_at == first.updated_at
+
+    async with db_connection_pool.new_session() as session, session.begin():
+        await session.execute(
+            update(Comment).where(Comment.id == comment.id).values(post_id=second.id)
+        )
+    assert await _comment_counts(db_connection_pool, first.id, second.id) == [2, 3]
+
+    assert await post_repo.delete_comment(comment.id) is True
+    assert await _comment_counts(db_connection_pool, first.id, second.id) == [2, 2]
+
+
+@pytest.mark.asyncio
+async def test_create_comment_write_behind(db_connection_pool: ConnectionPool):
+    post_repo = PostRepo(
+        db_connection_pool,
+        PostCache(max_size=10, ttl=30),
+        comment_batch_size=10,
+        comment_batch_delay=0.05,
+    )
+    first = await post_repo.create_post(title="First", main_content="Content")
+    second = await post_repo.create_post(title="Second", main_content="Content")
+    await post_repo.view_post(first.id)
+
+    inserts: list[str] = []
+
+    def count_inserts(
+        _conn: object, _cursor: object, statement: str, *args: object
+    ) -> None:
+        if statement.startswith("INSERT INTO comments"):
+            inserts.append(statement)
+
+    engine = db_connection_pool.engine.sync_engine
+    event.listen(engine, "before_cursor_execute", count_inserts)
+    try:
+        new_comments = [NewComment(first.id, f"Comment {i}") for i in range(5)]
+        new_comments += [NewComment(second.id, f"Comment {i}") for i in range(5)]
+        comments = await asyncio.gather(
+            *[post_repo.create_comment(c.post_id, c.content) for c in new_comments]
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", count_inserts)
+    assert len(inserts) == 1
+    # Every caller gets its own comment
+    assert [(c.post_id, c.content) for c in comments] == [
+        (c.post_id, c.content) for c in new_comments
+    ]
+    assert len({comment.id for comment in comments}) == 10
+    assert all(comment.created_at is not None for comment in comments)
+    # Counted by the trigger, the cached post was invalidated
+    assert await _comment_counts(db_connection_pool, first.id, second.id) == [5, 5]
+    post = await post_repo.view_post(first.id)
+    assert post is not None and post.comment_count == 5
+
+    # A comment of a missing post fails its whole batch
+    results = await asyncio.gather(
+        post_repo.create_comment(first.id, "Comment"),
+        post_repo.create_comment(-1, "Comment"),
+        return_exceptions=True,
+    )
+    assert all(isinstance(result, IntegrityError) for result in results)
+    assert await _comment_counts(db_connection_pool, first.id) == [5]
+
+    # Comments waiting for their batch are written on close
+    pending = asyncio.create_task(post_repo.create_comment(second.id, "Last"))
+    await asyncio.sleep(0)
+    await asyncio.wait_for(post_repo.close(), 5)
+    assert (await pending).content == "Last"
+    assert await _comment_counts(db_connection_pool, second.id) == [6]
+
+
+@pytest.mark.asyncio
+async def test_reconcile_comment_counts(db_connection_pool: ConnectionPool):
+    post_repo = PostRepo(db_connection_pool)
+    posts = [
+        await post_repo.create_post(title=f"Post {i}", main_content="Content")
+        for i in range(5)
+    ]
+    post_ids = [post.id for post in posts]
+    await post_repo.create_comments_bulk(
+        [NewComment(post_id, "Comment") for post_id in post_ids[:3]]
+    )
+    # Counts that are off, e.g. before the backfill
+    async with db_connection_pool.new_session() as session, session.begin():
+        await session.execute(
+            update(Post)
+            .where(Post.id.in_(post_ids[1:4]))
+            .values(comment_count=7, updated_at=Post.updated_at)
+        )
+
+    batches = [
+        batch
+        async for batch in post_repo.reconcile_comment_counts(
+            batch_size=2, after_id=post_ids[0] - 1
+        )
+    ]
+    assert [(batch.last_id, batch.posts, batch.fixed) for batch in batches] == [
+        (post_ids[1], 2, 1),
+        (post_ids[3], 2, 2),
+        (post_ids[4], 1, 0),
+    ]
+    assert await _comment_counts(db_connection_pool, *post_ids) == [1, 1, 1, 0, 0]
+    # Counts are not edits of the posts
+    page = await post_repo.view_posts(5)
+    assert [post.updated_at for post in page.posts] == [
+        post.updated_at for post in posts
+    ]
+
+
+@contextmanager
+def _count_queries(pool: ConnectionPool) -> Iterator[list[str]]:
+    statements: list[str] = []
+
+    def before_cursor_execute(_conn: Any, _cursor: Any, statement: str, *_: Any):
+        statements.append(statement)
+
+    engine = pool.engine.sync_engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.mark.asyncio
+async def test_view_posts_with_comments(db_connection_pool: ConnectionPool):
+    post_repo = PostRepo(db_connection_pool)
+    posts = await post_repo.create_posts_bulk(
+        [
+            NewPost(title=f"Post {i}", main_content="content")
+            for i in range(MAX_PAGE_SIZE)
+        ]
+    )
+    # The first post has no comments, the last one more than a page shows
+    await post_repo.create_comments_bulk(
+        [
+            NewComment(post_id=post.id, content=f"{post.title} comment {i}")
+            for post in posts[1:]
+            for i in range(3)
+        ]
+        + [NewComment(post_id=posts[-1].id, content="More") for _ in range(10)]
+    )
+
+    for limit in (1, 5, MAX_PAGE_SIZE):
+        with _count_queries(db_connection_pool) as statements:
+            page = await post_repo.view_posts_with_comments(limit, comments_per_post=5)
+        # Posts and the comments of all of them, not a query per post
+        assert len(statements) == 2
+        assert [post.id for post in page.posts] == [post.id for post in posts[:limit]]
+
+    assert page.posts[0].comments == []
+    assert [comment.content for comment in page.posts[1].comments] == [
+        "Post 1 comment 0",
+        "Post 1 comment 1",
+        "Post 1 comment 2",
+    ]
+    assert all(len(post.comments) == 3 for post in page.posts[1:-1])
+    # The oldest comments only
+    last = page.posts[-1]
+    assert last.comment_count == 13
+    assert [comment.content for comment in last.comments] == [
+        f"{last.title} comment {i}" for i in range(3)
+    ] + ["More"] * 2
+    assert page.next_key is None
+
+    first = await post_repo.view_posts_with_comments(4, comments_per_post=5)
+    second = await post_repo.view_posts_with_comments(
+        4, after=first.next_key, comments_per_post=5
+    )
+    assert [post.id for post in second.posts] == [post.id for post in posts[4:8]]
+    assert [len(post.comments) for post in second.posts] == [3] * 4
+
+
+class _StatementPerCallPostRepo(PostRepo):
+    """Former view_post building its statement on every call, the benchmark baseline"""
+
+    async def _fetch_post(self, post_id: int) -> PostRow | None:
+        async def fetch(session: AsyncSession) -> PostRow | None:
+            columns = Post.__table__.c
+            stmt = select(*[columns[field] for field in PostRow._fields]).where(
+                columns.id == post_id
+            )
+            row = (await session.execute(stmt)).first()
+            return PostRow._make(row) if row is not None else None
+
+        return await self.pool.read(fetch)
+
+
+async def _cpu_seconds_per_view(post_repo: PostRepo, post_id: int, views: int) -> float:
+    start = time.process_time()
+    for _ in range(views):
+        await post_repo.view_post(post_id)
+    return (time.process_time() - start) / views
+
+
+@pytest.mark.benchmark
+@pytest.mark.asyncio
+async def test_view_post_cpu_time(db_connection_pool: ConnectionPool):
+    """
+    CPU time of this process per view_post with the prebuilt statement,
+    compared to building the statement on every call.
+    Run with `pytest -m benchmark -s`
+    """
+    post_repo = PostRepo(db_connection_pool)
+    baseline_repo = _StatementPerCallPostRepo(db_connection_pool)
+    post = await post_repo.create_post(title="Post", main_content="content")
+    views = 2000
+    # Warm up the compiled and prepared statement caches
+    for repo in (post_repo, baseline_repo):
+        await _cpu_seconds_per_view(repo, post.id, 100)
+
+    baseline = await _cpu_seconds_per_view(baseline_repo, post.id, views)
+    prebuilt = await _cpu_seconds_per_view(post_repo, post.id, views)
+
+    print(
+        f"\nCPU time per view_post: statement per call {baseline * 1e6:.0f}us, "
+        f"prebuilt statement {prebuilt * 1e6:.0f}us"
+    )
+    assert prebuilt < baseline
+
+
+async def _view_posts_orm(pool: ConnectionPool, limit: int) -> list[Post]:
+    """Former view_posts loading Post entities, the benchmark baseline"""
+
+    async def fetch(session: AsyncSession) -> list[Post]:
+        stmt = select(Post).order_by(Post.created_at, Post.id).limit(limit + 1)
+        result = await session.execute(stmt)
+        return list(result.scalars().all())
+
+    return await pool.read(fetch)
+
+
+async def _traced_allocations(
+    view: Callable[[], Awaitable[object]],
+) -> tuple[int, int]:
+    """Peak allocated bytes while viewing and bytes retained by its result"""
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        result = await view()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak - start, retained - start
+
+
+@pytest.mark.benchmark
+@pytest.mark.asyncio
+async def test_view_posts_allocations(db_connection_pool: ConnectionPool):
+    """
+    Memory allocated per listed post by view_posts reading Core rows,
+    compared to loading ORM entities. Run with `pytest -m benchmark -s`
+    """
+    post_repo = PostRepo(db_connection_pool)
+    posts = 10_000
+    await post_repo.create_posts_bulk(
+        [NewPost(title=f"Post {i}", main_content="content") for i in range(posts)]
+    )
+    # Warm up the compiled and prepared statement caches
+    await post_repo.view_posts(posts)
+    await _view_posts_orm(db_connection_pool, posts)
+
+    orm_peak, orm_retained = await _traced_allocations(
+        lambda: _view_posts_orm(db_connection_pool, posts)
+    )
+    rows_peak, rows_retained = await _traced_allocations(
+        lambda: post_repo.view_posts(posts)
+    )
+
+    print(
+        f"\nbytes per listed post: ORM peak {orm_peak / posts:.0f}, "
+        f"retained {orm_retained / posts:.0f}; "
+        f"rows peak {rows_peak / posts:.0f}, retained {rows_retained / posts:.0f}"
+    )
+    assert rows_peak * 2 < orm_peak
+    assert rows_retained * 2 < orm_retained
+
+
+SEARCH_BENCHMARK_POSTS = 1_000_000
+SEARCH_MAX_SECONDS = 0.05
+
+
+async def _search_seconds(post_repo: PostRepo, query: str, searches: int) -> float:
+    # Warm up
+    page = await post_repo.search_posts(query, 20)
+    latencies = []
+    for _ in range(searches):
+        start = time.perf_counter()
+        await post_repo.search_posts(query, 20, page.next_key)
+        latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies)
+
+
+@pytest.mark.benchmark
+@pytest.mark.asyncio
+async def test_search_posts_latency(base_test_db_url: str, template_db_name: str):
+    """
+    Median latency of the second page of search_posts over
+    SEARCH_BENCHMARK_POSTS seeded posts, for queries matching from a few
+    hundred posts to all of them, see testing_utils.query_plans.SEED_VOCABULARY.
+    The slowest are the words in a few percent of the posts, w300 and w500,
+    for which reading the newest matches takes about as long either way.
+    Run with `pytest -m benchmark -s`, seeding takes a few minutes
+    """
+    db_url = await create_seeded_database(
+        base_test_db_url,
+        template_db_name,
+        posts=SEARCH_BENCHMARK_POSTS,
+        comments_per_post=0,
+    )
+    try:
+        async with ConnectionPool(db_url) as pool:
+            post_repo = PostRepo(pool)
+            for query in (
+                "w40000",
+                "w1000",
+                "w500",
+                "w300",
+                "w100",
+                "w10",
+                # In every title
+                "post",
+                "w1000 w2000",
+                '"w100 w200"',
+                "w10 OR w20",
+                "w1000 -w0",
+            ):
+                seconds = await _search_seconds(post_repo, query, 20)
+                print(f"\nsearch_posts({query!r}): {seconds * 1000:.1f}ms")
+                assert seconds < SEARCH_MAX_SECONDS, query
+    finally:
+        db_name = make_url(db_url).database
+        assert db_name is not None
+        await drop_database(base_test_db_url, db_name)
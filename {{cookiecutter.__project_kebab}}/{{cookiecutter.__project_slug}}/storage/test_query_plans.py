@@ -0,0 +1,157 @@
+"""
+Plans of every PostRepo query on a database with a realistic volume of posts,
+see testing_utils.query_plans. After a deliberate change of the costs run
+UPDATE_QUERY_PLAN_COSTS=1 pytest demo/storage/test_query_plans.py
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncGenerator, Awaitable, Callable
+
+import pytest
+import pytest_asyncio
+import sqlalchemy as sa
+
+from {{cookiecutter.__project_slug}}.storage.connection_pool import ConnectionPool
+from {{cookiecutter.__project_slug}}.storage.post_repo import NewComment, NewPost, PostKey, PostRepo
+from {{cookiecutter.__project_slug}}.testing_utils.db_setup import drop_database
+from {{cookiecutter.__project_slug}}.testing_utils.query_plans import (
+    PlanCosts,
+    Statement,
+    capture_statements,
+    create_seeded_database,
+    explain,
+    seq_scans,
+)
+
+_COSTS = PlanCosts(Path(__file__).with_name("query_plan_costs.json"))
+
+
+@dataclass
+class _Seeded:
+    # A post in the middle of the seeded ones, with comments
+    post_id: int
+    post_key: PostKey
+    comment_id: int
+
+
+async def _stream_posts(repo: PostRepo, _: _Seeded) -> None:
+    # Batches are fetched from the cursor, not as statements of their own
+    async for _post in repo.stream_posts():
+        pass
+
+
+async def _reconcile_comment_counts(repo: PostRepo, seeded: _Seeded) -> None:
+    # A single batch of posts
+    async for _batch in repo.reconcile_comment_counts(100, seeded.post_id):
+        break
+
+
+_QUERIES: dict[str, Callable[[PostRepo, _Seeded], Awaitable[object]]] = {
+    "create_post": lambda repo, _: repo.create_post("Title", "Content"),
+    "create_posts_bulk": lambda repo, _: repo.create_posts_bulk(
+        [
+            NewPost("Title", "Content"),
+            NewPost("Title", "Content", client_key="key"),
+        ]
+    ),
+    "view_post": lambda repo, seeded: repo.view_post(seeded.post_id),
+    "view_post_version": lambda repo, seeded: repo.view_post_version(seeded.post_id),
+    "view_posts": lambda repo, _: repo.view_posts(100),
+    "view_posts_after": lambda repo, seeded: repo.view_posts(100, seeded.post_key),
+    # A word of about one post in 250, see testing_utils.query_plans.SEED_VOCABULARY
+    "search_posts": lambda repo, _: repo.search_posts("w1000", 100),
+    "search_posts_after": lambda repo, seeded: repo.search_posts(
+        "w1000", 100, (0.05, seeded.post_id)
+    ),
+    "view_posts_with_comments_after": (
+        lambda repo, seeded: repo.view_posts_with_comments(
+            100, seeded.post_key, comments_per_post=20
+        )
+    ),
+    "stream_posts": _stream_posts,
+    "update_post": lambda repo, seeded: repo.update_post(
+        seeded.post_id, "Title", "Content"
+    ),
+    # The plan does not depend on whether the post exists,
+    # the seeded ones have comments which would prevent the delete
+    "delete_post": lambda repo, _: repo.delete_post(-1),
+    "create_comment": lambda repo, seeded: repo.create_comment(
+        seeded.post_id, "Content"
+    ),
+    "create_comments_bulk": lambda repo, seeded: repo.create_comments_bulk(
+        [NewComment(seeded.post_id, "Content")] * 2
+    ),
+    "view_comment": lambda repo, seeded: repo.view_comment(seeded.comment_id),
+    "update_comment": lambda repo, seeded: repo.update_comment(
+        seeded.comment_id, "Content"
+    ),
+    "delete_comment": lambda repo, seeded: repo.delete_comment(seeded.comment_id),
+    "reconcile_comment_counts": _reconcile_comment_counts,
+}
+
+# Statements that postgres runs itself, e.g. the foreign key checks
+# of deleted posts, which are not part of the plan of the DELETE
+_INTERNAL_QUERIES = {
+    "comments_foreign_key_check": Statement(
+        "SELECT 1 FROM ONLY comments x WHERE $1 = post_id FOR KEY SHARE OF x", (1,)
+    ),
+}
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def seeded_db_url(
+    base_test_db_url: str, template_db_name: str
+) -> AsyncGenerator[str, None]:
+    db_url = await create_seeded_database(base_test_db_url, template_db_name)
+    yield db_url
+    db_name = sa.make_url(db_url).database
+    assert db_name is not None
+    await drop_database(base_test_db_url, db_name)
+
+
+@pytest_asyncio.fixture
+async def seeded_pool(seeded_db_url: str) -> AsyncGenerator[ConnectionPool, None]:
+    # Queries of the tests change a few rows only, the plans stay the same
+    async with ConnectionPool(seeded_db_url) as pool:
+        yield pool
+
+
+async def _seeded(pool: ConnectionPool) -> _Seeded:
+    async with pool.new_session() as session:
+        result = await session.execute(
+            sa.text(
+                "SELECT posts.id, posts.created_at, min(comments.id) FROM posts"
+                " JOIN comments ON comments.post_id = posts.id"
+                " GROUP BY posts.id ORDER BY posts.id OFFSET :offset LIMIT 1"
+            ),
+            {"offset": 10_000},
+        )
+        post_id, created_at, comment_id = result.one()
+    return _Seeded(post_id, (created_at, post_id), comment_id)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", list(_QUERIES))
+async def test_query_plan(name: str, seeded_pool: ConnectionPool):
+    seeded = await _seeded(seeded_pool)
+    with capture_statements(seeded_pool.engine) as statements:
+        await _QUERIES[name](PostRepo(seeded_pool), seeded)
+    assert statements
+
+    costs = []
+    for statement in statements:
+        plan = await explain(
+            seeded_pool.engine, statement, cursor=name == "stream_posts"
+        )
+        assert seq_scans(plan) == [], f"Sequential scan in {statement.sql}"
+        costs.append(plan["Total Cost"])
+    _COSTS.check(name, costs)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", list(_INTERNAL_QUERIES))
+async def test_internal_query_plan(name: str, seeded_pool: ConnectionPool):
+    plan = await explain(seeded_pool.engine, _INTERNAL_QUERIES[name])
+    assert seq_scans(plan) == []
+    _COSTS.check(name, [plan["Total Cost"]])
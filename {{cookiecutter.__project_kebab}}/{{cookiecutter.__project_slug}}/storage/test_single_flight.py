@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import event
+
+from {{cookiecutter.__project_slug}}.storage.connection_pool import ConnectionPool
+from {{cookiecutter.__project_slug}}.storage.post_repo import PostRepo
+from {{cookiecutter.__project_slug}}.storage.single_flight import SingleFlight
+
+
+def _coalesced(method: str) -> float:
+    return (
+        REGISTRY.get_sample_value("coalesced_requests_total", {"method": method}) or 0.0
+    )
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_result():
+    single_flight = SingleFlight[int]("test_shares_result")
+    release = asyncio.Event()
+    calls = 0
+
+    async def fetch() -> int:
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return 42
+
+    callers = [asyncio.create_task(single_flight.do("key", fetch)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+    assert await asyncio.gather(*callers) == [42] * 5
+    assert calls == 1
+    assert single_flight.in_flight() == 0
+    assert _coalesced("test_shares_result") == 4
+
+    # Calls after the first one completed run again
+    assert await single_flight.do("key", fetch) == 42
+    assert calls == 2
+
+
+@pytest.mark.asyncio
+async def test_single_flight_different_keys():
+    single_flight = SingleFlight[str]("test_different_keys")
+    calls: list[str] = []
+
+    async def fetch(key: str) -> str:
+        calls.append(key)
+        await asyncio.sleep(0)
+        return key
+
+    results = await asyncio.gather(
+        single_flight.do("a", lambda: fetch("a")),
+        single_flight.do("b", lambda: fetch("b")),
+    )
+    assert results == ["a", "b"]
+    assert sorted(calls) == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_single_flight_propagates_errors():
+    single_flight = SingleFlight[int]("test_errors")
+
+    async def fetch() -> int:
+        await asyncio.sleep(0)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(
+        single_flight.do("key", fetch),
+        single_flight.do("key", fetch),
+        return_exceptions=True,
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_single_flight_cancelled_caller():
+    single_flight = SingleFlight[int]("test_cancelled")
+    release = asyncio.Event()
+
+    async def fetch() -> int:
+        await release.wait()
+        return 42
+
+    first = asyncio.create_task(single_flight.do("key", fetch))
+    second = asyncio.create_task(single_flight.do("key", fetch))
+    await asyncio.sleep(0)
+    first.cancel()
+    release.set()
+    assert await second == 42
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+
+@pytest.mark.asyncio
+async def test_coalesced_view_post(db_connection_pool: ConnectionPool):
+    post_repo = PostRepo(db_connection_pool, coalesce=["view_post"])
+    post = await post_repo.create_post(title="Post", main_content="content")
+
+    statements: list[str] = []
+
+    def count_statements(
+        _conn: object, _cursor: object, statement: str, *args: object
+    ) -> None:
+        statements.append(statement)
+
+    engine = db_connection_pool.engine.sync_engine
+    event.listen(engine, "before_cursor_execute", count_statements)
+    try:
+        posts = await asyncio.gather(*[post_repo.view_post(post.id) for _ in range(10)])
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statements)
+
+    assert all(viewed is not None and viewed.id == post.id for viewed in posts)
+    assert len([stmt for stmt in statements if stmt.startswith("SELECT")]) == 1
+
+
+def test_coalesce_unknown_method(db_connection_pool: ConnectionPool):
+    with pytest.raises(ValueError):
+        PostRepo(db_connection_pool, coalesce=["create_post"])
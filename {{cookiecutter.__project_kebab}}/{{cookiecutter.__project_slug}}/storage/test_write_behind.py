@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+from {{cookiecutter.__project_slug}}.storage.write_behind import WriteBehindBuffer
+
+
+def _batches(name: str) -> float:
+    return (
+        REGISTRY.get_sample_value("write_behind_batch_size_count", {"buffer": name})
+        or 0.0
+    )
+
+
+class _Writer:
+    def __init__(self):
+        self.batches: list[list[int]] = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self, items: list[int]) -> list[str]:
+        self.batches.append(items)
+        await self.release.wait()
+        if any(item < 0 for item in items):
+            raise ValueError("negative item")
+        return [f"written {item}" for item in items]
+
+
+@pytest.mark.asyncio
+async def test_write_behind_batches_concurrent_items():
+    writer = _Writer()
+    buffer = WriteBehindBuffer("test_batches", writer, max_items=3, max_delay=10)
+
+    results = await asyncio.gather(*[buffer.submit(item) for item in range(6)])
+    # Every caller gets the result of its own item
+    assert results == [f"written {item}" for item in range(6)]
+    # Full batches do not wait for the delay
+    assert writer.batches == [[0, 1, 2], [3, 4, 5]]
+    assert _batches("test_batches") == 2
+    await buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_write_behind_max_delay():
+    writer = _Writer()
+    buffer = WriteBehindBuffer("test_max_delay", writer, max_items=100, max_delay=0.01)
+
+    assert await buffer.submit(1) == "written 1"
+    assert await asyncio.gather(buffer.submit(2), buffer.submit(3)) == [
+        "written 2",
+        "written 3",
+    ]
+    assert writer.batches == [[1], [2, 3]]
+    await buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_write_behind_next_batch_while_writing():
+    writer = _Writer()
+    writer.release.clear()
+    buffer = WriteBehindBuffer("test_next_batch", writer, max_items=10, max_delay=0)
+
+    first = asyncio.create_task(buffer.submit(1))
+    while not writer.batches:
+        await asyncio.sleep(0)
+    # Submitted while the first batch is written
+    later = [asyncio.create_task(buffer.submit(item)) for item in (2, 3)]
+    await asyncio.sleep(0)
+    assert buffer.pending() == 2
+    writer.release.set()
+    assert await asyncio.gather(first, *later) == [
+        "written 1",
+        "written 2",
+        "written 3",
+    ]
+    assert writer.batches == [[1], [2, 3]]
+    await buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_write_behind_batch_error():
+    writer = _Writer()
+    buffer = WriteBehindBuffer("test_error", writer, max_items=2, max_delay=10)
+
+    results = await asyncio.gather(
+        *[buffer.submit(item) for item in (1, -1, 2, 3)], return_exceptions=True
+    )
+    # The error of the batch is raised in every caller of the batch only
+    assert [type(result) for result in results[:2]] == [ValueError] * 2
+    assert results[2:] == ["written 2", "written 3"]
+    await buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_write_behind_close_writes_pending_items():
+    writer = _Writer()
+    buffer = WriteBehindBuffer("test_close", writer, max_items=100, max_delay=10)
+
+    submitted = [asyncio.create_task(buffer.submit(item)) for item in range(3)]
+    await asyncio.sleep(0)
+    # Does not wait for the delay
+    await asyncio.wait_for(buffer.close(), 1)
+    assert writer.batches == [[0, 1, 2]]
+    assert [task.result() for task in submitted] == [
+        f"written {item}" for item in range(3)
+    ]
+    with pytest.raises(RuntimeError):
+        await buffer.submit(4)
+
+
+@pytest.mark.asyncio
+async def test_write_behind_cancelled_caller():
+    writer = _Writer()
+    writer.release.clear()
+    buffer = WriteBehindBuffer("test_cancelled", writer, max_items=2, max_delay=10)
+
+    first = asyncio.create_task(buffer.submit(1))
+    second = asyncio.create_task(buffer.submit(2))
+    await asyncio.sleep(0)
+    first.cancel()
+    writer.release.set()
+    # The item of the cancelled caller is written anyway
+    assert await second == "written 2"
+    assert writer.batches == [[1, 2]]
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    await buffer.close()
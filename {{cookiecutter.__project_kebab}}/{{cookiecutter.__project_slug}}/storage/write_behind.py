@@ -0,0 +1,152 @@
+"""
+Write-behind batching of concurrent writes.
+
+Items submitted by concurrent callers are buffered in the process and
+written together, so that a burst of writes costs a few transactions
+(and commits) instead of one per item. Every caller waits for the batch
+of its item and gets its own result back, or the error of the batch.
+"""
+
+import asyncio
+import contextvars
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Generic, Sequence, TypeVar
+
+from prometheus_client import Histogram
+
+logger = logging.getLogger(__name__)
+
+ItemT = TypeVar("ItemT")
+ResultT = TypeVar("ResultT")
+
+WRITE_BATCH_SIZE = Histogram(
+    "write_behind_batch_size",
+    "Items written together by a write-behind buffer",
+    ["buffer"],
+    buckets=[1, 2, 5, 10, 20, 50, 100, 200, 500, 1000],
+)
+
+
+@dataclass
+class _Pending(Generic[ItemT, ResultT]):
+    item: ItemT
+    result: asyncio.Future[ResultT]
+    # Loop time of the submission
+    submitted_at: float
+
+
+def _retrieve_exception(result: asyncio.Future) -> None:
+    # Marks the exception as retrieved in case the caller was cancelled
+    if not result.cancelled():
+        result.exception()
+
+
+class WriteBehindBuffer(Generic[ItemT, ResultT]):
+    def __init__(
+        self,
+        name: str,
+        write: Callable[[list[ItemT]], Awaitable[Sequence[ResultT]]],
+        max_items: int = 100,
+        max_delay: float = 0.005,
+    ):
+        """
+        write: writes a batch of items, returns a result per item, in order
+        max_items: a batch is written as soon as it has this many items
+        max_delay: max seconds an item waits for more items to write with
+
+        Batches are written one at a time by a background task, started by
+        the first submission. Items submitted while a batch is written
+        make up the next one.
+        """
+        if max_items <= 0:
+            raise ValueError("max_items must be positive")
+        self.name = name
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self._write = write
+        self._pending: list[_Pending[ItemT, ResultT]] = []
+        self._submitted = asyncio.Event()
+        self._closing = False
+        self._task: asyncio.Task | None = None
+
+    async def submit(self, item: ItemT) -> ResultT:
+        """
+        Result of writing `item` with the next batch. Exceptions of the
+        write of the batch are raised in every caller of the batch.
+        A cancelled caller does not cancel the write of its item.
+        """
+        if self._closing:
+            raise RuntimeError(f"Write-behind buffer {self.name} is closed")
+        loop = asyncio.get_running_loop()
+        pending = _Pending(item, loop.create_future(), loop.time())
+        pending.result.add_done_callback(_retrieve_exception)
+        self._pending.append(pending)
+        self._submitted.set()
+        if self._task is None:
+            # In a context of its own, not in the one of the first caller
+            self._task = loop.create_task(self._run(), context=contextvars.Context())
+        return await asyncio.shield(pending.result)
+
+    def pending(self) -> int:
+        """Items waiting for their batch to be written"""
+        return len(self._pending)
+
+    async def close(self) -> None:
+        """Write the items submitted so far and stop, new items are rejected"""
+        self._closing = True
+        self._submitted.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending or not self._closing:
+                if not self._pending:
+                    self._submitted.clear()
+                    await self._submitted.wait()
+                    continue
+                # The oldest item does not wait longer than max_delay
+                deadline = self._pending[0].submitted_at + self.max_delay
+                while len(self._pending) < self.max_items and not self._closing:
+                    if (remaining := deadline - loop.time()) <= 0:
+                        break
+                    self._submitted.clear()
+                    try:
+                        await asyncio.wait_for(self._submitted.wait(), remaining)
+                    except TimeoutError:
+                        break
+                batch = self._pending[: self.max_items]
+                del self._pending[: self.max_items]
+                await self._write_batch(batch)
+        finally:
+            # Only left when the task is cancelled, e.g. the loop is shut down
+            for pending in self._pending:
+                pending.result.cancel()
+
+    async def _write_batch(self, batch: list[_Pending[ItemT, ResultT]]) -> None:
+        WRITE_BATCH_SIZE.labels(self.name).observe(len(batch))
+        try:
+            results = await self._write([pending.item for pending in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(
+                    f"Write of {len(batch)} items returned {len(results)} results"
+                )
+        except asyncio.CancelledError:
+            for pending in batch:
+                pending.result.cancel()
+            raise
+        except Exception as e:
+            logger.warning(
+                "Write of a batch of %d items of %s failed: %r",
+                len(batch),
+                self.name,
+                e,
+            )
+            for pending in batch:
+                pending.result.set_exception(e)
+            return
+        for pending, result in zip(batch, results):
+            pending.result.set_result(result)
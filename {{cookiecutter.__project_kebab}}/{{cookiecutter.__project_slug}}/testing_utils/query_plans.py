@@ -0,0 +1,197 @@
+"""
+Query plan checks.
+
+Statements sent by the code under test are captured and explained with
+EXPLAIN (FORMAT JSON) on a database seeded with a realistic volume of rows,
+see create_seeded_database. Plans are checked for sequential scans and their
+costs are compared to the costs recorded in a JSON file.
+"""
+
+import json
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterator
+
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.engine.interfaces import ExecuteStyle
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from .db_setup import create_test_database_from_template
+
+# Set to record the current plan costs instead of comparing to them
+UPDATE_COSTS_ENV = "UPDATE_QUERY_PLAN_COSTS"
+
+# A plan may cost this many times more than the recorded cost, as
+# the statistics come from a random sample of the seeded rows
+COST_TOLERANCE = 1.5
+
+SEED_POSTS = 20_000
+SEED_COMMENTS_PER_POST = 5
+# Posts are made of SEED_WORDS_PER_POST words "w0", "w1", ... out of
+# SEED_VOCABULARY, the lower the number the more common the word
+SEED_VOCABULARY = 50_000
+SEED_WORDS_PER_POST = 40
+
+
+def _seed_statements(posts: int, comments_per_post: int) -> list[str]:
+    statements = [
+        # The same words on every run, for the same statistics and plan costs
+        "SELECT setseed(0.5)",
+        # Posts of the last `posts` minutes, a post per minute.
+        # WHERE n > 0 draws new words for every post
+        f"""
+        INSERT INTO posts (title, main_content, created_at, updated_at)
+        SELECT
+            'Post ' || n,
+            (
+                SELECT string_agg(
+                    'w' || floor(power(random(), 4) * {SEED_VOCABULARY}), ' '
+                )
+                FROM generate_series(1, {SEED_WORDS_PER_POST})
+                WHERE n > 0
+            ),
+            now() - make_interval(mins => {posts} - n),
+            now() - make_interval(mins => {posts} - n)
+        FROM generate_series(1, {posts}) AS n
+        """,
+    ]
+    if comments_per_post > 0:
+        statements += [
+            f"""
+            INSERT INTO comments (post_id, content, created_at, updated_at)
+            SELECT posts.id, 'Comment ' || n, posts.created_at, posts.created_at
+            FROM posts, generate_series(1, {comments_per_post}) AS n
+            ORDER BY posts.id, n
+            """,
+            # The comment count triggers updated every post once, in no
+            # particular order. Rewrites the posts in the order they were
+            # created, as they are when the counts are updated in place (HOT)
+            "CLUSTER posts USING ix_posts_created_at_id",
+        ]
+    return statements
+
+
+async def create_seeded_database(
+    base_db_url: str,
+    template_db_name: str,
+    posts: int = SEED_POSTS,
+    comments_per_post: int = SEED_COMMENTS_PER_POST,
+) -> str:
+    """
+    Create a database from the template with `posts` posts and their
+    comments, vacuumed and analyzed. Returns its URL
+    """
+    db_url = await create_test_database_from_template(base_db_url, template_db_name)
+    # VACUUM cannot run inside a transaction block
+    engine = create_async_engine(
+        db_url, poolclass=NullPool, isolation_level="AUTOCOMMIT"
+    )
+    async with engine.connect() as conn:
+        for statement in _seed_statements(posts, comments_per_post):
+            await conn.execute(sa.text(statement))
+        # Marks the pages all-visible for index-only scans, and collects
+        # the statistics the planner chooses plans with
+        await conn.execute(sa.text("VACUUM ANALYZE"))
+    await engine.dispose()
+    return db_url
+
+
+@dataclass
+class Statement:
+    sql: str
+    parameters: Any
+
+
+@contextmanager
+def capture_statements(engine: AsyncEngine) -> Iterator[list[Statement]]:
+    """Statements executed by the engine within the block"""
+    statements: list[Statement] = []
+
+    def before_cursor_execute(
+        _conn: Any,
+        _cursor: Any,
+        sql: str,
+        parameters: Any,
+        context: Any,
+        _executemany: bool,
+    ) -> None:
+        # The plan does not depend on which of the parameter sets is used.
+        # Batches of multi-row INSERT ... VALUES have a single set
+        if context.execute_style is ExecuteStyle.EXECUTEMANY:
+            parameters = parameters[0]
+        statements.append(Statement(sql, parameters))
+
+    sync_engine = engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+async def explain(
+    engine: AsyncEngine, statement: Statement, cursor: bool = False
+) -> dict[str, Any]:
+    """
+    Plan of the statement, without running it
+
+    cursor: the statement is read through a server-side cursor,
+        which postgres plans for fetching the first rows fast
+    """
+    sql = statement.sql
+    if cursor:
+        sql = f"DECLARE explained CURSOR FOR {sql}"
+    async with engine.connect() as conn:
+        result = await conn.exec_driver_sql(
+            f"EXPLAIN (FORMAT JSON) {sql}", statement.parameters
+        )
+        [explained] = result.scalar_one()
+        await conn.rollback()
+    if isinstance(explained, str):
+        explained = json.loads(explained)
+    return explained["Plan"]
+
+
+def seq_scans(plan: dict[str, Any]) -> list[str]:
+    """Relations read with a sequential scan anywhere in the plan"""
+    scanned = []
+    if plan["Node Type"] == "Seq Scan":
+        scanned.append(plan["Relation Name"])
+    for subplan in plan.get("Plans", []):
+        scanned.extend(seq_scans(subplan))
+    return scanned
+
+
+class PlanCosts:
+    """
+    Total costs of the plans of the statements of every named query,
+    recorded in a JSON file. Run with UPDATE_QUERY_PLAN_COSTS=1 to record
+    the current costs after a deliberate change of the queries or the schema
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.update = bool(os.environ.get(UPDATE_COSTS_ENV))
+
+    def check(self, name: str, costs: list[float]) -> None:
+        recorded_costs: dict[str, list[float]] = json.loads(self.path.read_text())
+        if self.update:
+            recorded_costs[name] = [round(cost, 2) for cost in costs]
+            self.path.write_text(
+                json.dumps(recorded_costs, indent=2, sort_keys=True) + "\n"
+            )
+            return
+        recorded = recorded_costs.get(name)
+        assert recorded is not None and len(recorded) == len(costs), (
+            f"Statements of {name!r} changed, record their costs "
+            f"with {UPDATE_COSTS_ENV}=1"
+        )
+        for cost, recorded_cost in zip(costs, recorded):
+            assert cost <= recorded_cost * COST_TOLERANCE, (
+                f"Plan cost of {name!r} regressed from {recorded_cost} to {cost}, "
+                f"if this is expected record it with {UPDATE_COSTS_ENV}=1"
+            )
@@ -2,109 +2,263 @@
 Tracking middleware
 """
 
-import asyncio
 import logging
-from dataclasses import dataclass
+import random
+import time
+from dataclasses import dataclass, field
 from functools import cached_property
+from typing import Callable, Iterable, Mapping
 
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from starlette.requests import Request
-from starlette.responses import Response
+from prometheus_client import Counter
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from uvicorn.protocols import utils as uviutils
 
 from {{cookiecutter.__project_slug}}.slog import logging_context
 
 logger = logging.getLogger(__name__)
 
+ACCESS_LOG_SUPPRESSED = Counter(
+    "access_log_suppressed",
+    "Requests without an access log line",
+    ["reason"],
+)
+
+
+def _find_header(headers: Iterable[tuple[bytes, bytes]], name: bytes) -> str | None:
+    """Value of the first header `name` (lowercase) without copying all headers"""
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _parse_content_length(value: str | None) -> int | None:
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
 
 @dataclass
 class RequestView:
-    request: Request
+    scope: Scope
 
     @property
     def client_addr(self) -> str:
-        client = self.request.scope.get("client")
+        client = self.scope.get("client")
         if not client:
             return ""
         return f"{client[0]}:{client[1]}"
 
     @property
     def url_path(self) -> str:
-        return uviutils.get_path_with_query_string(self.request.scope)  # type: ignore
+        return uviutils.get_path_with_query_string(self.scope)  # type: ignore
+
+    @property
+    def path(self) -> str:
+        return self.scope["path"]
 
     @property
     def method(self) -> str:
-        return self.request["method"]
+        return self.scope["method"]
 
     @property
     def http_version(self) -> str:
-        version = self.request["http_version"]
+        version = self.scope["http_version"]
         return f"HTTP/{version}"
 
     @cached_property
     def request_id(self) -> str | None:
-        return self.headers.get("x-request-id")
+        return self.header(b"x-request-id")
 
     @property
     def content_length(self) -> int | None:
-        try:
-            content_length = self.headers["Content-Length"]
-            return int(content_length)
-        except KeyError:
-            return None
+        return _parse_content_length(self.header(b"content-length"))
 
     @property
     def user_agent(self) -> str | None:
-        return self.headers.get("user-agent")
+        return self.header(b"user-agent")
 
-    @cached_property
-    def headers(self) -> dict:
-        return dict(self.request.headers.items())
+    def header(self, name: bytes) -> str | None:
+        return _find_header(self.scope.get("headers", ()), name)
 
 
 @dataclass
 class ResponseView:
-    response: Response
+    """Collects what is logged about the response from the sent ASGI messages"""
+
+    status: int | None = None
+    headers: list[tuple[bytes, bytes]] = field(default_factory=list)
+    body_size: int = 0
+
+    def on_message(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+            self.headers = message.get("headers", [])
+        elif message["type"] == "http.response.body":
+            self.body_size += len(message.get("body", b""))
 
     @property
     def content_length(self) -> int | None:
-        try:
-            content_length = self.response.headers["Content-Length"]
-            return int(content_length)
-        except KeyError:
-            return None
+        """Content-Length header, or the bytes sent for responses without it"""
+        content_length = _parse_content_length(
+            _find_header(self.headers, b"content-length")
+        )
+        if content_length is None and self.status is not None:
+            return self.body_size
+        return content_length
+
+
+class AccessLogSampler:
+    """
+    Decides which requests get an access log line.
+
+    Successful requests (status below 400) are logged with `success_rate`
+    probability, or the rate of the longest matching prefix in `path_rates`.
+    Failed requests and requests slower than `slow_seconds` are always logged.
 
+    On top of that at most `max_per_second` lines are logged (0 for no limit),
+    lines over the limit are counted and reported at most every
+    `summary_interval` seconds.
+    """
 
-class TrackingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
-        request_view = RequestView(request)
+    def __init__(
+        self,
+        success_rate: float = 1.0,
+        slow_seconds: float | None = None,
+        path_rates: Mapping[str, float] | None = None,
+        max_per_second: float = 0.0,
+        summary_interval: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+        rand: Callable[[], float] = random.random,
+    ):
+        self.success_rate = success_rate
+        self.slow_seconds = slow_seconds
+        # Most specific prefix first
+        self.path_rates = sorted(
+            (path_rates or {}).items(), key=lambda item: len(item[0]), reverse=True
+        )
+        self.max_per_second = max_per_second
+        self.summary_interval = summary_interval
+        self._clock = clock
+        self._rand = rand
+        self._tokens = max(max_per_second, 1.0)
+        self._refilled_at = clock()
+        self._rate_limited = 0
+        self._summarized_at = clock()
+
+    def should_log(self, path: str, status: int, latency: float) -> bool:
+        if status < 400 and (self.slow_seconds is None or latency < self.slow_seconds):
+            rate = self._success_rate(path)
+            if rate < 1.0 and self._rand() >= rate:
+                ACCESS_LOG_SUPPRESSED.labels("sampled").inc()
+                return False
+        if self.max_per_second > 0 and not self._take_token():
+            self._rate_limited += 1
+            ACCESS_LOG_SUPPRESSED.labels("rate_limited").inc()
+            return False
+        return True
+
+    def take_summary(self) -> int:
+        """
+        Number of lines dropped by the rate limit since the last summary,
+        0 if there are none or the last summary was less than summary_interval ago
+        """
+        if not self._rate_limited:
+            return 0
+        now = self._clock()
+        if now - self._summarized_at < self.summary_interval:
+            return 0
+        rate_limited, self._rate_limited = self._rate_limited, 0
+        self._summarized_at = now
+        return rate_limited
+
+    def _success_rate(self, path: str) -> float:
+        for prefix, rate in self.path_rates:
+            if path.startswith(prefix):
+                return rate
+        return self.success_rate
+
+    def _take_token(self) -> bool:
+        now = self._clock()
+        burst = max(self.max_per_second, 1.0)
+        self._tokens = min(
+            burst, self._tokens + (now - self._refilled_at) * self.max_per_second
+        )
+        self._refilled_at = now
+        if self._tokens < 1.0:
+            return False
+        self._tokens -= 1.0
+        return True
+
+
+class TrackingMiddleware:
+    """
+    Logs http requests with their `httpRequest` fields
+    and adds their request id to the logging context.
+
+    Plain ASGI middleware: it does not wrap the response into
+    an extra task and stream like BaseHTTPMiddleware does.
+    """
+
+    def __init__(self, app: ASGIApp, sampler: AccessLogSampler | None = None):
+        """sampler: which requests to log, all of them by default"""
+        self.app = app
+        self.sampler = sampler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_view = RequestView(scope)
+        response_view = ResponseView()
+
+        async def send_tracked(message: Message) -> None:
+            response_view.on_message(message)
+            await send(message)
 
         with logging_context(request_id=request_view.request_id):
             # measure request time
-            start_time = asyncio.get_event_loop().time()
-            response = await call_next(request)
-            end_time = asyncio.get_event_loop().time()
-
-            response_view = ResponseView(response)
-
-            logger.info(
-                "%s %s %s",
-                request_view.method,
-                request_view.url_path,
-                request_view.http_version,
-                extra={
-                    "httpRequest": {
-                        "requestMethod": request_view.method,
-                        "requestUrl": request_view.url_path,
-                        "remoteIp": request_view.client_addr,
-                        "protocol": request_view.http_version,
-                        "userAgent": request_view.user_agent,
-                        "requestSize": request_view.content_length,
-                        "responseSize": response_view.content_length,
-                        "latency": f"{round(end_time - start_time, 6)}s",
-                        "status": response.status_code,
-                    }
-                },
-            )
-
-        return response
+            start_time = time.perf_counter()
+            try:
+                await self.app(scope, receive, send_tracked)
+            finally:
+                end_time = time.perf_counter()
+                self._log(request_view, response_view, latency=end_time - start_time)
+
+    def _log(
+        self, request_view: RequestView, response_view: ResponseView, latency: float
+    ) -> None:
+        # The app failed before sending a response
+        status = response_view.status or 500
+        # Decide before building the log record, skipped requests cost little
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        if self.sampler is not None:
+            if not self.sampler.should_log(request_view.path, status, latency):
+                return
+            if rate_limited := self.sampler.take_summary():
+                logger.warning("Access log rate limit dropped %d lines", rate_limited)
+
+        logger.info(
+            "%s %s %s",
+            request_view.method,
+            request_view.url_path,
+            request_view.http_version,
+            extra={
+                "httpRequest": {
+                    "requestMethod": request_view.method,
+                    "requestUrl": request_view.url_path,
+                    "remoteIp": request_view.client_addr,
+                    "protocol": request_view.http_version,
+                    "userAgent": request_view.user_agent,
+                    "requestSize": request_view.content_length,
+                    "responseSize": response_view.content_length,
+                    "latency": f"{round(latency, 6)}s",
+                    "status": status,
+                }
+            },
+        )
@@ -4,36 +4,42 @@ Context based tracking middleware tests
 
 import asyncio
 import logging
+import time
 from unittest.mock import ANY
 
 import pytest
+from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
 from starlette.requests import Request
-from starlette.responses import Response
+from starlette.responses import Response, StreamingResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from .slog import logging_context
 from .testing_utils.log import JsonLogs
-from .tracking import RequestView, ResponseView, TrackingMiddleware
+from .tracking import (
+    AccessLogSampler,
+    RequestView,
+    ResponseView,
+    TrackingMiddleware,
+)
 
 logger = logging.getLogger(__name__)
 
 
 @pytest.fixture()
-def f_request() -> Request:
-    return Request(
-        scope={
-            "method": "GET",
-            "type": "http",
-            "http_version": "1.1",
-            "headers": [
-                (b"x-request-id", b"abc"),
-                (b"user-agent", b"agent"),
-                (b"Content-Length", b"10"),
-            ],
-            "client": ("10.1.1.10", "10"),
-            "path": "/v1/path",
-            "query_string": "",
-        },
-    )
+def f_scope() -> Scope:
+    return {
+        "method": "GET",
+        "type": "http",
+        "http_version": "1.1",
+        "headers": [
+            (b"x-request-id", b"abc"),
+            (b"user-agent", b"agent"),
+            (b"content-length", b"10"),
+        ],
+        "client": ("10.1.1.10", "10"),
+        "path": "/v1/path",
+        "query_string": "",
+    }
 
 
 @pytest.fixture()
@@ -41,8 +47,31 @@ def f_response() -> Response:
     return Response(headers={"Content-Length": "10"})
 
 
-def test_request_view(f_request: Request):
-    view = RequestView(f_request)
+async def _call(app: ASGIApp, scope: Scope) -> list[Message]:
+    sent: list[Message] = []
+    body_received = False
+
+    async def receive() -> Message:
+        nonlocal body_received
+        if body_received:
+            # Client stays connected
+            await asyncio.Future()
+        body_received = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: Message) -> None:
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent
+
+
+async def _run(app: ASGIApp, scope: Scope) -> list[Message]:
+    return await _call(TrackingMiddleware(app), scope)
+
+
+def test_request_view(f_scope: Scope):
+    view = RequestView(f_scope)
     assert view.client_addr == "10.1.1.10:10"
     assert view.url_path == "/v1/path"
     assert view.method == "GET"
@@ -52,25 +81,41 @@ def test_request_view(f_request: Request):
     assert view.user_agent == "agent"
 
 
-def test_response_view(f_response: Response):
-    view = ResponseView(f_response)
+def test_response_view():
+    view = ResponseView()
+    view.on_message(
+        {
+            "type": "http.response.start",
+            "status": 201,
+            "headers": [(b"content-length", b"10")],
+        }
+    )
+    assert view.status == 201
     assert view.content_length == 10
 
 
+def test_response_view_without_content_length():
+    view = ResponseView()
+    view.on_message({"type": "http.response.start", "status": 200, "headers": []})
+    view.on_message({"type": "http.response.body", "body": b"abc", "more_body": True})
+    view.on_message({"type": "http.response.body", "body": b"de"})
+    assert view.content_length == 5
+
+
 @pytest.mark.asyncio
 async def test_tracking_middleware(
-    f_request: Request,
+    f_scope: Scope,
     f_response: Response,
     structured_logs_capture: JsonLogs,
 ):
-    async def api_call(request: Request):
+    async def api_call(scope: Scope, receive: Receive, send: Send):
         with logging_context(b=20):
             logger.info("slow api call")
             await asyncio.sleep(0.2)
-        return f_response
+        await f_response(scope, receive, send)
 
-    tracking = TrackingMiddleware(None)  # type: ignore
-    await tracking.dispatch(f_request, api_call)
+    sent = await _run(api_call, f_scope)
+    assert sent[0]["status"] == 200
 
     assert structured_logs_capture.parse() == [
         {
@@ -108,3 +153,163 @@ async def test_tracking_middleware(
     # latency in string format as "0.123s"
     latency = float(structured_logs_capture.parse()[1]["httpRequest"]["latency"][:-1])
     assert 0.19 <= latency <= 0.21
+
+
+@pytest.mark.asyncio
+async def test_tracking_middleware_streaming(
+    f_scope: Scope, structured_logs_capture: JsonLogs
+):
+    async def chunks():
+        yield b"abc"
+        yield b"de"
+
+    sent = await _run(StreamingResponse(chunks()), f_scope)
+    assert b"".join(message.get("body", b"") for message in sent[1:]) == b"abcde"
+
+    [log] = structured_logs_capture.parse()
+    assert log["httpRequest"]["responseSize"] == 5
+    assert log["httpRequest"]["status"] == 200
+
+
+@pytest.mark.asyncio
+async def test_tracking_middleware_error(
+    f_scope: Scope, structured_logs_capture: JsonLogs
+):
+    async def failing_app(scope: Scope, receive: Receive, send: Send):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        await _run(failing_app, f_scope)
+
+    [log] = structured_logs_capture.parse()
+    assert log["httpRequest"]["status"] == 500
+    assert log["logging.googleapis.com/labels"]["request_id"] == "abc"
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_sampler_rates():
+    sampler = AccessLogSampler(
+        success_rate=0.0,
+        slow_seconds=1.0,
+        path_rates={"/v1": 0.5, "/v1/posts": 1.0},
+        rand=lambda: 0.7,
+    )
+    assert not sampler.should_log("/other", 200, 0.1)
+    assert sampler.should_log("/other", 404, 0.1)
+    assert sampler.should_log("/other", 500, 0.1)
+    assert sampler.should_log("/other", 200, 1.5)
+    # The longest matching prefix wins
+    assert not sampler.should_log("/v1/comments", 200, 0.1)
+    assert sampler.should_log("/v1/posts/1", 200, 0.1)
+
+
+def test_sampler_rate_limit():
+    clock = _Clock()
+    sampler = AccessLogSampler(max_per_second=2, summary_interval=10, clock=clock)
+    assert [sampler.should_log("/", 500, 0.1) for _ in range(3)] == [
+        True,
+        True,
+        False,
+    ]
+    assert sampler.take_summary() == 0
+
+    clock.now = 10.0
+    assert sampler.should_log("/", 200, 0.1)
+    assert sampler.take_summary() == 1
+    assert sampler.take_summary() == 0
+
+
+@pytest.mark.asyncio
+async def test_tracking_middleware_sampling(
+    f_scope: Scope, structured_logs_capture: JsonLogs
+):
+    clock = _Clock()
+    tracking = TrackingMiddleware(
+        Response(),
+        sampler=AccessLogSampler(
+            success_rate=0.0, max_per_second=1, summary_interval=0, clock=clock
+        ),
+    )
+    error = TrackingMiddleware(Response(status_code=503), sampler=tracking.sampler)
+
+    await _call(tracking, f_scope)
+    assert structured_logs_capture.parse() == []
+
+    await _call(error, f_scope)
+    await _call(error, f_scope)
+    clock.now = 1.0
+    await _call(error, f_scope)
+
+    logs = structured_logs_capture.parse()
+    assert [log["severity"] for log in logs] == ["INFO", "WARNING", "INFO"]
+    assert logs[1]["message"] == "Access log rate limit dropped 1 lines"
+
+
+class _BaseHTTPTracking(BaseHTTPMiddleware):
+    """Former BaseHTTPMiddleware based implementation, the benchmark baseline"""
+
+    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
+        request_view = RequestView(request.scope)
+        with logging_context(request_id=request_view.request_id):
+            start_time = time.perf_counter()
+            response = await call_next(request)
+            end_time = time.perf_counter()
+            logger.info(
+                "%s %s %s",
+                request_view.method,
+                request_view.url_path,
+                request_view.http_version,
+                extra={
+                    "httpRequest": {
+                        "requestMethod": request_view.method,
+                        "requestUrl": request_view.url_path,
+                        "remoteIp": request_view.client_addr,
+                        "protocol": request_view.http_version,
+                        "userAgent": request_view.user_agent,
+                        "requestSize": request_view.content_length,
+                        "responseSize": response.headers.get("content-length"),
+                        "latency": f"{round(end_time - start_time, 6)}s",
+                        "status": response.status_code,
+                    }
+                },
+            )
+        return response
+
+
+async def _seconds_per_request(app: ASGIApp, scope: Scope, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        await _call(app, scope)
+    return (time.perf_counter() - start) / requests
+
+
+@pytest.mark.benchmark
+@pytest.mark.asyncio
+async def test_tracking_middleware_overhead(f_scope: Scope):
+    """
+    Per-request overhead of the tracking middleware on top of a bare app,
+    compared to the former BaseHTTPMiddleware implementation.
+    Run with `pytest -m benchmark -s`
+    """
+    app = Response(b"x" * 100)
+    requests = 5000
+    # Warm up imports and caches
+    for candidate in (app, TrackingMiddleware(app), _BaseHTTPTracking(app)):
+        await _seconds_per_request(candidate, f_scope, 100)
+
+    bare = await _seconds_per_request(app, f_scope, requests)
+    asgi = await _seconds_per_request(TrackingMiddleware(app), f_scope, requests)
+    base_http = await _seconds_per_request(_BaseHTTPTracking(app), f_scope, requests)
+
+    print(
+        f"\nper-request overhead: pure ASGI {(asgi - bare) * 1e6:.1f}us, "
+        f"BaseHTTPMiddleware {(base_http - bare) * 1e6:.1f}us"
+    )
+    assert asgi - bare < base_http - bare
@@ -0,0 +1,280 @@
+"""
+Multi-process serving
+
+The parent process binds the listening socket and runs a supervisor
+based on uvicorn's Multiprocess, which spawns the workers. Every worker
+accepts connections on the inherited socket and opens its own ConnectionPool.
+Workers report to the supervisor when they have started.
+
+Signals of the parent process:
+SIGHUP - rolling restart, each new worker has to start
+    before the old one is stopped
+SIGTTIN / SIGTTOU - one more / one less worker
+SIGINT / SIGTERM - graceful shutdown of all workers
+
+Prometheus metrics of the workers are written to PROMETHEUS_MULTIPROC_DIR
+and aggregated by the /metrics endpoint of whichever worker serves it.
+"""
+
+import glob
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import signal
+import tempfile
+import time
+import traceback
+from contextlib import AsyncExitStack
+from dataclasses import replace
+from multiprocessing.queues import Queue
+from socket import socket
+from typing import Callable, Iterable
+
+import uvicorn
+from prometheus_client import multiprocess
+from starlette.types import ASGIApp, Receive, Scope, Send
+from uvicorn.supervisors.multiprocess import Multiprocess, Process
+
+from {{cookiecutter.__project_slug}}.application_context import AppSettings
+from {{cookiecutter.__project_slug}}.main import open_app
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+# Max seconds for a new worker to start during a rolling restart
+WORKER_START_TIMEOUT = 60.0
+
+
+def worker_settings(
+    settings: AppSettings, workers: int, connection_budget: int
+) -> AppSettings:
+    """
+    Settings of each of `workers` processes. Their pools together open at most
+    `connection_budget` connections to each database, 0 for no limit.
+    """
+    if connection_budget <= 0:
+        return settings
+    share = connection_budget // workers
+    if settings.post_cache_size > 0:
+        # The notification listener of the cache has a connection outside the pool
+        share -= 1
+    if share < 1:
+        raise ValueError(
+            f"A budget of {connection_budget} connections is too small "
+            f"for {workers} workers"
+        )
+    pool_size = min(settings.db_pool_size, share)
+    return replace(
+        settings,
+        db_pool_size=pool_size,
+        db_max_overflow=min(settings.db_max_overflow, share - pool_size),
+    )
+
+
+def remove_exited_gauges(metrics_dir: str, running_pids: Iterable[int | None]) -> None:
+    """
+    Removes live gauges (e.g. connection pool gauges) of the workers that are
+    not running anymore, so that they are not summed up with the running ones
+    """
+    running = set(running_pids)
+    for path in glob.glob(os.path.join(metrics_dir, "gauge_live*_*.db")):
+        pid = int(path.removesuffix(".db").rpartition("_")[2])
+        if pid not in running:
+            multiprocess.mark_process_dead(pid, metrics_dir)
+
+
+class WorkerApp:
+    """
+    ASGI app pickled to every worker process.
+
+    On lifespan startup it sets the process up with `setup_process`
+    (logging and sentry are not inherited by spawned processes),
+    opens the app with its own connection pool, see main.open_app,
+    and puts its pid into `started`
+    """
+
+    def __init__(
+        self,
+        settings: AppSettings,
+        setup_process: Callable[[], None],
+        started: "Queue[int] | None" = None,
+    ):
+        self.settings = settings
+        self.setup_process = setup_process
+        self.started = started
+        self._app: ASGIApp | None = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        assert self._app is not None, "Requests are served after lifespan startup"
+        await self._app(scope, receive, send)
+
+    async def _lifespan(self, receive: Receive, send: Send) -> None:
+        await receive()  # lifespan.startup
+        async with AsyncExitStack() as stack:
+            try:
+                self.setup_process()
+                self._app = await stack.enter_async_context(open_app(self.settings))
+            except Exception:
+                logger.exception("Worker failed to start")
+                await send(
+                    {
+                        "type": "lifespan.startup.failed",
+                        "message": traceback.format_exc(),
+                    }
+                )
+                return
+            await send({"type": "lifespan.startup.complete"})
+            if self.started is not None:
+                self.started.put(os.getpid())
+            await receive()  # lifespan.shutdown
+            self._app = None
+        await send({"type": "lifespan.shutdown.complete"})
+
+
+class _Supervisor(Multiprocess):
+    def __init__(
+        self,
+        config: uvicorn.Config,
+        target: Callable[[list[socket] | None], None],
+        sockets: list[socket],
+        metrics_dir: str,
+        started: "Queue[int]",
+    ):
+        super().__init__(config, target, sockets)
+        self.metrics_dir = metrics_dir
+        self.started = started
+        self._started_pids: set[int | None] = set()
+        self.failed_to_start = False
+
+    def restart_all(self) -> None:
+        """
+        Replaces the workers one by one, the old worker is stopped
+        only once the new one has started
+        """
+        for idx, old_process in enumerate(self.processes):
+            new_process = Process(self.config, self.target, self.sockets)
+            new_process.start()
+            if not self._wait_started(new_process):
+                logger.error(
+                    "Worker %s did not start, keeping worker %s and the rest",
+                    new_process.pid,
+                    old_process.pid,
+                )
+                new_process.kill()
+                new_process.join()
+                return
+            old_process.terminate()
+            old_process.join()
+            self.processes[idx] = new_process
+
+    def keep_subprocess_alive(self) -> None:
+        """
+        Replaces dead workers like Multiprocess.keep_subprocess_alive,
+        but stops the supervisor if a worker died before it started:
+        the app cannot start, a new worker would fail all the same
+        """
+        if self.should_exit.is_set():
+            return
+        for idx, process in enumerate(self.processes):
+            if process.is_alive(timeout=self.config.timeout_worker_healthcheck):
+                continue
+            process.kill()
+            process.join()
+            if self.should_exit.is_set():
+                return
+            self._collect_started()
+            if process.pid not in self._started_pids:
+                logger.error(
+                    "Worker %s exited before it started, stopping", process.pid
+                )
+                self.failed_to_start = True
+                self.should_exit.set()
+                return
+            logger.info("Worker %s died, starting a new one", process.pid)
+            self.processes[idx] = Process(self.config, self.target, self.sockets)
+            self.processes[idx].start()
+        # Called periodically, after restarts and dead workers are replaced
+        self._collect_started()
+        running_pids = {process.pid for process in self.processes}
+        self._started_pids &= running_pids
+        remove_exited_gauges(self.metrics_dir, running_pids)
+
+    def _wait_started(self, process: Process) -> bool:
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        while process.pid not in self._started_pids:
+            exiting = any(
+                sig in (signal.SIGINT, signal.SIGTERM) for sig in self.signal_queue
+            )
+            if exiting or not process.process.is_alive() or time.monotonic() > deadline:
+                return False
+            self._collect_started(timeout=0.5)
+        return True
+
+    def _collect_started(self, timeout: float = 0.0) -> None:
+        try:
+            self._started_pids.add(self.started.get(timeout=timeout))
+            while True:
+                self._started_pids.add(self.started.get_nowait())
+        except queue.Empty:
+            pass
+
+
+def run_workers(
+    settings: AppSettings,
+    setup_process: Callable[[], None],
+    workers: int,
+) -> None:
+    """
+    Serves the app with `workers` processes until SIGINT or SIGTERM.
+    Raises RuntimeError if a worker exits before it has started
+
+    settings: settings of each worker, see worker_settings
+    setup_process: called in every worker before it opens the app
+    """
+    metrics_dir = os.environ.get(METRICS_DIR_ENV)
+    temporary_metrics_dir = not metrics_dir
+    if not metrics_dir:
+        metrics_dir = tempfile.mkdtemp(prefix="prometheus_")
+        # Inherited by the workers, prometheus_client reads it on import
+        os.environ[METRICS_DIR_ENV] = metrics_dir
+    else:
+        os.makedirs(metrics_dir, exist_ok=True)
+        # Metrics of a previous run must not be aggregated with the new ones
+        for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+            os.remove(path)
+
+    # uvicorn spawns the workers
+    started: "Queue[int]" = multiprocessing.get_context("spawn").Queue()
+    config = uvicorn.Config(
+        WorkerApp(settings, setup_process, started),
+        host=settings.host,
+        port=settings.port,
+        workers=workers,
+        lifespan="on",
+        log_config=None,
+        access_log=False,
+        timeout_graceful_shutdown=settings.timeout_graceful_shutdown,
+    )
+    try:
+        sock = config.bind_socket()
+        logger.info(
+            "Serving on http://%s:%s with %d workers",
+            settings.host,
+            settings.port,
+            workers,
+        )
+        server = uvicorn.Server(config)
+        supervisor = _Supervisor(config, server.run, [sock], metrics_dir, started)
+        supervisor.run()
+        sock.close()
+        if supervisor.failed_to_start:
+            raise RuntimeError("Workers failed to start, see the errors above")
+    finally:
+        if temporary_metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
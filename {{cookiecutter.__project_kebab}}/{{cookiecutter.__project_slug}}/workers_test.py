@@ -0,0 +1,133 @@
+"""
+Tests of multi-process serving (workers.py)
+"""
+
+import asyncio
+import multiprocessing
+import os
+import pickle
+from dataclasses import replace
+from pathlib import Path
+
+import httpx
+import pytest
+from starlette.types import Message
+
+from .application_context import AppSettings
+from .storage.connection_pool import ConnectionPool
+from .workers import WorkerApp, remove_exited_gauges, worker_settings
+
+
+SETTINGS = AppSettings(
+    db_url="postgresql://localhost/test",
+    host="127.0.0.1",
+    port=8000,
+    root_path="",
+)
+
+
+@pytest.mark.parametrize(
+    "budget, post_cache_size, pool_size, max_overflow",
+    [
+        # No budget keeps the configured pool
+        (0, 0, 5, 10),
+        # 100 / 4 = 25 per worker, more than configured
+        (100, 0, 5, 10),
+        # 40 / 4 = 10 per worker, overflow gets what is left
+        (40, 0, 5, 5),
+        (12, 0, 3, 0),
+        # One connection per worker goes to the cache listener
+        (12, 100, 2, 0),
+    ],
+)
+def test_worker_settings(
+    budget: int, post_cache_size: int, pool_size: int, max_overflow: int
+):
+    settings = worker_settings(
+        replace(SETTINGS, post_cache_size=post_cache_size),
+        workers=4,
+        connection_budget=budget,
+    )
+    assert (settings.db_pool_size, settings.db_max_overflow) == (
+        pool_size,
+        max_overflow,
+    )
+
+
+def test_worker_settings_budget_too_small():
+    with pytest.raises(ValueError):
+        worker_settings(SETTINGS, workers=4, connection_budget=3)
+    with pytest.raises(ValueError):
+        worker_settings(
+            replace(SETTINGS, post_cache_size=100), workers=4, connection_budget=4
+        )
+
+
+def test_remove_exited_gauges(tmp_path: Path):
+    names = [
+        "gauge_livesum_100.db",
+        "gauge_liveall_100.db",
+        "gauge_livesum_200.db",
+        "gauge_all_100.db",
+        "counter_100.db",
+    ]
+    for name in names:
+        (tmp_path / name).touch()
+
+    remove_exited_gauges(str(tmp_path), [200, None])
+
+    assert sorted(os.listdir(tmp_path)) == [
+        "counter_100.db",
+        "gauge_all_100.db",
+        "gauge_livesum_200.db",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_worker_app(db_connection_pool: ConnectionPool):
+    db_url = db_connection_pool.engine.url.render_as_string(hide_password=False)
+    setup_calls: list[bool] = []
+    # Goes to the worker processes with pickle
+    worker_app = pickle.loads(
+        pickle.dumps(WorkerApp(replace(SETTINGS, db_url=db_url), print))
+    )
+    worker_app.setup_process = lambda: setup_calls.append(True)
+    worker_app.started = multiprocessing.get_context("spawn").Queue()
+
+    received: asyncio.Queue[Message] = asyncio.Queue()
+    sent: asyncio.Queue[Message] = asyncio.Queue()
+    lifespan = asyncio.create_task(
+        worker_app({"type": "lifespan"}, received.get, sent.put)
+    )
+
+    await received.put({"type": "lifespan.startup"})
+    assert (await sent.get())["type"] == "lifespan.startup.complete"
+    assert setup_calls == [True]
+    assert worker_app.started.get(timeout=5) == os.getpid()
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=worker_app), base_url="http://test"
+    ) as client:
+        response = await client.get("/health")
+        assert response.status_code == 200
+
+    await received.put({"type": "lifespan.shutdown"})
+    assert (await sent.get())["type"] == "lifespan.shutdown.complete"
+    await lifespan
+
+
+@pytest.mark.asyncio
+async def test_worker_app_startup_failure():
+    def fail() -> None:
+        raise RuntimeError("no config")
+
+    worker_app = WorkerApp(SETTINGS, fail)
+    received: asyncio.Queue[Message] = asyncio.Queue()
+    sent: asyncio.Queue[Message] = asyncio.Queue()
+    await received.put({"type": "lifespan.startup"})
+
+    await worker_app({"type": "lifespan"}, received.get, sent.put)
+
+    failed = sent.get_nowait()
+    assert failed["type"] == "lifespan.startup.failed"
+    assert "no config" in failed["message"]